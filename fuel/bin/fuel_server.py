@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""Fuel data server utility."""
+import argparse
+import importlib
+import os
+
+from six.moves import cPickle
+
+from fuel.datasets import Dataset
+from fuel.server import start_dataset_server, start_server
+
+
+def load_stream(spec):
+    """Load the data stream or dataset to serve.
+
+    Parameters
+    ----------
+    spec : str
+        Either the path to a pickled data stream or dataset, or the
+        import path of a function returning one, e.g.
+        ``my_package.streams:create_stream`` (or equivalently
+        ``my_package.streams.create_stream``), which is called without
+        arguments.
+
+    Returns
+    -------
+    :class:`.AbstractDataStream` or :class:`.Dataset`
+
+    """
+    if os.path.isfile(spec):
+        with open(spec, 'rb') as f:
+            return cPickle.load(f)
+    module_name, separator, name = spec.rpartition(':')
+    if not separator:
+        module_name, _, name = spec.rpartition('.')
+    if not module_name:
+        raise ValueError('{} is neither a file nor the import path of a '
+                         'function'.format(spec))
+    return getattr(importlib.import_module(module_name), name)()
+
+
+def main(args=None):
+    """Entry point for `fuel-server` script.
+
+    This function can also be imported and used from Python.
+
+    Parameters
+    ----------
+    args : iterable, optional (default: None)
+        A list of arguments that will be passed to Fuel's server
+        utility. If this argument is not specified, `sys.argv[1:]` will
+        be used.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Serves a data stream (or dataset) to a training loop '
+                    'running in another process.')
+    parser.add_argument(
+        "stream", help="file containing a pickled data stream or dataset, "
+                       "or import path of a function that returns one, "
+                       "e.g. my_package.streams:create_stream. Datasets "
+                       "are served with start_dataset_server, so that "
+                       "clients can make their own requests; only the "
+                       "--port and --workers options apply to them.")
+    parser.add_argument(
+        "-p", "--port", type=int, default=5557,
+        help="port to serve on (default: 5557)")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1,
+        help="number of worker processes (default: 1)")
+    stream_options = parser.add_argument_group(
+        'data stream options', 'These options only apply when serving a '
+                               'data stream, not a dataset.')
+    stream_options.add_argument(
+        "--hwm", type=int, default=10,
+        help="ZeroMQ high-water mark of the sending socket (default: 10)")
+    stream_options.add_argument(
+        "--shared-memory", action='store_true',
+        help="pass batches through shared memory, for clients on the same "
+             "host")
+    stream_options.add_argument(
+        "--compression", choices=('zlib', 'lz4'), default=None,
+        help="compress batches with this codec")
+    stream_options.add_argument(
+        "--shuffle", action='store_true',
+        help="shuffle the bytes of floating point arrays before compressing "
+             "them")
+    stream_options.add_argument(
+        "--stats-interval", type=float, default=60,
+        help="log the throughput every this many seconds, or never if 0 "
+             "(default: 60)")
+    stream_options.add_argument(
+        "--max-bytes", type=int, default=None,
+        help="limit the size of the batches sent, but not yet received by "
+             "the client, to this many bytes")
+    args = parser.parse_args(args)
+
+    stream = load_stream(args.stream)
+    if isinstance(stream, Dataset):
+        given = ['--' + option.replace('_', '-')
+                 for option in ('hwm', 'shared_memory', 'compression',
+                                'shuffle', 'stats_interval', 'max_bytes')
+                 if getattr(args, option) != parser.get_default(option)]
+        if given:
+            parser.error('{} cannot be used when serving a dataset'.format(
+                ', '.join(given)))
+        start_dataset_server(stream, port=args.port,
+                             num_workers=args.workers)
+    else:
+        start_server(stream, port=args.port, hwm=args.hwm,
+                     num_workers=args.workers,
+                     shared_memory=args.shared_memory,
+                     compression=args.compression, shuffle=args.shuffle,
+                     stats_interval=args.stats_interval or None,
+                     max_bytes=args.max_bytes)
+
+
+if __name__ == "__main__":
+    main()
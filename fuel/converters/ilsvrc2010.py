@@ -1,5 +1,6 @@
 from __future__ import division
 from collections import OrderedDict
+from contextlib import contextmanager
 from functools import partial
 import gzip
 import io
@@ -12,6 +13,7 @@ import numpy
 from picklable_itertools.extras import equizip
 from PIL import Image
 from scipy.io.matlab import loadmat
+import six
 from six.moves import zip, xrange
 import zmq
 
@@ -41,7 +43,7 @@ ALL_FILES = PUBLIC_FILES + IMAGE_TARS
 @check_exists(required_files=ALL_FILES)
 def convert_ilsvrc2010(directory, output_directory,
                        output_filename='ilsvrc2010.hdf5',
-                       shuffle_seed=config.default_seed):
+                       shuffle_seed=config.default_seed, num_producers=1):
     """Converter for data from the ILSVRC 2010 competition.
 
     Source files for this dataset can be obtained by registering at
@@ -59,6 +61,9 @@ def convert_ilsvrc2010(directory, output_directory,
         Seed for a random number generator used to shuffle the order
         of the training set on disk, so that sequential reads will not
         be ordered by class.
+    num_producers : int, optional
+        The number of processes that decode the training set. The
+        layout of the HDF5 file doesn't depend on it. Defaults to 1.
 
     .. [ILSVRC2010WEB] http://image-net.org/challenges/LSVRC/2010/index
 
@@ -76,7 +81,8 @@ def convert_ilsvrc2010(directory, output_directory,
         log.info('Creating HDF5 datasets...')
         prepare_hdf5_file(f, n_train, n_valid, n_test)
         log.info('Processing training set...')
-        process_train_set(f, train, patch, n_train, wnid_map, shuffle_seed)
+        process_train_set(f, train, patch, n_train, wnid_map, shuffle_seed,
+                          num_producers)
         log.info('Processing validation set...')
         process_other_set(f, 'valid', valid, patch, valid_groundtruth, n_train)
         log.info('Processing test set...')
@@ -100,6 +106,10 @@ def fill_subparser(subparser):
         "--shuffle-seed", help="Seed to use for randomizing order of the "
                                "training set on disk.",
         default=config.default_seed, type=int, required=False)
+    subparser.add_argument(
+        "--num-producers", help="Number of processes that decode the "
+                                "training set.",
+        default=1, type=int, required=False)
     return convert_ilsvrc2010
 
 
@@ -202,7 +212,7 @@ def prepare_hdf5_file(hdf5_file, n_train, n_valid, n_test):
 
 
 def process_train_set(hdf5_file, train_archive, patch_archive, n_train,
-                      wnid_map, shuffle_seed=None):
+                      wnid_map, shuffle_seed=None, num_producers=1):
     """Process the ILSVRC2010 training set.
 
     Parameters
@@ -223,13 +233,74 @@ def process_train_set(hdf5_file, train_archive, patch_archive, n_train,
         Seed for a NumPy random number generator that permutes the
         training set on disk. If `None`, no permutation is performed
         (this is the default).
+    num_producers : int, optional
+        The number of processes between which the inner TAR files
+        are divided. Defaults to 1.
 
     """
+    with _restore_position(patch_archive):
+        patch_images = extract_patch_images(patch_archive, 'train')
+    with _restore_position(train_archive):
+        work_units = train_set_work_units(train_archive, patch_images)
     producer = partial(train_set_producer, train_archive=train_archive,
                        patch_archive=patch_archive, wnid_map=wnid_map)
     consumer = partial(image_consumer, hdf5_file=hdf5_file,
                        num_expected=n_train, shuffle_seed=shuffle_seed)
-    producer_consumer(producer, consumer)
+    producer_consumer(producer, consumer, work_units=work_units,
+                      num_producers=num_producers)
+
+
+@contextmanager
+def _restore_position(f):
+    """Seek a file-like object back to where it was after reading it."""
+    if isinstance(f, six.string_types):
+        yield
+        return
+    position = f.tell()
+    try:
+        yield
+    finally:
+        f.seek(position)
+
+
+def train_set_work_units(train_archive, patch_images):
+    """List the inner TAR files of the training set TAR file.
+
+    Parameters
+    ----------
+    train_archive :  str or file-like object
+        Filename or file handle for the TAR archive of training images.
+    patch_images : dict
+        A dictionary whose keys are the filenames (without path) of the
+        patch images for the training set.
+
+    Returns
+    -------
+    work_units : list of tuples
+        For each inner TAR file, its name and the position in the
+        training set of its first image, in the order in which
+        :func:`train_set_producer` sends them.
+
+    Raises
+    ------
+    ValueError
+        If a patch image doesn't replace any image of the training set.
+
+    """
+    work_units = []
+    unused_patches = set(patch_images)
+    position = 0
+    with tar_open(train_archive) as tar:
+        for inner_tar_info in tar:
+            with tar_open(tar.extractfile(inner_tar_info.name)) as inner:
+                work_units.append((inner_tar_info.name, position))
+                for info in inner:
+                    if info.isfile():
+                        unused_patches.discard(os.path.basename(info.name))
+                        position += 1
+    if unused_patches:
+        raise ValueError('not all patch images were used')
+    return work_units
 
 
 def _write_to_hdf5(hdf5_file, index, image_filename, image_data,
@@ -239,7 +310,8 @@ def _write_to_hdf5(hdf5_file, index, image_filename, image_data,
     hdf5_file['targets'][index] = class_index
 
 
-def train_set_producer(socket, train_archive, patch_archive, wnid_map):
+def train_set_producer(socket, train_archive, patch_archive, wnid_map,
+                       work_units=None):
     """Load/send images from the training set TAR file or patch images.
 
     Parameters
@@ -253,12 +325,29 @@ def train_set_producer(socket, train_archive, patch_archive, wnid_map):
     wnid_map : dict
         A dictionary that maps WordNet IDs to 0-based class indices.
         Used to decode the filenames of the inner TAR files.
+    work_units : list of tuples, optional
+        The names of the inner TAR files to send and the positions of
+        their first images, as returned by :func:`train_set_work_units`.
+        By default all inner TAR files are sent.
+
+    Notes
+    -----
+    Each image is sent with its position in the training set, so that
+    the layout on disk doesn't depend on the order in which several
+    producers deliver their images. Whether all patch images were used
+    is only checked when sending all inner TAR files.
 
     """
     patch_images = extract_patch_images(patch_archive, 'train')
+    positions = None if work_units is None else dict(work_units)
+    position = 0
     num_patched = 0
     with tar_open(train_archive) as tar:
         for inner_tar_info in tar:
+            if positions is not None:
+                if inner_tar_info.name not in positions:
+                    continue
+                position = positions[inner_tar_info.name]
             with tar_open(tar.extractfile(inner_tar_info.name)) as inner:
                 wnid = inner_tar_info.name.split('.')[0]
                 class_index = wnid_map[wnid]
@@ -273,9 +362,11 @@ def train_set_producer(socket, train_archive, patch_archive, wnid_map):
                 for image_fn, (image_data, patched) in stream:
                     if patched:
                         num_patched += 1
-                    socket.send_pyobj((image_fn, class_index), zmq.SNDMORE)
+                    socket.send_pyobj((image_fn, class_index, position),
+                                      zmq.SNDMORE)
                     socket.send(image_data)
-    if num_patched != len(patch_images):
+                    position += 1
+    if positions is None and num_patched != len(patch_images):
         raise ValueError('not all patch images were used')
 
 
@@ -300,17 +391,27 @@ def image_consumer(socket, hdf5_file, num_expected, shuffle_seed=None,
         The offset in the HDF5 datasets at which to start writing
         received examples. Defaults to 0.
 
+    Notes
+    -----
+    Images are sent with a `(filename, class_index)` tuple, and are
+    written in the order in which they arrive. If the tuple has a
+    third element, it is used as the position of the image instead.
+
     """
     with progress_bar('images', maxval=num_expected) as pb:
         if shuffle_seed is None:
-            index_gen = iter(xrange(num_expected))
+            permutation = None
         else:
             rng = numpy.random.RandomState(shuffle_seed)
-            index_gen = iter(rng.permutation(num_expected))
-        for i, num in enumerate(index_gen):
-            image_filename, class_index = socket.recv_pyobj(zmq.SNDMORE)
+            permutation = rng.permutation(num_expected)
+        for i in xrange(num_expected):
+            metadata = socket.recv_pyobj(zmq.SNDMORE)
+            image_filename, class_index = metadata[:2]
+            position = metadata[2] if len(metadata) > 2 else i
+            if permutation is not None:
+                position = permutation[position]
             image_data = numpy.fromstring(socket.recv(), dtype='uint8')
-            _write_to_hdf5(hdf5_file, num + offset, image_filename,
+            _write_to_hdf5(hdf5_file, position + offset, image_filename,
                            image_data, class_index)
             pb.update(i + 1)
 
@@ -1,6 +1,7 @@
 import collections
 from abc import ABCMeta, abstractmethod
 
+import numpy
 from six import add_metaclass
 
 from picklable_itertools import iter_, izip
@@ -40,6 +41,11 @@ class Dataset(object):
     example_iteration_scheme : :class:`.IterationScheme` or ``None``
         The iteration scheme the class uses in order to produce a stream of
         examples.
+    supports_slices : bool
+        Whether :meth:`get_data` accepts a slice of example indices and
+        returns the same data as requesting each example in turn and
+        stacking the results. :class:`.Batch` uses this to read batches
+        of examples in a single request.
     default_transformers: It is expected to be a tuple with one element per
         transformer in the pipeline. Each element is a tuple with three
         elements:
@@ -58,6 +64,7 @@ class Dataset(object):
 
     """
     provides_sources = None
+    supports_slices = False
     default_transformers = tuple()
 
     def __init__(self, sources=None, axis_labels=None):
@@ -381,6 +388,15 @@ class IndexableDataset(Dataset):
     def num_examples(self):
         return len(self.indexables[0])
 
+    @property
+    def supports_slices(self):
+        # Arbitrary indexables might only accept integers, and slicing an
+        # object array doesn't stack its elements the way a list would
+        return all(isinstance(indexable, (list, tuple)) or
+                   (isinstance(indexable, numpy.ndarray) and
+                    indexable.dtype != object)
+                   for indexable in self.indexables)
+
     def get_data(self, state=None, request=None):
         if state is not None or request is None:
             raise ValueError
@@ -1,4 +1,5 @@
 import numbers
+import sys
 from itertools import product
 from collections import defaultdict
 
@@ -9,7 +10,7 @@ import tables
 from six.moves import zip, range
 
 from fuel.datasets import Dataset
-from fuel.utils import do_not_pickle_attributes, Subset
+from fuel.utils import do_not_pickle_attributes, LRUCache, Subset
 from fuel.schemes import SequentialExampleScheme
 
 
@@ -90,7 +91,8 @@ class PytablesDataset(Dataset):
 
 
 @do_not_pickle_attributes('data_sources', 'external_file_handle',
-                          'source_shapes', 'in_memory_subset', 'subsets')
+                          'source_shapes', 'in_memory_subset', 'subsets',
+                          'in_memory_sources', 'example_cache')
 class H5PYDataset(Dataset):
     """An h5py-fueled HDF5 dataset.
 
@@ -130,8 +132,12 @@ class H5PYDataset(Dataset):
         Which subset of data to use *within the context of the split*.
         Can be either a slice or a list of indices. Defaults to `None`,
         in which case the whole split is used.
-    load_in_memory : bool, optional
-        Whether to load the data in main memory. Defaults to `False`.
+    load_in_memory : bool or tuple of str or int, optional
+        Whether to load the data in main memory. Defaults to `False`. A
+        tuple of source names only loads those sources, while the other
+        ones are read from the file when requested. An integer is a
+        budget in bytes: as many sources as fit in it are loaded,
+        smallest first (variable-length sources are never counted in).
     driver : str, optional
         Low-level driver to use. Defaults to `None`. See h5py
         documentation for a complete list of available options.
@@ -144,6 +150,23 @@ class H5PYDataset(Dataset):
         performance, set this flag to `False`. Note that in that case,
         it is the user's responsibility to make sure that indices are
         ordered.
+    memory_map : bool, optional
+        If `True`, sources that are stored contiguously and uncompressed
+        are read through a read-only memory map of the file instead of
+        through h5py. Slices of them are then returned without copying
+        (and can't be written to), and all processes reading the file
+        share the operating system's page cache. Other sources are read
+        as usual. Only applies to files opened by path with the default
+        driver, and not when loading the data in memory. Defaults to
+        `False`.
+    cache_size : int, optional
+        If given, the examples read from the file are kept in a cache of
+        at most this many bytes, and examples that are requested again
+        are served from memory until they are evicted (least recently
+        used first). Useful for datasets that don't quite fit in memory.
+        The size of an example includes a few hundred bytes for the
+        Python objects holding it. Each process reading the dataset has
+        its own cache. By default, examples aren't cached.
 
     Attributes
     ----------
@@ -157,6 +180,12 @@ class H5PYDataset(Dataset):
         examples.
     vlen_sources : tuple of strings
         All sources provided by this dataset which have variable length.
+    in_memory_sources : tuple of strings
+        The requested sources which are loaded in memory.
+    example_cache : :class:`.LRUCache` or ``None``
+        The cache of examples read from the file, if `cache_size` is
+        given. Its `hits` and `misses` count the examples that were and
+        weren't found in it.
     default_axis_labels : dict mapping string to tuple of strings
         Maps all sources provided by this dataset to their axis labels.
 
@@ -164,10 +193,11 @@ class H5PYDataset(Dataset):
     interface_version = '0.3'
     _ref_counts = defaultdict(int)
     _file_handles = {}
+    _memory_maps = {}
 
     def __init__(self, file_or_path, which_sets, subset=None,
                  load_in_memory=False, driver=None, sort_indices=True,
-                 **kwargs):
+                 memory_map=False, cache_size=None, **kwargs):
         if isinstance(file_or_path, h5py.File):
             self.path = file_or_path.filename
             self.external_file_handle = file_or_path
@@ -184,6 +214,8 @@ class H5PYDataset(Dataset):
         self.load_in_memory = load_in_memory
         self.driver = driver
         self.sort_indices = sort_indices
+        self.memory_map = memory_map
+        self.cache_size = cache_size
 
         self._parse_dataset_info()
 
@@ -472,11 +504,19 @@ class H5PYDataset(Dataset):
         self.subsets = [Subset.subset_of(subset, self.user_given_subset)
                         for subset in subsets]
 
+        self.in_memory_sources = self._get_in_memory_sources(handle)
+        self.example_cache = (LRUCache(self.cache_size) if self.cache_size
+                              else None)
+
         # Load data sources and source shapes (if requested)
-        if self.load_in_memory:
+        if self.in_memory_sources:
             data_sources = []
             source_shapes = []
             for source_name, subset in zip(self.sources, self.subsets):
+                if source_name not in self.in_memory_sources:
+                    data_sources.append(None)
+                    source_shapes.append(None)
+                    continue
                 data_sources.append(
                     subset.index_within_subset(
                         handle[source_name], slice(None)))
@@ -490,8 +530,7 @@ class H5PYDataset(Dataset):
             self.data_sources = tuple(data_sources)
             self.source_shapes = tuple(source_shapes)
             # This exists only for request sanity checking purposes.
-            self.in_memory_subset = Subset(
-                slice(None), len(self.data_sources[0]))
+            self.in_memory_subset = Subset(slice(None), self.num_examples)
         else:
             self.data_sources = None
             self.source_shapes = None
@@ -499,12 +538,64 @@ class H5PYDataset(Dataset):
 
         self._out_of_memory_close()
 
+    def _get_in_memory_sources(self, handle):
+        """Determine which sources `load_in_memory` asks to load."""
+        if isinstance(self.load_in_memory, bool):
+            return self.sources if self.load_in_memory else ()
+        if isinstance(self.load_in_memory, numbers.Integral):
+            sizes = []
+            for source_name, subset in zip(self.sources, self.subsets):
+                if source_name in self.vlen_sources:
+                    continue
+                node = handle[source_name]
+                sizes.append((subset.num_examples * node.dtype.itemsize *
+                              int(numpy.prod(node.shape[1:])), source_name))
+            in_memory_sources = []
+            budget = self.load_in_memory
+            for size, source_name in sorted(sizes):
+                if size > budget:
+                    break
+                in_memory_sources.append(source_name)
+                budget -= size
+            return tuple(source_name for source_name in self.sources
+                         if source_name in in_memory_sources)
+        if not all(source_name in self.provides_sources
+                   for source_name in self.load_in_memory):
+            raise ValueError("unable to load unknown sources in memory")
+        return tuple(source_name for source_name in self.sources
+                     if source_name in self.load_in_memory)
+
     @property
     def num_examples(self):
         return self.subsets[0].num_examples
 
+    @property
+    def supports_slices(self):
+        return not any(source in self.vlen_sources for source in self.sources)
+
+    @property
+    def chunk_size(self):
+        """The number of examples in each HDF5 chunk.
+
+        If the sources are chunked differently, the largest chunk is
+        returned. `None` if none of the sources are chunked.
+
+        """
+        self._out_of_memory_open()
+        try:
+            chunks = [self._file_handle[source_name].chunks
+                      for source_name in self.sources]
+        finally:
+            self._out_of_memory_close()
+        chunk_sizes = [chunk[0] for chunk in chunks if chunk is not None]
+        return max(chunk_sizes) if chunk_sizes else None
+
+    @property
+    def _reads_file(self):
+        return len(self.in_memory_sources) < len(self.sources)
+
     def open(self):
-        return None if self.load_in_memory else self._out_of_memory_open()
+        return self._out_of_memory_open() if self._reads_file else None
 
     def _out_of_memory_open(self):
         if not self.external_file_handle:
@@ -515,7 +606,7 @@ class H5PYDataset(Dataset):
             self._ref_counts[self.path] += 1
 
     def close(self, state):
-        if not self.load_in_memory:
+        if self._reads_file:
             self._out_of_memory_close()
 
     def _out_of_memory_close(self):
@@ -525,6 +616,30 @@ class H5PYDataset(Dataset):
                 del self._ref_counts[self.path]
                 self._file_handles[self.path].close()
                 del self._file_handles[self.path]
+                self._memory_maps.pop(self.path, None)
+
+    def _get_memory_map(self, source_name):
+        """Returns a memory map of a source, or `None` if it can't be mapped.
+
+        Only sources stored contiguously and without filters can be mapped,
+        since their data is a plain array at some offset of the file.
+
+        """
+        if (self.external_file_handle or
+                self.driver not in (None, 'sec2', 'stdio')):
+            return None
+        memory_maps = self._memory_maps.setdefault(self.path, {})
+        if source_name not in memory_maps:
+            node = self._file_handle[source_name]
+            offset = node.id.get_offset()
+            if (node.chunks is not None or node.dtype.hasobject or
+                    offset is None or not node.size):
+                memory_maps[source_name] = None
+            else:
+                memory_maps[source_name] = numpy.asarray(numpy.memmap(
+                    self.path, dtype=node.dtype, mode='r', offset=offset,
+                    shape=node.shape))
+        return memory_maps[source_name]
 
     @property
     def _file_handle(self):
@@ -536,10 +651,17 @@ class H5PYDataset(Dataset):
             raise IOError('no open handle for file {}'.format(self.path))
 
     def get_data(self, state=None, request=None):
-        if self.load_in_memory:
+        if not self._reads_file:
             data, shapes = self._in_memory_get_data(state, request)
-        else:
+        elif not self.in_memory_sources:
             data, shapes = self._out_of_memory_get_data(state, request)
+        else:
+            data, shapes = self._in_memory_get_data(state, request)
+            file_data, file_shapes = self._out_of_memory_get_data(
+                state, request)
+            for i, source_name in enumerate(self.sources):
+                if source_name not in self.in_memory_sources:
+                    data[i], shapes[i] = file_data[i], file_shapes[i]
         for i in range(len(data)):
             if shapes[i] is not None:
                 if isinstance(request, numbers.Integral):
@@ -553,6 +675,7 @@ class H5PYDataset(Dataset):
         if state is not None or request is None:
             raise ValueError
         data = [self.in_memory_subset.index_within_subset(data_source, request)
+                if data_source is not None else None
                 for data_source in self.data_sources]
         shapes = [self.in_memory_subset.index_within_subset(shape, request)
                   if shape is not None else None
@@ -562,16 +685,86 @@ class H5PYDataset(Dataset):
     def _out_of_memory_get_data(self, state=None, request=None):
         if not isinstance(request, (numbers.Integral, slice, list)):
             raise ValueError()
+        if self.example_cache is not None:
+            return self._cached_get_data(request)
+        return self._read_file(request)
+
+    def _cached_get_data(self, request):
+        """Serves examples from the example cache, reading missing ones."""
+        if isinstance(request, numbers.Integral):
+            indices = [request]
+        elif isinstance(request, slice):
+            indices = list(range(*request.indices(self.num_examples)))
+        else:
+            indices = request
+        self.subsets[0].check_request(request)
+        cache = self.example_cache
+        examples = [cache.get(index) for index in indices]
+        missing = sorted(set(index for index, example
+                             in zip(indices, examples) if example is None))
+        if missing:
+            missing_data, missing_shapes = self._read_file(missing)
+            read = {}
+            for j, index in enumerate(missing):
+                example = tuple(
+                    None if source_data is None else
+                    (source_data[j].copy(),
+                     None if source_shapes is None else
+                     source_shapes[j].copy())
+                    for source_data, source_shapes
+                    in zip(missing_data, missing_shapes))
+                # The sizes of the copies include their array objects
+                nbytes = sum(sys.getsizeof(value) +
+                             (0 if shape is None else sys.getsizeof(shape))
+                             for value, shape in filter(None, example))
+                cache.put(index, example, nbytes)
+                read[index] = example
+            examples = [read[index] if example is None else example
+                        for index, example in zip(indices, examples)]
+        # Cached arrays are copied, so that changing the data returned in
+        # place doesn't change the cache
+        data = []
+        shapes = []
+        for i, source_name in enumerate(self.sources):
+            if source_name in self.in_memory_sources:
+                data.append(None)
+                shapes.append(None)
+            elif isinstance(request, numbers.Integral):
+                value, shape = examples[0][i]
+                data.append(value.copy())
+                shapes.append(None if shape is None else shape.copy())
+            elif source_name in self.vlen_sources:
+                source_data = numpy.empty(len(examples), dtype=object)
+                for j, example in enumerate(examples):
+                    source_data[j] = example[i][0].copy()
+                data.append(source_data)
+                shapes.append(numpy.asarray(
+                    [example[i][1] for example in examples]))
+            else:
+                data.append(numpy.asarray(
+                    [example[i][0] for example in examples]))
+                shapes.append(None)
+        return data, shapes
+
+    def _read_file(self, request):
         data = []
         shapes = []
         handle = self._file_handle
         for source_name, subset in zip(self.sources, self.subsets):
+            if source_name in self.in_memory_sources:
+                data.append(None)
+                shapes.append(None)
+                continue
+            node = None
+            if self.memory_map:
+                node = self._get_memory_map(source_name)
+            if node is None:
+                node = handle[source_name]
             # Process the data request within the context of the data source
             # subset
             data.append(
                 subset.index_within_subset(
-                    handle[source_name], request,
-                    sort_indices=self.sort_indices))
+                    node, request, sort_indices=self.sort_indices))
             # If this source has variable length, get the shapes as well
             if source_name in self.vlen_sources:
                 shapes.append(
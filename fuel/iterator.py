@@ -1,5 +1,15 @@
+import sys
+
 import six
 
+# Asynchronous iteration (StopAsyncIteration, loop.create_future) needs
+# Python 3.5, although asyncio itself is available on 3.4
+if sys.version_info >= (3, 5):
+    import asyncio
+    ASYNCIO_AVAILABLE = True
+else:
+    ASYNCIO_AVAILABLE = False
+
 
 class DataIterator(six.Iterator):
     """An iterator over data, representing a single epoch.
@@ -34,3 +44,66 @@ class DataIterator(six.Iterator):
             return dict(zip(self.data_stream.sources, data))
         else:
             return data
+
+
+def _next_or_stop(iterator):
+    # StopIteration can't be passed through a future
+    try:
+        return False, next(iterator)
+    except StopIteration:
+        return True, None
+
+
+class AsyncDataIterator(object):
+    """An asynchronous iterator over data, representing a single epoch.
+
+    Supports ``async for`` loops. Each item is read from a regular
+    iterator in an executor, so that reading doesn't block the event
+    loop. Requires :mod:`asyncio` (Python 3.5 or later).
+
+    Parameters
+    ----------
+    iterator : iterator
+        The iterator over the epoch, e.g. a :class:`DataIterator`. Only
+        one item is read at a time.
+    loop : :class:`asyncio.AbstractEventLoop`, optional
+        The event loop to run on. Defaults to the current event loop.
+    executor : :class:`concurrent.futures.Executor`, optional
+        The executor to read items in. Defaults to the loop's default
+        executor.
+
+    """
+    def __init__(self, iterator, loop=None, executor=None):
+        if not ASYNCIO_AVAILABLE:
+            raise ImportError("asynchronous iteration requires Python 3.5 "
+                              "or later")
+        self.iterator = iterator
+        self.loop = loop
+        self.executor = executor
+
+    def __aiter__(self):
+        return self
+
+    def _get_loop(self):
+        if self.loop is not None:
+            return self.loop
+        return asyncio.get_event_loop()
+
+    def __anext__(self):
+        loop = self._get_loop()
+        future = loop.create_future()
+
+        def done(read):
+            if future.cancelled():
+                return
+            if read.exception() is not None:
+                future.set_exception(read.exception())
+                return
+            stop, data = read.result()
+            if stop:
+                future.set_exception(StopAsyncIteration())
+            else:
+                future.set_result(data)
+        loop.run_in_executor(self.executor, _next_or_stop,
+                             self.iterator).add_done_callback(done)
+        return future
@@ -1,8 +1,9 @@
+import sys
 from abc import ABCMeta, abstractmethod
 from collections import Iterable
 
 import numpy
-from picklable_itertools import chain, repeat, imap, iter_
+from picklable_itertools import chain, repeat, imap, iter_, islice
 from picklable_itertools.extras import partition_all
 from six import add_metaclass
 from six.moves import xrange
@@ -124,6 +125,49 @@ class ConcatenatedScheme(IterationScheme):
         return self.schemes[0].requests_examples
 
 
+class PartitionedScheme(IterationScheme):
+    """Iterate over a single partition of another scheme's requests.
+
+    The requests of the wrapped scheme are dealt out in turn, so partition
+    ``i`` receives requests ``i``, ``i + num_partitions``, etc. Useful for
+    dividing the work of an epoch between several workers, each of which
+    iterates over its own partition.
+
+    Parameters
+    ----------
+    scheme : :class:`IterationScheme`
+        The scheme whose requests are partitioned.
+    num_partitions : int
+        The total number of partitions.
+    partition : int
+        The partition to iterate over, between 0 and
+        ``num_partitions - 1``.
+
+    Notes
+    -----
+    The partitions are only disjoint if all copies of the wrapped scheme
+    produce the same requests. For stochastic schemes this means that the
+    copies must share the same random state.
+
+    """
+    def __init__(self, scheme, num_partitions, partition):
+        if not 0 <= partition < num_partitions:
+            raise ValueError('partition must be between 0 and {}, got {} '
+                             'instead'.format(num_partitions - 1, partition))
+        self.scheme = scheme
+        self.num_partitions = num_partitions
+        self.partition = partition
+
+    def get_request_iterator(self):
+        # The picklable islice doesn't accept None as the stop argument
+        return islice(self.scheme.get_request_iterator(), self.partition,
+                      sys.maxsize, self.num_partitions)
+
+    @property
+    def requests_examples(self):
+        return self.scheme.requests_examples
+
+
 @add_metaclass(ABCMeta)
 class IndexScheme(IterationScheme):
     """Iteration schemes that return single indices.
@@ -229,6 +273,50 @@ class ShuffledScheme(BatchScheme):
             return imap(list, partition_all(self.batch_size, indices))
 
 
+class ShuffledBlockScheme(BatchScheme):
+    """Shuffled blocks iterator.
+
+    Iterate over contiguous blocks of examples in shuffled order. Each
+    block is read sequentially, so a dataset stored on disk in chunks can
+    be read a chunk at a time instead of all over the file. Combine it
+    with the :class:`.BlockShuffle` transformer to shuffle the examples
+    of several blocks into batches.
+
+    Parameters
+    ----------
+    examples : int or list
+        Defines which examples from the dataset are iterated.
+        If list, its items are the indices of examples.
+        If an integer, it will use that many examples from the beginning
+        of the dataset, i.e. it is interpreted as range(examples)
+    block_size : int
+        The number of examples in each block, e.g. the number of
+        examples in an HDF5 chunk.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random state used to shuffle the blocks.
+
+    Notes
+    -----
+    The block size isn't enforced, so the last block could be smaller.
+
+    """
+    def __init__(self, examples, block_size, rng=None):
+        self.rng = rng
+        if self.rng is None:
+            self.rng = numpy.random.RandomState(config.default_seed)
+        super(ShuffledBlockScheme, self).__init__(examples, block_size)
+
+    @property
+    def block_size(self):
+        return self.batch_size
+
+    def get_request_iterator(self):
+        blocks = list(imap(list, partition_all(self.batch_size,
+                                               self.indices)))
+        self.rng.shuffle(blocks)
+        return iter_(blocks)
+
+
 class BalancedSamplingScheme(ShuffledScheme):
     """Balanced sampling batches iterator.
 
@@ -1,15 +1,221 @@
+import json
 import logging
+import numbers
+import os
+import struct
+import time
+import zlib
+from multiprocessing import Process
 
 import numpy
 import zmq
-from numpy.lib.format import header_data_from_array_1_0
+from numpy.lib.format import dtype_to_descr, header_data_from_array_1_0
+from zmq.utils.monitor import recv_monitor_message
 
 from fuel.utils import buffer_
+from fuel.utils.parallel import (SeedSequence, partition_stream,
+                                 reseed_stream)
+from fuel.utils.shared_memory import (SharedMemoryRing, read_shared_memory,
+                                      remove_on_sigterm)
+
+try:
+    import lz4.block
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# The codecs arrays can be compressed with. zlib uses its fastest level,
+# since compression only pays off if it keeps up with the network.
+_compressors = {'zlib': lambda data: zlib.compress(data, 1)}
+_decompressors = {'zlib': zlib.decompress}
+if LZ4_AVAILABLE:
+    _compressors['lz4'] = lz4.block.compress
+    _decompressors['lz4'] = lz4.block.decompress
+
+# The first byte of a packed binary header, which a JSON object can't
+# start with, followed by the size of its schema
+_BINARY_HEADER = b'\x00'
+_SCHEMA_SIZE = struct.Struct('<H')
+
+# The schemas of the binary headers sent and received by this process
+_packing_schemas = {}
+_unpacking_schemas = {}
+
+
+def _check_compression(compression):
+    """Check whether arrays can be compressed with a given codec.
+
+    Parameters
+    ----------
+    compression : str or None
+        The name of the codec, either ``'zlib'`` or ``'lz4'``, or `None`.
+
+    Raises
+    ------
+    ValueError
+        If the codec is unknown.
+    ImportError
+        If the codec requires a package that is not installed.
+
+    """
+    if compression is None or compression in _compressors:
+        return
+    if compression == 'lz4':
+        raise ImportError("the lz4 package is required for lz4 compression")
+    raise ValueError("unknown compression codec: {}".format(compression))
+
+
+def _shuffle(array):
+    """Group the bytes of the elements of a float array by significance.
+
+    The exponents and high-order bytes of floating point numbers tend to
+    be similar, so grouping them together exposes more redundancy. Other
+    arrays are returned as is.
+
+    """
+    if array.dtype.kind != 'f' or array.dtype.itemsize == 1:
+        return buffer_(array), False
+    bytes_ = array.reshape(-1).view(numpy.uint8)
+    return numpy.ascontiguousarray(
+        bytes_.reshape((-1, array.dtype.itemsize)).T).tobytes(), True
+
+
+def _unshuffle(data, dtype):
+    """Inverse of :func:`_shuffle`."""
+    bytes_ = numpy.frombuffer(data, dtype=numpy.uint8)
+    return numpy.ascontiguousarray(
+        bytes_.reshape((dtype.itemsize, -1)).T).view(dtype).reshape(-1)
+
+
+def _descr_to_dtype(descr):
+    """Create a data type from its ``.npy`` description.
+
+    The descriptions of structured data types are lists of tuples, which
+    need to be restored after they have been sent as JSON.
 
-def send_arrays(socket, arrays, stop=False):
+    """
+    if not isinstance(descr, list):
+        return numpy.dtype(descr)
+    fields = []
+    for field in descr:
+        name = tuple(field[0]) if isinstance(field[0], list) else field[0]
+        fields.append((name, _descr_to_dtype(field[1])) +
+                      tuple(tuple(shape) for shape in field[2:]))
+    return numpy.dtype(fields)
+
+
+def _pack_header(metadata, arrays, compression, shuffled):
+    """Pack the header of a batch into a compact binary format.
+
+    Parameters
+    ----------
+    metadata : dict
+        The metadata of the batch.
+    arrays : list
+        The C-contiguous :class:`numpy.ndarray` in the batch.
+    compression : str or None
+        The codec the arrays are compressed with.
+    shuffled : list
+        For each array, whether its bytes were shuffled before compression.
+
+    Returns
+    -------
+    bytes or None
+        The packed header, or `None` if the metadata contains anything
+        but integers.
+
+    Notes
+    -----
+    The header consists of the schema of the batch, a small JSON object
+    with the names of the metadata, and the data type and number of
+    dimensions of the arrays, followed by the metadata and the shapes of
+    the arrays as 64-bit integers. The schema is only encoded once, and
+    only decoded once by the receiver, as long as it doesn't change.
+
+    """
+    keys = tuple(sorted(metadata))
+    values = [metadata[key] for key in keys]
+    if not all(isinstance(value, numbers.Integral) and
+               not isinstance(value, bool) for value in values):
+        return None
+    key = (keys, compression,
+           tuple((array.dtype, array.ndim, array_shuffled)
+                 for array, array_shuffled in zip(arrays, shuffled)))
+    if key not in _packing_schemas:
+        schema = json.dumps({
+            'metadata': keys,
+            'arrays': [{'descr': dtype_to_descr(array.dtype),
+                        'ndim': array.ndim,
+                        'compression': compression,
+                        'shuffle': array_shuffled}
+                       for array, array_shuffled in zip(arrays, shuffled)]
+        }).encode('utf-8')
+        values_struct = struct.Struct('<{}q'.format(
+            len(keys) + sum(array.ndim for array in arrays)))
+        _packing_schemas[key] = (
+            _BINARY_HEADER + _SCHEMA_SIZE.pack(len(schema)) + schema,
+            values_struct)
+    prefix, values_struct = _packing_schemas[key]
+    for array in arrays:
+        values.extend(array.shape)
+    return prefix + values_struct.pack(*values)
+
+
+def _unpack_header(header):
+    """Unpack a header packed by :func:`_pack_header`.
+
+    Returns
+    -------
+    metadata : dict
+        The metadata of the batch.
+    arrays : list
+        For each array, a tuple of its data type, shape, the codec it was
+        compressed with and whether its bytes were shuffled.
+
+    """
+    schema_start = 1 + _SCHEMA_SIZE.size
+    schema_size, = _SCHEMA_SIZE.unpack_from(header, 1)
+    schema = header[schema_start:schema_start + schema_size]
+    if schema not in _unpacking_schemas:
+        description = json.loads(schema.decode('utf-8'))
+        arrays = [(_descr_to_dtype(array['descr']), array['ndim'],
+                   array['compression'], array['shuffle'])
+                  for array in description['arrays']]
+        values_struct = struct.Struct('<{}q'.format(
+            len(description['metadata']) +
+            sum(ndim for _, ndim, _, _ in arrays)))
+        _unpacking_schemas[schema] = (
+            description['metadata'], arrays, values_struct)
+    keys, arrays, values_struct = _unpacking_schemas[schema]
+    values = values_struct.unpack_from(header, schema_start + schema_size)
+    metadata = dict(zip(keys, values[:len(keys)]))
+    shapes_start, array_descriptions = len(keys), []
+    for dtype, ndim, compression, shuffled in arrays:
+        shape = values[shapes_start:shapes_start + ndim]
+        array_descriptions.append((dtype, shape, compression, shuffled))
+        shapes_start += ndim
+    return metadata, array_descriptions
+
+
+def _recv_array(socket, dtype, shape, compression, shuffled):
+    """Receive an array sent over the socket by :func:`send_arrays`."""
+    data = socket.recv()
+    if compression is not None:
+        _check_compression(compression)
+        data = _decompressors[compression](data)
+    if shuffled:
+        array = _unshuffle(data, dtype)
+    else:
+        buf = buffer_(data)
+        array = numpy.frombuffer(buf, dtype=dtype)
+    array.shape = shape
+    return array
+
+
+def send_arrays(socket, arrays, stop=False, metadata=None, ring=None,
+                compression=None, shuffle=False):
     """Send NumPy arrays using the buffer interface and some metadata.
 
     Parameters
@@ -20,29 +226,154 @@ def send_arrays(socket, arrays, stop=False):
         A list of :class:`numpy.ndarray` to transfer.
     stop : bool, optional
         Instead of sending a series of NumPy arrays, send a JSON object
-        with a single `stop` key. The :func:`recv_arrays` will raise
+        with a `stop` key. The :func:`recv_arrays` will raise
         ``StopIteration`` when it receives this.
+    metadata : dict, optional
+        Additional JSON-serializable information to send along with the
+        arrays, e.g. the epoch and index of the batch. It is returned by
+        :func:`recv_message`.
+    ring : :class:`.SharedMemoryRing`, optional
+        If given, the arrays are written to shared memory if possible, and
+        only their location is sent.
+    compression : str, optional
+        The codec to compress the arrays with when they are sent over the
+        socket, ``'zlib'`` or ``'lz4'`` (requires the `lz4` package).
+        Defaults to `None`, i.e. no compression.
+    shuffle : bool, optional
+        If `True`, the bytes of compressed floating point arrays are
+        grouped by significance first, which compresses continuous values
+        better, but values with few distinct bit patterns (e.g. rescaled
+        pixels) worse. Defaults to `False`.
+
+    Returns
+    -------
+    int
+        The number of bytes of array data sent over the socket, after
+        compression.
 
     Notes
     -----
-    The protocol is very simple: A single JSON object describing the array
-    format (using the same specification as ``.npy`` files) is sent first.
-    Subsequently the arrays are sent as bytestreams (through NumPy's
-    support of the buffering protocol).
+    The protocol is very simple: A single JSON object is sent first. Its
+    `arrays` key holds a list describing the format of each array (using
+    the same specification as ``.npy`` files), and the remaining keys hold
+    the metadata. Subsequently the arrays are sent as bytestreams (through
+    NumPy's support of the buffering protocol). When the arrays are
+    written to shared memory, the JSON object's `shared_memory` key holds
+    the file and slot they were written to, the description of each array
+    holds its offset in the file, and no bytestreams follow. Compressed
+    arrays are described by the additional `compression` and `shuffle`
+    keys, so that the receiver can decompress them without being told the
+    codec in advance.
+
+    If all metadata are integers, the JSON object is replaced by a packed
+    binary header holding the same information (see :func:`_pack_header`),
+    which is much cheaper to encode and decode for small batches.
 
     """
-    if arrays:
-        # The buffer protocol only works on contiguous arrays
-        arrays = [numpy.ascontiguousarray(array) for array in arrays]
+    header = dict(metadata) if metadata else {}
     if stop:
-        headers = {'stop': True}
-        socket.send_json(headers)
+        header['stop'] = True
+        socket.send_json(header)
+        return 0
+    # The buffer protocol only works on contiguous arrays
+    arrays = [numpy.ascontiguousarray(array) for array in arrays]
+    if ring is not None:
+        slot, offsets = ring.write(arrays)
+        if slot is not None:
+            header['arrays'] = [header_data_from_array_1_0(array)
+                                for array in arrays]
+            header['shared_memory'] = {'path': ring.path, 'slot': slot}
+            for array_header, offset in zip(header['arrays'], offsets):
+                array_header['offset'] = offset
+            socket.send_json(header)
+            return 0
+    frames, shuffled = arrays, [False] * len(arrays)
+    if compression is not None:
+        _check_compression(compression)
+        frames, shuffled = [], []
+        for array in arrays:
+            if shuffle:
+                data, array_shuffled = _shuffle(array)
+            else:
+                data, array_shuffled = buffer_(array), False
+            frames.append(_compressors[compression](data))
+            shuffled.append(array_shuffled)
+    packed_header = _pack_header(header, arrays, compression, shuffled)
+    if packed_header is not None:
+        socket.send(packed_header, zmq.SNDMORE)
     else:
-        headers = [header_data_from_array_1_0(array) for array in arrays]
-        socket.send_json(headers, zmq.SNDMORE)
-        for array in arrays[:-1]:
-            socket.send(array, zmq.SNDMORE)
-        socket.send(arrays[-1])
+        header['arrays'] = [header_data_from_array_1_0(array)
+                            for array in arrays]
+        if compression is not None:
+            for array_header, array_shuffled in zip(header['arrays'],
+                                                    shuffled):
+                array_header['compression'] = compression
+                array_header['shuffle'] = array_shuffled
+        socket.send_json(header, zmq.SNDMORE)
+    for frame in frames[:-1]:
+        socket.send(frame, zmq.SNDMORE)
+    socket.send(frames[-1])
+    return sum(len(frame) if compression is not None else frame.nbytes
+               for frame in frames)
+
+
+def recv_message(socket):
+    """Receive a list of NumPy arrays along with their metadata.
+
+    Parameters
+    ----------
+    socket : :class:`zmq.Socket`
+        The socket to receive the arrays on.
+
+    Returns
+    -------
+    metadata : dict
+        The metadata passed to :func:`send_arrays`. Contains the key
+        `stop` if the message signifies the end of an epoch, and the key
+        `error` if the server failed to answer a request.
+    arrays : list or None
+        A list of :class:`numpy.ndarray` objects, or `None` if the message
+        signifies the end of an epoch or an error.
+
+    Notes
+    -----
+    Arrays received through shared memory are read-only views of the
+    shared memory, and their slot is only released once they are garbage
+    collected. Keeping them around for long can exhaust the slots, in
+    which case the sender falls back to sending batches over the socket.
+
+    """
+    frame = socket.recv()
+    if frame[:1] == _BINARY_HEADER:
+        metadata, array_descriptions = _unpack_header(frame)
+        return metadata, [_recv_array(socket, *array_description)
+                          for array_description in array_descriptions]
+    header = json.loads(frame.decode('utf-8'))
+    if header.get('stop') or 'error' in header:
+        return header, None
+    shared_memory = header.pop('shared_memory', None)
+    if shared_memory:
+        # All arrays are views of this one
+        base = read_shared_memory(shared_memory['path'],
+                                  shared_memory['slot'])
+    arrays = []
+    for array_header in header.pop('arrays'):
+        dtype = _descr_to_dtype(array_header['descr'])
+        if shared_memory:
+            offset = array_header['offset']
+            nbytes = dtype.itemsize * int(numpy.prod(array_header['shape']))
+            array = base[offset:offset + nbytes].view(dtype)
+            array.flags.writeable = False
+        else:
+            array = _recv_array(
+                socket, dtype, array_header['shape'],
+                array_header.get('compression'), array_header.get('shuffle'))
+        array.shape = array_header['shape']
+        if array_header['fortran_order']:
+            array.shape = array_header['shape'][::-1]
+            array = array.transpose()
+        arrays.append(array)
+    return header, arrays
 
 
 def recv_arrays(socket):
@@ -65,23 +396,380 @@ def recv_arrays(socket):
         signifying that the server has finished a single epoch.
 
     """
-    headers = socket.recv_json()
-    if 'stop' in headers:
+    _, arrays = recv_message(socket)
+    if arrays is None:
         raise StopIteration
-    arrays = []
-    for header in headers:
-        data = socket.recv()
-        buf = buffer_(data)
-        array = numpy.frombuffer(buf, dtype=numpy.dtype(header['descr']))
-        array.shape = header['shape']
-        if header['fortran_order']:
-            array.shape = header['shape'][::-1]
-            array = array.transpose()
-        arrays.append(array)
     return arrays
 
 
-def start_server(data_stream, port=5557, hwm=10):
+def send_request(socket, request, request_id):
+    """Send a request for data to a server started by
+    :func:`start_dataset_server`.
+
+    Parameters
+    ----------
+    socket : :class:`zmq.Socket`
+        A DEALER socket connected to the server.
+    request : int, slice, list or None
+        The request to pass to the dataset's
+        :meth:`~.datasets.Dataset.get_data` method. Lists and arrays of
+        indices are sent as lists of integers.
+    request_id : int
+        An identifier of the request, which is sent back along with the
+        data as the `id` key of the metadata returned by
+        :func:`recv_message`.
+
+    """
+    if isinstance(request, slice):
+        request = {'slice': [request.start, request.stop, request.step]}
+    elif isinstance(request, numbers.Integral):
+        request = int(request)
+    elif request is not None:
+        request = [int(index) for index in request]
+    # The empty frame delimits the routing information added by the server
+    socket.send(b'', zmq.SNDMORE)
+    socket.send_json({'id': request_id, 'request': request})
+
+
+def recv_request(socket):
+    """Receive a request sent by :func:`send_request`.
+
+    Parameters
+    ----------
+    socket : :class:`zmq.Socket`
+        A REP socket to receive the request on.
+
+    Returns
+    -------
+    request_id : int
+        The identifier of the request.
+    request : int, slice, list or None
+        The request.
+
+    """
+    message = socket.recv_json()
+    request = message['request']
+    if isinstance(request, dict):
+        request = slice(*request['slice'])
+    return message['id'], request
+
+
+def _serve_requests(dataset, port, parent_pid):
+    """Answer the requests forwarded by the broker.
+
+    Parameters
+    ----------
+    dataset : :class:`.Dataset`
+        The dataset to answer requests from.
+    port : int
+        The port on localhost on which the broker forwards requests.
+    parent_pid : int
+        The PID of the broker process. The worker exits when the broker
+        is gone.
+
+    """
+    context = zmq.Context()
+    state = dataset.open()
+    try:
+        socket = context.socket(zmq.REP)
+        socket.connect('tcp://127.0.0.1:{}'.format(port))
+        while True:
+            while not socket.poll(1000):
+                if os.getppid() != parent_pid:
+                    return
+            request_id, request = recv_request(socket)
+            try:
+                data = dataset.get_data(state, request)
+            except Exception as e:
+                logger.exception('failed to answer request {}'.format(
+                    request_id))
+                socket.send_json({
+                    'id': request_id,
+                    'error': '{}: {}'.format(type(e).__name__, e)})
+            else:
+                send_arrays(socket, data, metadata={'id': request_id})
+    finally:
+        dataset.close(state)
+        context.destroy(linger=0)
+
+
+class _FlowControl(object):
+    """Limits the number of bytes the client hasn't acknowledged yet.
+
+    Parameters
+    ----------
+    socket : :class:`zmq.Socket`
+        The socket on which the client acknowledges the batches it
+        received, by sending their size.
+    max_bytes : int
+        The number of bytes that can be in flight. A batch is only sent
+        while fewer bytes are in flight, so this can be exceeded by up to
+        the size of one batch.
+    data_socket : :class:`zmq.Socket`, optional
+        The socket the batches are sent over. If given, the whole budget
+        is restored whenever a client disconnects from it, since the
+        batches queued for that client are dropped and will never be
+        acknowledged.
+
+    """
+    def __init__(self, socket, max_bytes, data_socket=None):
+        self.socket = socket
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.poller = zmq.Poller()
+        self.poller.register(socket, zmq.POLLIN)
+        self.monitor = None
+        if data_socket is not None:
+            self.monitor = data_socket.get_monitor_socket(
+                zmq.EVENT_DISCONNECTED)
+            self.poller.register(self.monitor, zmq.POLLIN)
+
+    def receive_acknowledgements(self, timeout=0):
+        """Process acknowledgements, waiting up to `timeout` ms for one."""
+        while True:
+            events = dict(self.poller.poll(timeout))
+            if not events:
+                return
+            if self.monitor in events:
+                recv_monitor_message(self.monitor)
+                self.in_flight = 0
+            if self.socket in events:
+                # Batches sent before a reset can still be acknowledged
+                self.in_flight = max(
+                    self.in_flight - int(self.socket.recv()), 0)
+            timeout = 0
+
+    def wait(self, parent_pid=None):
+        """Wait until a batch can be sent.
+
+        Returns `False` if the process with PID `parent_pid` stopped being
+        the parent of the current one in the meantime.
+
+        """
+        self.receive_acknowledgements()
+        while self.in_flight >= self.max_bytes:
+            self.receive_acknowledgements(1000)
+            if parent_pid is not None and os.getppid() != parent_pid:
+                return False
+        return True
+
+
+def _forward(frontend, backend, flow_control):
+    """Forward batches sent with their size while the budget allows it."""
+    while True:
+        flow_control.wait()
+        frames = frontend.recv_multipart(copy=False)
+        backend.send_multipart(frames[1:], copy=False)
+        flow_control.in_flight += int(frames[0].bytes)
+
+
+class ServerStats(object):
+    """Keeps track of where a server spends its time.
+
+    Attributes
+    ----------
+    num_batches : int
+        The number of batches sent.
+    num_bytes : int
+        The number of bytes of array data sent.
+    load_time : float
+        The time in seconds spent retrieving batches from the data stream.
+    send_time : float
+        The time in seconds spent serializing and sending batches.
+    blocked_time : float
+        The time in seconds spent waiting for the client to make room in
+        the queue of the socket, i.e. waiting for the high-water mark.
+    start_time : float
+        The time at which the counters were last reset.
+
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.num_batches = 0
+        self.num_bytes = 0
+        self.load_time = 0.
+        self.send_time = 0.
+        self.blocked_time = 0.
+        self.start_time = time.time()
+
+    def report(self):
+        """Summarize the counters in a human readable way."""
+        elapsed_time = max(time.time() - self.start_time, 1e-6)
+        return ('{:.1f} batches/s, {:.1f} MB/s, {:.0%} of the time loading '
+                'data, {:.0%} sending it and {:.0%} waiting for the '
+                'client'.format(self.num_batches / elapsed_time,
+                                self.num_bytes / elapsed_time / 1e6,
+                                self.load_time / elapsed_time,
+                                self.send_time / elapsed_time,
+                                self.blocked_time / elapsed_time))
+
+
+def _send_epochs(socket, data_stream, producer=0, num_producers=1,
+                 parent_pid=None, ring=None, compression=None,
+                 shuffle=False, stats_interval=None, flow_control=None,
+                 send_sizes=False, reseed=False):
+    """Send the batches of a data stream, one epoch after the other.
+
+    Parameters
+    ----------
+    socket : :class:`zmq.Socket`
+        The socket to send the batches over.
+    data_stream : :class:`.DataStream`
+        The data stream to return batches from.
+    producer : int, optional
+        The index of the process sending the batches, when several
+        processes serve partitions of the same data stream. Defaults to 0.
+    num_producers : int, optional
+        The total number of processes serving the data stream. Defaults
+        to 1.
+    parent_pid : int, optional
+        If given, return as soon as the process with this PID is no longer
+        the parent of the current one, instead of blocking indefinitely on
+        a socket that no one will read from.
+    ring : :class:`.SharedMemoryRing`, optional
+        If given, batches are passed through this ring of shared memory
+        when possible.
+    compression : str, optional
+        The codec to compress batches with, see :func:`send_arrays`.
+    shuffle : bool, optional
+        Whether to shuffle the bytes of floating point arrays before
+        compressing them, see :func:`send_arrays`.
+    stats_interval : float, optional
+        If given, a :class:`ServerStats` summary is logged every this many
+        seconds.
+    flow_control : :class:`_FlowControl`, optional
+        If given, batches are only sent while the client's memory budget
+        allows it.
+    send_sizes : bool, optional
+        If `True`, each message is preceded by a frame holding the size of
+        the batch, for a broker that does flow control. Defaults to
+        `False`.
+    reseed : bool, optional
+        If `True`, the data stream is reseeded at the start of every
+        epoch, with the producer and the epoch as the spawn key of a
+        :class:`~.utils.parallel.SeedSequence` (see
+        :func:`~.utils.parallel.reseed_stream`). Defaults to `False`.
+
+    Notes
+    -----
+    Each batch is sent along with the epoch it belongs to and its index
+    within the epoch: the `i`-th batch of producer `p` has index ``i *
+    num_producers + p``. This is the position of its request in the
+    iteration scheme if the producers were dealt the requests in turn
+    (see :func:`~.utils.parallel.partition_stream`) and the data stream
+    returns one batch per request. If it filters, merges or splits
+    batches, the indices still interleave the batches of the producers,
+    but no longer follow the requests. With flow control, each batch also
+    holds its size in bytes, which the client sends back once it has
+    received the batch.
+
+    """
+    def get_epoch_iterator(epoch):
+        if reseed:
+            reseed_stream(data_stream,
+                          SeedSequence(spawn_key=(producer, epoch)))
+        return data_stream.get_epoch_iterator()
+
+    it = get_epoch_iterator(0)
+    epoch, num_batches = 0, 0
+    stats = ServerStats()
+    while True:
+        metadata = {'epoch': epoch, 'producer': producer,
+                    'num_producers': num_producers}
+        start_time = time.time()
+        try:
+            data = next(it)
+            stop = False
+            metadata['index'] = num_batches * num_producers + producer
+            if flow_control is not None or send_sizes:
+                metadata['nbytes'] = sum(numpy.asarray(array).nbytes
+                                         for array in data)
+            num_batches += 1
+            logger.debug("sending {} arrays".format(len(data)))
+        except StopIteration:
+            it = get_epoch_iterator(epoch + 1)
+            data = None
+            stop = True
+            epoch, num_batches = epoch + 1, 0
+            logger.debug("sending StopIteration")
+        load_time = time.time()
+        stats.load_time += load_time - start_time
+        if flow_control is not None and not flow_control.wait(parent_pid):
+            return
+        if not socket.poll(0, zmq.POLLOUT):
+            while not socket.poll(1000, zmq.POLLOUT):
+                if parent_pid is not None and os.getppid() != parent_pid:
+                    return
+        blocked_time = time.time()
+        stats.blocked_time += blocked_time - load_time
+        if send_sizes:
+            socket.send(str(metadata.get('nbytes', 0)).encode('ascii'),
+                        zmq.SNDMORE)
+        stats.num_bytes += send_arrays(
+            socket, data, stop=stop, metadata=metadata, ring=ring,
+            compression=compression, shuffle=shuffle)
+        if flow_control is not None:
+            flow_control.in_flight += metadata.get('nbytes', 0)
+        stats.send_time += time.time() - blocked_time
+        if not stop:
+            stats.num_batches += 1
+        if (stats_interval is not None and
+                time.time() - stats.start_time > stats_interval):
+            logger.info('producer {}: {}'.format(producer, stats.report()))
+            stats.reset()
+
+
+def _start_worker(data_stream, port, hwm, num_workers, worker, parent_pid,
+                  shared_memory, **kwargs):
+    r"""Serve a partition of a data stream to the broker.
+
+    Parameters
+    ----------
+    data_stream : :class:`.DataStream`
+        The data stream to return batches from. Only the partition of each
+        epoch that belongs to this worker is sent.
+    port : int
+        The port on localhost on which the broker receives the batches of
+        this worker.
+    hwm : int
+        The high-water mark of the sending socket.
+    num_workers : int
+        The total number of workers.
+    worker : int
+        The index of this worker.
+    parent_pid : int
+        The PID of the broker process. The worker exits when the broker
+        is gone.
+    shared_memory : bool
+        Whether to pass batches through shared memory.
+    \*\*kwargs
+        Passed on to :func:`_send_epochs`.
+
+    """
+    partition_stream(data_stream, num_workers, worker)
+    context = zmq.Context()
+    ring = None
+    if shared_memory:
+        ring = SharedMemoryRing(hwm + 2)
+        remove_on_sigterm(ring)
+    try:
+        socket = context.socket(zmq.PUSH)
+        socket.set_hwm(hwm)
+        socket.connect('tcp://127.0.0.1:{}'.format(port))
+        _send_epochs(socket, data_stream, worker, num_workers, parent_pid,
+                     ring, reseed=True, **kwargs)
+    finally:
+        # Batches still queued for the broker can't be delivered anymore
+        context.destroy(linger=0)
+        if ring is not None:
+            ring.close()
+
+
+def start_server(data_stream, port=5557, hwm=10, num_workers=1,
+                 shared_memory=False, compression=None, shuffle=False,
+                 stats_interval=None, max_bytes=None):
     """Start a data processing server.
 
     This command starts a server in the current process that performs the
@@ -106,26 +794,158 @@ def start_server(data_stream, port=5557, hwm=10):
         many batches will actually be queued with a particular HWM.
         Defaults to 10. Be sure to set the corresponding HWM on the
         receiving end as well.
+    num_workers : int, optional
+        The number of worker processes. If larger than 1, each worker runs
+        its own copy of the data stream and serves a partition of each
+        epoch (see :func:`~.utils.parallel.partition_stream`), while the
+        current process forwards their batches to the client. The random
+        states of the transformers are reseeded differently in each worker
+        and epoch (see :func:`~.utils.parallel.reseed_stream`). Defaults
+        to 1, in which case the data stream is served by the current
+        process.
+    shared_memory : bool, optional
+        If `True`, batches are written to a :class:`.SharedMemoryRing` of
+        ``hwm + 2`` slots (per worker) and only their location is sent to
+        the client, avoiding copies through the network stack. The client
+        must run on the same host. Processes writing to shared memory
+        remove it when they receive SIGTERM. Defaults to `False`.
+    compression : str, optional
+        If ``'zlib'`` or ``'lz4'`` (requires the `lz4` package), batches
+        are compressed before they are sent, which is worth it if the
+        client is on another host and the network is the bottleneck. The
+        client detects the codec automatically. Defaults to `None`, i.e.
+        no compression.
+    shuffle : bool, optional
+        If `True`, the bytes of floating point arrays are shuffled before
+        compression, see :func:`send_arrays`. Defaults to `False`.
+    stats_interval : float, optional
+        If given, every process producing batches logs how many batches
+        and bytes it sent per second, and how much of its time it spent
+        retrieving batches from the data stream, sending them, and
+        waiting for the client (see :class:`ServerStats`), every this
+        many seconds. If most time is spent waiting for the client, the
+        training loop is the bottleneck. Defaults to `None`.
+    max_bytes : int, optional
+        If given, the size of the batches that were sent, but not received
+        by the client's data stream yet, is limited to this many bytes
+        (plus the size of one batch), which bounds the memory used by the
+        queues in between regardless of the size of the batches. The
+        client acknowledges each batch it receives on port ``port + 1``.
+        The budget is restored whenever a client disconnects, since the
+        batches queued for it are lost.
+        Defaults to `None`, in which case only the high-water marks limit
+        the queues.
+
+    Notes
+    -----
+    With several workers, batches are forwarded in the order they are
+    produced, and workers can start on the next epoch before the others
+    have finished the current one. :class:`.ServerDataStream` uses the
+    epoch and index sent along with each batch to restore the epoch
+    boundaries and, optionally, the order of the batches.
 
     """
+    _check_compression(compression)
     logging.basicConfig(level='INFO')
 
     context = zmq.Context()
     socket = context.socket(zmq.PUSH)
     socket.set_hwm(hwm)
-    socket.bind('tcp://*:{}'.format(port))
 
-    it = data_stream.get_epoch_iterator()
+    workers, ring, flow_control = [], None, None
+    if max_bytes is not None:
+        flow_control = _FlowControl(context.socket(zmq.PULL), max_bytes,
+                                    socket)
+    try:
+        if num_workers == 1:
+            if shared_memory:
+                ring = SharedMemoryRing(hwm + 2)
+                remove_on_sigterm(ring)
+            socket.bind('tcp://*:{}'.format(port))
+            if flow_control is not None:
+                flow_control.socket.bind('tcp://*:{}'.format(port + 1))
+            logger.info('server started')
+            _send_epochs(socket, data_stream, ring=ring,
+                         compression=compression, shuffle=shuffle,
+                         stats_interval=stats_interval,
+                         flow_control=flow_control)
+        frontend = context.socket(zmq.PULL)
+        frontend.set_hwm(hwm)
+        frontend_port = frontend.bind_to_random_port('tcp://127.0.0.1')
+        for worker in range(num_workers):
+            process = Process(
+                target=_start_worker,
+                args=(data_stream, frontend_port, hwm, num_workers, worker,
+                      os.getpid(), shared_memory),
+                kwargs={'compression': compression, 'shuffle': shuffle,
+                        'stats_interval': stats_interval,
+                        'send_sizes': max_bytes is not None})
+            process.daemon = True
+            process.start()
+            workers.append(process)
+        # Bind only after forking, so that the workers don't inherit the
+        # listening socket and keep the port busy when they outlive us
+        socket.bind('tcp://*:{}'.format(port))
+        logger.info('server started with {} workers'.format(num_workers))
+        if flow_control is not None:
+            flow_control.socket.bind('tcp://*:{}'.format(port + 1))
+            _forward(frontend, socket, flow_control)
+        else:
+            zmq.proxy(frontend, socket)
+    finally:
+        for process in workers:
+            process.terminate()
+        context.destroy(linger=0)
+        if ring is not None:
+            ring.close()
 
-    logger.info('server started')
-    while True:
-        try:
-            data = next(it)
-            stop = False
-            logger.debug("sending {} arrays".format(len(data)))
-        except StopIteration:
-            it = data_stream.get_epoch_iterator()
-            data = None
-            stop = True
-            logger.debug("sending StopIteration")
-        send_arrays(socket, data, stop=stop)
+
+def start_dataset_server(dataset, port=5557, num_workers=1):
+    """Start a server that answers requests for data from a dataset.
+
+    Unlike :func:`start_server`, which streams the batches of a data
+    stream, this server lets the client iterate over the dataset with an
+    iteration scheme of its own choosing, or request arbitrary examples
+    (see :class:`.ServerDataStream`). The current process forwards the
+    requests to a pool of worker processes, each of which holds its own
+    copy of the dataset.
+
+    Parameters
+    ----------
+    dataset : :class:`.Dataset`
+        The dataset to answer requests from. Each worker calls its
+        :meth:`~.datasets.Dataset.open` method, so datasets that read
+        from files, like :class:`.H5PYDataset`, shouldn't have any files
+        open when the server is started.
+    port : int, optional
+        The port the server and the client will use to communicate.
+        Defaults to 5557.
+    num_workers : int, optional
+        The number of worker processes. Requests are dealt out to the
+        workers in turn, so that several requests can be answered at the
+        same time. Defaults to 1.
+
+    """
+    logging.basicConfig(level='INFO')
+
+    context = zmq.Context()
+    workers = []
+    try:
+        backend = context.socket(zmq.DEALER)
+        backend_port = backend.bind_to_random_port('tcp://127.0.0.1')
+        for _ in range(num_workers):
+            process = Process(target=_serve_requests,
+                              args=(dataset, backend_port, os.getpid()))
+            process.daemon = True
+            process.start()
+            workers.append(process)
+        # Bind only after forking, see start_server
+        frontend = context.socket(zmq.ROUTER)
+        frontend.bind('tcp://*:{}'.format(port))
+        logger.info('dataset server started with {} workers'.format(
+            num_workers))
+        zmq.proxy(frontend, backend)
+    finally:
+        for process in workers:
+            process.terminate()
+        context.destroy(linger=0)
@@ -1,10 +1,21 @@
+import threading
+import time
 from abc import ABCMeta, abstractmethod
+from collections import deque, OrderedDict
 
+import six
 import zmq
 from six import add_metaclass, iteritems
+from six.moves import queue
+try:
+    import zmq.asyncio
+    ZMQ_ASYNCIO_AVAILABLE = True
+except ImportError:
+    ZMQ_ASYNCIO_AVAILABLE = False
 
-from fuel.iterator import DataIterator
-from fuel.server import recv_arrays
+from fuel.iterator import AsyncDataIterator, DataIterator
+from fuel.server import recv_message, send_request
+from fuel.utils.parallel import EpochReassembler
 
 
 @add_metaclass(ABCMeta)
@@ -96,6 +107,28 @@ class AbstractDataStream(object):
                             if self.iteration_scheme else None,
                             as_dict=as_dict)
 
+    def aiter_epoch(self, as_dict=False, loop=None):
+        """Get an asynchronous iterator over an epoch.
+
+        Parameters
+        ----------
+        as_dict : bool, optional
+            See :meth:`get_epoch_iterator`.
+        loop : :class:`asyncio.AbstractEventLoop`, optional
+            The event loop to run on. Defaults to the current event loop.
+
+        Returns
+        -------
+        :class:`.AsyncDataIterator`
+            An iterator for ``async for`` loops. This default
+            implementation reads each batch from :meth:`get_epoch_iterator`
+            in the loop's default executor, so that other tasks keep
+            running in the meantime.
+
+        """
+        return AsyncDataIterator(self.get_epoch_iterator(as_dict=as_dict),
+                                 loop)
+
     def iterate_epochs(self, as_dict=False):
         """Allow iteration through all epochs.
 
@@ -189,7 +222,7 @@ class ServerDataStream(AbstractDataStream):
         The names of the data sources returned by this data stream.
     produces_examples : bool
         Whether this data stream produces examples (as opposed to batches
-        of examples).
+        of examples). Ignored if `iteration_scheme` is given.
     host : str, optional
         The host to connect to. Defaults to ``localhost``.
     port : int, optional
@@ -206,38 +239,253 @@ class ServerDataStream(AbstractDataStream):
     axis_labels : dict, optional
         Maps source names to tuples of strings describing axis semantics,
         one per axis. Defaults to `None`, i.e. no information is available.
+    ordered : bool, optional
+        If `True`, the batches of each epoch are returned in the order of
+        the requests of the server's iteration scheme, even when the
+        server's workers finish them out of order. This assumes the
+        server's data stream returns one batch per request; otherwise the
+        workers' batches are interleaved in turn. Defaults to `False`, in
+        which case batches are returned as soon as they are received.
+    prefetch : int, optional
+        If given, a background thread receives and decodes up to this many
+        batches ahead of the training loop, so that deserialization
+        overlaps with the computation on the previous batch and delays of
+        the server are absorbed. Defaults to `None`, in which case batches
+        are received when they are requested, and buffered by ZeroMQ only.
+        When requesting data, this is the number of requests that are sent
+        ahead of the one being waited for.
+    iteration_scheme : :class:`.IterationScheme`, optional
+        If given, the stream connects to a server started by
+        :func:`.start_dataset_server` instead, and sends it the requests
+        of this iteration scheme. :meth:`get_data` then accepts any
+        request the server's dataset accepts.
+
+    Notes
+    -----
+    When the server runs several workers, each of them sends its own
+    share of every epoch. Batches are assigned to epochs using the
+    metadata sent along with them, and ``StopIteration`` is only raised
+    once every worker has finished the epoch. Batches belonging to the
+    next epoch that arrive early are held back until then. Each batch is
+    returned exactly once.
+
+    If the server limits the memory used by batches in flight (see the
+    `max_bytes` argument of :func:`.start_server`), the stream tells the
+    server about every batch it takes off the socket (or the prefetching
+    queue). The server restores its budget whenever a connection is
+    closed, which :meth:`connect` does before reconnecting, since the
+    batches in flight on it are lost.
+
+    When prefetching from a server that uses shared memory, the prefetched
+    batches keep their slots in use, so `prefetch` should be smaller than
+    the number of slots.
 
     """
     def __init__(self, sources, produces_examples, host='localhost', port=5557,
-                 hwm=10, axis_labels=None):
-        super(ServerDataStream, self).__init__(axis_labels=axis_labels)
+                 hwm=10, axis_labels=None, ordered=False, prefetch=None,
+                 iteration_scheme=None):
+        super(ServerDataStream, self).__init__(
+            iteration_scheme=iteration_scheme, axis_labels=axis_labels)
         self.sources = sources
-        self.produces_examples = produces_examples
+        if iteration_scheme is None:
+            self.produces_examples = produces_examples
         self.host = host
         self.port = port
         self.hwm = hwm
+        self.ordered = ordered
+        self.prefetch = prefetch
+        self._num_batches, self._wait_time = 0, 0.
+        self._stats_start_time = time.time()
         self.connect()
 
     def connect(self):
+        if getattr(self, 'socket', None) is not None:
+            # Let the server know the batches queued for us are lost
+            if self._prefetcher is not None:
+                self._prefetcher.stop()
+            else:
+                self.socket.close(linger=0)
+            if self._ack_socket is not None:
+                self._ack_socket.close()
         context = zmq.Context()
-        self.socket = socket = context.socket(zmq.PULL)
+        if self.iteration_scheme is not None:
+            self.socket = context.socket(zmq.DEALER)
+        else:
+            self.socket = context.socket(zmq.PULL)
+        socket = self.socket
         socket.set_hwm(self.hwm)
         socket.connect("tcp://{}:{}".format(self.host, self.port))
         self.connected = True
+        # The requests that were sent and not returned yet, and the data
+        # received for them
+        self._pending = OrderedDict()
+        self._replies = {}
+        self._next_id = 0
+        self._prefetcher = None
+        if self.prefetch and self.iteration_scheme is None:
+            # From now on the socket is only used by the prefetching thread
+            self._prefetcher = _Prefetcher(socket, self.prefetch)
+            self._prefetcher.start()
+        # The epoch and number of producers are taken from the messages
+        self._reassembler = EpochReassembler()
+        self._ack_socket = None
 
     def get_data(self, request=None):
-        if request is not None:
+        if (request is None) != (self.iteration_scheme is None):
             raise ValueError
         if not self.connected:
             self.connect()
-        data = recv_arrays(self.socket)
+        if request is not None:
+            data = self._request(request)
+            self._num_batches += 1
+            return data
+        while True:
+            data = self._next_batch()
+            if data is not None:
+                return data
+            self._receive()
+
+    def _next_batch(self):
+        """Return the next batch, if received, without blocking.
+
+        Raises
+        ------
+        StopIteration
+            If the epoch is finished.
+
+        """
+        self._reassembler.ordered = self.ordered
+        data = self._reassembler.pop()
+        if data is not None:
+            self._num_batches += 1
+            return tuple(data)
+        if self._reassembler.epoch_finished():
+            self._reassembler.next_epoch()
+            raise StopIteration
+        return None
+
+    def _send_request(self, request):
+        """Send a request and return its identifier."""
+        if not self.connected:
+            self.connect()
+        request_id = self._next_id
+        self._next_id += 1
+        send_request(self.socket, request, request_id)
+        self._pending[request_id] = request
+        return request_id
+
+    def _request(self, request):
+        """Return the data for a request, sending it if needed."""
+        for request_id, pending_request in iteritems(self._pending):
+            if pending_request is request:
+                break
+        else:
+            request_id = self._send_request(request)
+        while request_id not in self._replies:
+            start_time = time.time()
+            self.socket.recv()
+            metadata, data = recv_message(self.socket)
+            self._wait_time += time.time() - start_time
+            # Replies to requests that were forgotten are dropped
+            if metadata['id'] in self._pending:
+                self._replies[metadata['id']] = metadata, data
+        del self._pending[request_id]
+        metadata, data = self._replies.pop(request_id)
+        if 'error' in metadata:
+            raise RuntimeError('server failed to answer request {}: {}'.format(
+                request, metadata['error']))
         return tuple(data)
 
-    def get_epoch_iterator(self, **kwargs):
-        return super(ServerDataStream, self).get_epoch_iterator(**kwargs)
+    def _receive(self):
+        """Receive a message and store it with the epoch it belongs to."""
+        start_time = time.time()
+        if self._prefetcher is not None:
+            metadata, data = self._prefetcher.get()
+        else:
+            metadata, data = recv_message(self.socket)
+        self._wait_time += time.time() - start_time
+        # Batches held back until their turn must not count towards the
+        # server's budget, or the batches they wait for may never be sent
+        self._acknowledge(metadata.get('nbytes'))
+        self._reassembler.num_producers = metadata['num_producers']
+        self._reassembler.add(metadata['epoch'], metadata['producer'],
+                              None if data is None else metadata['index'],
+                              data)
+
+    def _acknowledge(self, nbytes):
+        """Tell the server that a batch of `nbytes` bytes was received."""
+        if nbytes is None:
+            return
+        if self._ack_socket is None:
+            self._ack_socket = self.socket.context.socket(zmq.PUSH)
+            self._ack_socket.connect(
+                "tcp://{}:{}".format(self.host, self.port + 1))
+        self._ack_socket.send(str(nbytes).encode('ascii'))
+
+    def get_epoch_iterator(self, as_dict=False):
+        if self.iteration_scheme is None:
+            return super(ServerDataStream, self).get_epoch_iterator(
+                as_dict=as_dict)
+        if self.connected:
+            # Requests sent ahead during an earlier epoch are not needed
+            self._pending.clear()
+            self._replies.clear()
+        return DataIterator(
+            self, _RequestPipeline(
+                self, self.iteration_scheme.get_request_iterator(),
+                self.prefetch or 0),
+            as_dict=as_dict)
+
+    def aiter_epoch(self, as_dict=False, loop=None):
+        """Get an asynchronous iterator over an epoch.
+
+        Unless the stream requests data or prefetches batches in a
+        thread, batches are received straight from the socket when the
+        event loop reports it is readable, without using a thread. This
+        requires :mod:`zmq.asyncio`.
+
+        See :meth:`.AbstractDataStream.aiter_epoch`.
+
+        """
+        if (self.iteration_scheme is not None or self.prefetch or
+                not ZMQ_ASYNCIO_AVAILABLE):
+            return super(ServerDataStream, self).aiter_epoch(
+                as_dict=as_dict, loop=loop)
+        return _AsyncServerIterator(self, as_dict, loop)
+
+    def stats(self, reset=False):
+        """Report how much time was spent waiting for the server.
+
+        Parameters
+        ----------
+        reset : bool, optional
+            If `True`, start counting anew after reporting. Defaults to
+            `False`.
+
+        Returns
+        -------
+        dict
+            The number of batches returned (`num_batches`), the time in
+            seconds spent waiting to receive data (`wait_time`), and the
+            time since counting started (`elapsed_time`). If most of the
+            elapsed time is spent waiting, the server is the bottleneck.
+
+        """
+        now = time.time()
+        stats = {'num_batches': self._num_batches,
+                 'wait_time': self._wait_time,
+                 'elapsed_time': now - self._stats_start_time}
+        if reset:
+            self._num_batches = 0
+            self._wait_time = 0.
+            self._stats_start_time = now
+        return stats
 
     def close(self):
-        pass
+        if self._prefetcher is not None:
+            # Reconnect if more data is requested
+            self._prefetcher.stop()
+            self.connected = False
 
     def next_epoch(self):
         pass
@@ -248,5 +496,170 @@ class ServerDataStream(AbstractDataStream):
     def __getstate__(self):
         state = self.__dict__.copy()
         state['connected'] = False
-        del state['socket']
+        state['socket'] = None
+        state['_prefetcher'] = None
+        state['_ack_socket'] = None
         return state
+
+
+class _RequestPipeline(six.Iterator):
+    """Iterate over requests, sending them to the server ahead of time.
+
+    Parameters
+    ----------
+    data_stream : :class:`ServerDataStream`
+        The stream to send the requests with.
+    request_iterator : iterator
+        The requests to iterate over.
+    num_ahead : int
+        The number of requests to send before they are returned.
+
+    """
+    def __init__(self, data_stream, request_iterator, num_ahead):
+        self.data_stream = data_stream
+        self.request_iterator = request_iterator
+        self.num_ahead = num_ahead
+        self.requests = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while len(self.requests) <= self.num_ahead:
+            try:
+                request = next(self.request_iterator)
+            except StopIteration:
+                break
+            self.data_stream._send_request(request)
+            self.requests.append(request)
+        if not self.requests:
+            raise StopIteration
+        return self.requests.popleft()
+
+
+class _AsyncServerIterator(AsyncDataIterator):
+    """Receive the batches of an epoch in an event loop.
+
+    The socket is shadowed by a :mod:`zmq.asyncio` socket, whose poll
+    futures tell when a message has arrived. Multipart messages arrive
+    as a whole, so receiving them never blocks the loop.
+
+    """
+    def __init__(self, data_stream, as_dict, loop):
+        super(_AsyncServerIterator, self).__init__(None, loop)
+        self.data_stream = data_stream
+        self.as_dict = as_dict
+        self._async_socket = None
+
+    def __anext__(self):
+        loop = self._get_loop()
+        future = loop.create_future()
+        # zmq.asyncio uses the running loop, so only start once it runs
+        loop.call_soon(self._step, future)
+        return future
+
+    def _step(self, future):
+        """Resolve `future` with the next batch, or wait for the socket."""
+        if future.done():
+            return
+        stream = self.data_stream
+        try:
+            if not stream.connected:
+                stream.connect()
+            while True:
+                data = stream._next_batch()
+                if data is not None:
+                    break
+                if not stream.socket.poll(0):
+                    self._wait(future)
+                    return
+                stream._receive()
+        except StopIteration:
+            future.set_exception(StopAsyncIteration())
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            if self.as_dict:
+                data = dict(zip(stream.sources, data))
+            future.set_result(data)
+
+    def _wait(self, future):
+        """Call :meth:`_step` again once a message has arrived."""
+        socket = self.data_stream.socket
+        if (self._async_socket is None or
+                self._async_socket.underlying != socket.underlying):
+            # Reconnecting replaces the socket. The shadow must not be
+            # closed, since that would close the stream's socket too.
+            self._async_socket = zmq.asyncio.Socket.shadow(
+                socket.underlying)
+        poll = self._async_socket.poll(flags=zmq.POLLIN)
+
+        def polled(poll):
+            if future.done():
+                return
+            if poll.exception() is not None:
+                future.set_exception(poll.exception())
+            else:
+                self._step(future)
+        poll.add_done_callback(polled)
+        future.add_done_callback(lambda future: poll.cancel())
+
+
+class _Prefetcher(threading.Thread):
+    """A thread that receives messages from a socket into a queue.
+
+    Parameters
+    ----------
+    socket : :class:`zmq.Socket`
+        The socket to receive from. It must not be used by any other
+        thread.
+    size : int
+        The maximum number of messages in the queue.
+
+    """
+    def __init__(self, socket, size):
+        super(_Prefetcher, self).__init__()
+        self.daemon = True
+        self.socket = socket
+        self.queue = queue.Queue(size)
+        self.stopped = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                # Time out regularly to check whether we were stopped
+                if not self.socket.poll(100):
+                    continue
+                self._put(recv_message(self.socket))
+        except Exception as e:
+            self.error = e
+            self._put(e)
+        finally:
+            self.socket.close(linger=0)
+
+    def _put(self, message):
+        """Queue a message, unless the thread is stopped in the meantime."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(message, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self):
+        """Return the next message, re-raising errors of the thread.
+
+        Once the thread failed, every message after the ones it queued
+        before failing raises its error.
+
+        """
+        if self.error is not None and self.queue.empty():
+            raise self.error
+        message = self.queue.get()
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def stop(self):
+        self.stopped.set()
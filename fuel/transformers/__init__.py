@@ -1,24 +1,46 @@
 import logging
 from abc import ABCMeta, abstractmethod
-from collections import defaultdict
-from multiprocessing import Process, Queue
+from collections import defaultdict, deque
+from multiprocessing import Process, Queue, Value
+import os
+import threading
+import traceback
 
 import numpy
 import pyximport
 import warnings
-from picklable_itertools import chain, ifilter, izip
-from six import add_metaclass, iteritems
+from picklable_itertools import chain, ifilter, islice, izip
+from six import add_metaclass, get_unbound_function, iteritems
+from six.moves import map, queue
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    CONCURRENT_FUTURES_AVAILABLE = True
+except ImportError:
+    CONCURRENT_FUTURES_AVAILABLE = False
 
 pyximport.install()
 
 from fuel import config
-from fuel.streams import AbstractDataStream
-from fuel.schemes import BatchSizeScheme
+from fuel.iterator import DataIterator
+from fuel.streams import AbstractDataStream, DataStream
+from fuel.schemes import (BatchSizeScheme, ConstantScheme,
+                          SequentialExampleScheme, ShuffledBlockScheme)
+from fuel.utils.parallel import (EpochReassembler, SeedSequence,
+                                 partition_stream, reseed_stream)
+from fuel.utils.shared_memory import (SharedMemoryRing, read_shared_memory,
+                                      release_removed_maps, remove_on_sigterm)
 from ..exceptions import AxisLabelsMismatchError
 import numpy as np
 
 log = logging.getLogger(__name__)
 
+# Pools of threads shared by transformers, by process and number of
+# threads. A forked process inherits the pools of its parent, but not their
+# threads, so it must start its own.
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
 
 class ExpectsAxisLabels(object):
     """Mixin for transformers, used to verify axis labels.
@@ -191,7 +213,7 @@ class AgnosticTransformer(Transformer):
         return self.transform_any(batch)
 
 
-class Mapping(Transformer):
+class Mapping(AgnosticTransformer):
     """Applies a mapping to the data of the wrapped data stream.
 
     Parameters
@@ -217,16 +239,22 @@ class Mapping(Transformer):
         return self.data_stream.sources + (self.add_sources
                                            if self.add_sources else ())
 
-    def get_data(self, request=None):
-        if request is not None:
-            raise ValueError
-        data = next(self.child_epoch_iterator)
+    def transform_any(self, data):
         image = self.mapping(data)
         if not self.add_sources:
             return image
         return data + image
 
 
+def _thread_pool(num_threads):
+    """Return a pool of threads shared by all sourcewise transformers."""
+    key = (os.getpid(), num_threads)
+    with _thread_pools_lock:
+        if key not in _thread_pools:
+            _thread_pools[key] = ThreadPoolExecutor(num_threads)
+        return _thread_pools[key]
+
+
 @add_metaclass(ABCMeta)
 class SourcewiseTransformer(Transformer):
     """Applies a transformation sourcewise.
@@ -242,19 +270,58 @@ class SourcewiseTransformer(Transformer):
     which_sources : tuple of str, optional
         Which sources to apply the mapping to. Defaults to `None`, in
         which case the mapping is applied to all sources.
+    parallel : int, optional
+        If given, the examples of a batch that are transformed one by one
+        (see :meth:`map_examples`) are spread over a pool of this many
+        threads, which is shared by all transformers using the same
+        number of threads. Defaults to `None`, in which case they are
+        transformed in turn.
+
+    Notes
+    -----
+    When transforming a batch with :meth:`map_examples`, random numbers
+    should be drawn for the whole batch beforehand and passed to the
+    function, so that they don't depend on the order in which the threads
+    process the examples.
 
     """
 
     def __init__(self, data_stream, produces_examples, which_sources=None,
-                 **kwargs):
+                 parallel=None, **kwargs):
         if which_sources is None:
             which_sources = data_stream.sources
         elif isinstance(which_sources, str):
             raise TypeError('which_sources parameter should be a tuple of str.')
+        if parallel and not CONCURRENT_FUTURES_AVAILABLE:
+            raise ImportError("the futures package is required to use the "
+                              "parallel option on Python 2")
         self.which_sources = which_sources
+        self.parallel = parallel
         super(SourcewiseTransformer, self).__init__(
             data_stream, produces_examples, **kwargs)
 
+    def map_examples(self, function, *iterables):
+        r"""Apply a function to each example of a batch.
+
+        Parameters
+        ----------
+        function : callable
+            The function to apply, which is passed an element of each
+            iterable in turn.
+        \*iterables
+            The examples of the batch, and optionally further arguments
+            for each example.
+
+        Returns
+        -------
+        list
+            The results, in the order of the examples.
+
+        """
+        if not self.parallel:
+            return list(map(function, *iterables))
+        return list(_thread_pool(self.parallel).map(function, *iterables))
+
     def _apply_sourcewise_transformation(self, data, method):
         data = list(data)
         for i, source_name in enumerate(self.data_stream.sources):
@@ -535,6 +602,115 @@ class Cache(Transformer):
                 raise
 
 
+class BlockShuffle(Transformer):
+    """Shuffle the examples of several blocks into batches.
+
+    Reads blocks of examples (e.g. the contiguous blocks requested by a
+    :class:`.ShuffledBlockScheme`) into a shuffle buffer, and returns
+    batches of examples drawn at random from it. When the buffer runs
+    out, the remaining examples are shuffled together with the next
+    blocks. The examples of nearby blocks thereby end up in the same
+    batches, but reading blocks keeps the I/O close to sequential.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The data stream to wrap. It must produce batches (blocks).
+    iteration_scheme : :class:`.BatchSizeScheme`
+        The scheme giving the size of the batches to return.
+    buffer_blocks : int, optional
+        The number of blocks read into the buffer at a time. The more
+        blocks, the better the examples are mixed. Defaults to 8.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random state used to shuffle the buffer.
+
+    """
+    def __init__(self, data_stream, iteration_scheme, buffer_blocks=8,
+                 rng=None, **kwargs):
+        if data_stream.produces_examples:
+            raise ValueError('the wrapped data stream must produce batches '
+                             'of examples, not single examples.')
+        if not isinstance(iteration_scheme, BatchSizeScheme):
+            raise ValueError('iteration scheme must be an instance of '
+                             'BatchSizeScheme')
+        if data_stream.axis_labels:
+            kwargs.setdefault('axis_labels', data_stream.axis_labels.copy())
+        super(BlockShuffle, self).__init__(
+            data_stream, iteration_scheme=iteration_scheme, **kwargs)
+        self.buffer_blocks = buffer_blocks
+        self.rng = rng
+        if self.rng is None:
+            self.rng = numpy.random.RandomState(config.default_seed)
+        self.buffer = None
+
+    def get_epoch_iterator(self, **kwargs):
+        self.buffer = None
+        return super(BlockShuffle, self).get_epoch_iterator(**kwargs)
+
+    def get_data(self, request=None):
+        if request is None:
+            raise ValueError
+        if self.buffer is None or request > len(self.buffer[0]):
+            self._fill_buffer()
+        data = tuple(source_buffer[:request] for source_buffer in self.buffer)
+        self.buffer = tuple(source_buffer[request:]
+                            for source_buffer in self.buffer)
+        return data
+
+    def _fill_buffer(self):
+        blocks = [] if self.buffer is None else [self.buffer]
+        for block in islice(self.child_epoch_iterator, self.buffer_blocks):
+            blocks.append(block)
+        if not blocks or not any(len(block[0]) for block in blocks):
+            raise StopIteration
+        buffer = [numpy.concatenate(source_blocks)
+                  for source_blocks in zip(*blocks)]
+        order = self.rng.permutation(len(buffer[0]))
+        self.buffer = tuple(source_buffer[order] for source_buffer in buffer)
+
+
+def block_shuffled_stream(dataset, batch_size, block_size=None,
+                          buffer_blocks=8, rng=None):
+    """Returns a stream of batches shuffled a block at a time.
+
+    Fancy indexing a file with shuffled batches reads nearly every
+    chunk for every batch. Instead, this stream reads contiguous blocks
+    of examples in shuffled order, and shuffles the examples of
+    `buffer_blocks` blocks at a time into batches. The order of the
+    examples is only approximately random, but the file is read
+    almost sequentially.
+
+    Parameters
+    ----------
+    dataset : :class:`.Dataset`
+        The dataset to read, e.g. an :class:`.H5PYDataset` whose data
+        stays on disk. It must support requests for slices of examples.
+    batch_size : int
+        The size of the batches.
+    block_size : int, optional
+        The number of examples in each block. Defaults to the
+        `chunk_size` of the dataset (see
+        :attr:`.H5PYDataset.chunk_size`), or to `batch_size` if it
+        doesn't have one.
+    buffer_blocks : int, optional
+        The number of blocks shuffled together. Defaults to 8.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random state used to shuffle the blocks and the examples.
+
+    Returns
+    -------
+    :class:`BlockShuffle`
+        The data stream.
+
+    """
+    if block_size is None:
+        block_size = getattr(dataset, 'chunk_size', None) or batch_size
+    stream = DataStream(dataset, iteration_scheme=ShuffledBlockScheme(
+        dataset.num_examples, block_size, rng=rng))
+    return BlockShuffle(stream, ConstantScheme(batch_size),
+                        buffer_blocks=buffer_blocks, rng=rng)
+
+
 class SortMapping(object):
     """Callable class for creating sorting mappings.
 
@@ -584,10 +760,35 @@ class Batch(Transformer):
         requested. At level 1, the last batch is discarded if it is not of
         the correct size. At the highest strictness level, 2, an error is
         raised if a batch of the requested size cannot be provided.
+    recycle_buffers : int, optional
+        If given, the batches of each source are written into this many
+        pre-allocated arrays, which are reused in turn. A batch is then
+        overwritten by the one returned `recycle_buffers` requests later,
+        so consumers must be done with it (or copy it) by then. By
+        default, every batch is a new array.
+
+    Notes
+    -----
+    When recycling buffers, the first batch is converted from a list of
+    examples as usual. For each source whose examples all had the same
+    shape and dtype, the examples of the following batches are then
+    written directly into a recycled array, which saves allocating (and
+    faulting in) a new one for every batch. A source whose examples stop
+    matching goes back to being converted from lists.
+
+    If the wrapped stream is a :class:`.DataStream` iterating over the
+    examples of a dataset in order with a :class:`.SequentialExampleScheme`
+    and the dataset :attr:`~.Dataset.supports_slices`, each batch is read
+    with a single slice request instead of one request per example. When
+    recycling buffers, the slices the dataset returns views of (e.g. of
+    arrays in memory) are then copied into the recycled arrays, while
+    those it reads into new arrays (e.g. from a file) are returned as they
+    are.
 
     """
 
-    def __init__(self, data_stream, iteration_scheme, strictness=0, **kwargs):
+    def __init__(self, data_stream, iteration_scheme, strictness=0,
+                 recycle_buffers=None, **kwargs):
         if not data_stream.produces_examples:
             raise ValueError('the wrapped data stream must produce examples, '
                              'not batches of examples.')
@@ -597,6 +798,8 @@ class Batch(Transformer):
         if iteration_scheme.requests_examples:
             raise ValueError('the iteration scheme must request batches, '
                              'not individual examples.')
+        if recycle_buffers is not None and recycle_buffers < 1:
+            raise ValueError('recycle_buffers must be a positive integer')
         if data_stream.axis_labels:
             kwargs.setdefault(
                 'axis_labels',
@@ -605,26 +808,129 @@ class Batch(Transformer):
         super(Batch, self).__init__(
             data_stream, iteration_scheme=iteration_scheme, **kwargs)
         self.strictness = strictness
+        self.recycle_buffers = recycle_buffers
+        self._example_specs = None
+        self._buffers = None
+
+    def _get_buffer(self, source_index, request):
+        if self._buffers is None:
+            self._buffers = [deque() for _ in self.sources]
+        buffers = self._buffers[source_index]
+        buffer = None
+        if len(buffers) == self.recycle_buffers:
+            buffer = buffers.popleft()
+        if buffer is None or len(buffer) < request:
+            shape, dtype = self._example_specs[source_index]
+            buffer = numpy.empty((request,) + shape, dtype=dtype)
+        buffers.append(buffer)
+        return buffer[:request]
+
+    def _write_example(self, data, index, source_index, example):
+        """Write an example into its buffer, or fall back to a list."""
+        shape, dtype = self._example_specs[source_index]
+        try:
+            array = numpy.asarray(example)
+        except ValueError:
+            array = None
+        if (array is not None and array.shape == shape and
+                array.dtype == dtype):
+            data[source_index][index] = array
+        else:
+            data[source_index] = (list(data[source_index][:index]) +
+                                  [example])
+            self._example_specs[source_index] = None
+            self._buffers[source_index] = deque()
+
+    def _reads_slices(self):
+        return (isinstance(self.data_stream, DataStream) and
+                isinstance(self.data_stream.iteration_scheme,
+                           SequentialExampleScheme) and
+                self.data_stream.dataset.supports_slices and
+                isinstance(self.child_epoch_iterator, DataIterator))
+
+    def _get_slice(self, request):
+        """Read the next examples of the child stream in one request."""
+        indices = list(islice(self.child_epoch_iterator.request_iterator,
+                              request))
+        if not indices or (self.strictness and len(indices) < request):
+            if self.strictness > 1 and indices:
+                raise ValueError
+            raise StopIteration
+        start = indices[0]
+        if indices != list(range(start, start + len(indices))):
+            # Example schemes can iterate over arbitrary lists of indices
+            examples = [self.data_stream.get_data(index)
+                        for index in indices]
+            return tuple(numpy.asarray(source_data)
+                         for source_data in zip(*examples))
+        data = self.data_stream.get_data(slice(start, start + len(indices)))
+        if self.recycle_buffers and self._example_specs is None:
+            self._example_specs = [
+                (source_data.shape[1:], source_data.dtype)
+                if isinstance(source_data, numpy.ndarray) and
+                source_data.dtype != object else None
+                for source_data in data]
+        # Slicing an array returns a view of the dataset, while batches
+        # are expected to be new arrays
+        return tuple(self._copy_view(i, source_data)
+                     if getattr(source_data, 'base', None) is not None
+                     else numpy.asarray(source_data)
+                     for i, source_data in enumerate(data))
+
+    def _copy_view(self, source_index, view):
+        """Copy a view of a dataset, into a recycled buffer if possible."""
+        if (self._example_specs is None or
+                self._example_specs[source_index] !=
+                (view.shape[1:], view.dtype)):
+            return numpy.array(view)
+        buffer = self._get_buffer(source_index, len(view))
+        buffer[...] = view
+        return buffer
 
     def get_data(self, request=None):
         """Get data from the dataset."""
         if request is None:
             raise ValueError
-        data = [[] for _ in self.sources]
-        for i in range(request):
+        if self._reads_slices():
+            return self._get_slice(request)
+        if self._example_specs is None:
+            data = [[] for _ in self.sources]
+        else:
+            data = [[] if spec is None else self._get_buffer(i, request)
+                    for i, spec in enumerate(self._example_specs)]
+        size = 0
+        while size < request:
             try:
-                for source_data, example in zip(
-                        data, next(self.child_epoch_iterator)):
-                    source_data.append(example)
+                example = next(self.child_epoch_iterator)
             except StopIteration:
                 # If some data has been extracted and `strict` is not set,
                 # we should spit out this data before stopping iteration.
-                if not self.strictness and data[0]:
+                if not self.strictness and size:
                     break
-                elif self.strictness > 1 and data[0]:
+                elif self.strictness > 1 and size:
                     raise ValueError
                 raise
-        return tuple(numpy.asarray(source_data) for source_data in data)
+            for i, (source_data, source_example) in enumerate(
+                    zip(data, example)):
+                if isinstance(source_data, list):
+                    source_data.append(source_example)
+                else:
+                    self._write_example(data, size, i, source_example)
+            size += 1
+        batch = tuple(numpy.asarray(source_data)
+                      if isinstance(source_data, list)
+                      else source_data[:size] for source_data in data)
+        if self.recycle_buffers and self._example_specs is None:
+            self._example_specs = [
+                None if source_batch.dtype == object
+                else (source_batch.shape[1:], source_batch.dtype)
+                for source_batch in batch]
+        return batch
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffers'] = None
+        return state
 
 
 class Unpack(Transformer):
@@ -815,13 +1121,72 @@ class Merge(AbstractDataStream):
         return tuple(result)
 
 
+class _SharedMemoryBatch(object):
+    """The location of a batch in a :class:`.SharedMemoryRing`.
+
+    Parameters
+    ----------
+    path : str
+        The path of the ring's file.
+    slot : int
+        The slot the batch was written to.
+    arrays : list
+        A ``(dtype, shape, offset)`` tuple for each array of the batch.
+
+    """
+    def __init__(self, path, slot, arrays):
+        self.path = path
+        self.slot = slot
+        self.arrays = arrays
+
+    @classmethod
+    def write(cls, ring, batch):
+        """Write a batch to a ring.
+
+        Returns
+        -------
+        :class:`_SharedMemoryBatch` or tuple
+            The location of the batch, or the batch itself if it can't be
+            written to shared memory, because it doesn't only consist of
+            arrays, because it is larger than the first batch or because
+            all slots are in use.
+
+        """
+        if not all(isinstance(data, numpy.ndarray) and
+                   not data.dtype.hasobject for data in batch):
+            return batch
+        arrays = [numpy.ascontiguousarray(data) for data in batch]
+        slot, offsets = ring.write(arrays)
+        if slot is None:
+            return batch
+        return cls(ring.path, slot,
+                   [(array.dtype, array.shape, offset)
+                    for array, offset in zip(arrays, offsets)])
+
+    def read(self):
+        """Return read-only views of the batch's arrays.
+
+        The slot is released once the arrays are garbage collected.
+
+        """
+        base = read_shared_memory(self.path, self.slot)
+        batch = []
+        for dtype, shape, offset in self.arrays:
+            nbytes = dtype.itemsize * int(numpy.prod(shape))
+            array = base[offset:offset + nbytes].view(dtype)
+            array.shape = shape
+            array.flags.writeable = False
+            batch.append(array)
+        return tuple(batch)
+
+
 class BackgroundProcess(object):
     """A background process that reads batches and stores them in a queue.
 
     The :meth:`main` method needs to be called in order to start reading
-    batches into the queue. Note that this process will run infinitely;
-    start it as a :attr:`~multiprocessing.Process.daemon` to make sure it
-    will get killed when the main process exits.
+    batches into the queue. Note that this process will run until reading
+    a batch fails; start it as a :attr:`~multiprocessing.Process.daemon`
+    to make sure it will get killed when the main process exits.
 
     Parameters
     ----------
@@ -830,27 +1195,100 @@ class BackgroundProcess(object):
     max_batches : int
         The maximum number of batches to store in the queue. If reached,
         the process wil block until a batch is popped from the queue.
+    worker : int, optional
+        The index of this process, when several processes share the work
+        of each epoch. Defaults to 0.
+    num_workers : int, optional
+        The number of processes sharing the work of each epoch. If more
+        than 1, the data stream is restricted to every `num_workers`-th
+        request of its iteration scheme, starting at the `worker`-th, when
+        :meth:`main` is called, and its random states are reseeded at the
+        start of every epoch (see :func:`~.utils.parallel.reseed_stream`).
+        Defaults to 1.
+    batches : :class:`multiprocessing.Queue`, optional
+        The queue to store batches in, which may be shared with other
+        processes. By default a new queue of size `max_batches` is
+        created.
+    shared_memory : bool, optional
+        If `True`, batches consisting of NumPy arrays are written to a
+        :class:`.SharedMemoryRing`, and only their location is put in the
+        queue. The ring has two more slots than this process's share of
+        the queue, ``max_batches / num_workers`` rounded up. Defaults to
+        `False`.
+    epoch : :class:`multiprocessing.Value`, optional
+        An integer shared with the reading process, holding the epoch it
+        is waiting for. If it is larger than the epoch being read, the
+        rest of that epoch is skipped. By default a new value is created.
+
+    Notes
+    -----
+    Each batch is stored as a tuple ``(epoch, worker, index, batch)``,
+    where `index` is ``i * num_workers + worker`` for the `i`-th batch of
+    this process, i.e. the position of the batch's request in the epoch
+    if the data stream returns one batch per request.
+    At the end of each epoch ``(epoch, worker, None, StopIteration)`` is
+    stored. If reading a batch raises an exception, ``(epoch, worker,
+    None, traceback)`` is stored instead, with the formatted traceback,
+    and :meth:`main` returns.
 
     """
 
-    def __init__(self, data_stream, max_batches):
+    def __init__(self, data_stream, max_batches, worker=0, num_workers=1,
+                 batches=None, shared_memory=False, epoch=None):
         self.data_stream = data_stream
-        self.batches = Queue(max_batches)
+        self.max_batches = max_batches
+        self.batches = Queue(max_batches) if batches is None else batches
+        self.worker = worker
+        self.num_workers = num_workers
+        self.shared_memory = shared_memory
+        self.epoch = Value('l', 0) if epoch is None else epoch
         self.run_background = True
 
     def main(self):
-        while True:
-            iterator = self.data_stream.get_epoch_iterator()
-            for batch in iterator:
-                self.batches.put(batch)
-            self.batches.put(StopIteration)
+        epoch, ring = 0, None
+        try:
+            if self.num_workers > 1:
+                partition_stream(self.data_stream, self.num_workers,
+                                 self.worker)
+            if self.shared_memory:
+                # The workers share the queue, so each needs slots for
+                # its share of it only
+                ring = SharedMemoryRing(
+                    -(-self.max_batches // self.num_workers) + 2)
+                remove_on_sigterm(ring)
+            while True:
+                if self.num_workers > 1:
+                    reseed_stream(self.data_stream,
+                                  SeedSequence(spawn_key=(self.worker, epoch)))
+                iterator = self.data_stream.get_epoch_iterator()
+                for i, batch in enumerate(iterator):
+                    if self.epoch.value > epoch:
+                        # The reader abandoned this epoch
+                        break
+                    if ring is not None:
+                        batch = _SharedMemoryBatch.write(ring, batch)
+                    index = i * self.num_workers + self.worker
+                    self.batches.put((epoch, self.worker, index, batch))
+                else:
+                    self.batches.put(
+                        (epoch, self.worker, None, StopIteration))
+                epoch = max(epoch + 1, self.epoch.value)
+        except Exception:
+            self.batches.put(
+                (epoch, self.worker, None, traceback.format_exc()))
+        finally:
+            if ring is not None:
+                ring.close()
 
     def get_next_data(self):
-        return self.batches.get()
+        data = self.batches.get()[3]
+        if isinstance(data, _SharedMemoryBatch):
+            return data.read()
+        return data
 
 
 class MultiProcessing(Transformer):
-    """Cache batches from the stream in a separate process.
+    """Cache batches from the stream in separate processes.
 
     To speed up training of your model, it can be worthwhile to load and
     process data in separate process. This is a simple implementation of
@@ -863,34 +1301,243 @@ class MultiProcessing(Transformer):
         The data stream to read batches from in the separate process.
     max_store : int, optional
         The maximum number of batches to keep in the queue.
+    num_workers : int, optional
+        The number of processes reading batches. If more than 1, each
+        process runs its own copy of the data stream and reads a share of
+        every epoch. The requests of the iteration schemes are dealt out
+        in turn to the processes (see
+        :func:`~.utils.parallel.partition_stream`), so the innermost data
+        streams must have an iteration scheme. The random states of the
+        transformers are reseeded differently in each process and epoch,
+        which keeps runs reproducible. Defaults to 1.
+    ordered : bool, optional
+        If `True`, the batches of each epoch are returned in the order of
+        the iteration scheme's requests, even when the processes finish
+        them out of order. This assumes the data stream returns one batch
+        per request; otherwise the processes' batches are interleaved in
+        turn. Defaults to `False`, in which case batches are returned as
+        soon as they are read.
+    shared_memory : bool, optional
+        If `True`, batches consisting of NumPy arrays are passed through
+        shared memory instead of being pickled and copied through a pipe.
+        Each process writes its batches to a memory-mapped file, and the
+        arrays returned are read-only views of this file. Each process
+        reserves slots the size of its first batch for its share of the
+        queue, ``max_store / num_workers`` rounded up, plus two. Only the
+        slots in use at once take up memory. Larger batches, and batches
+        read while all slots are taken by batches that are queued or
+        still referenced, are pickled as usual. Defaults to `False`.
 
     Notes
     -----
-    This approach incurs an overhead from the need to serialize batches in
-    order to send them to the main process. This should be acceptable if
-    your model's training calls take significantly longer than reading a
-    batch of data does, but for fast models or slow data pipelines a more
-    robust approach might need to be considered.
+    Unless `shared_memory` is used, this approach incurs an overhead from
+    the need to serialize batches in order to send them to the main
+    process. This should be acceptable if your model's training calls
+    take significantly longer than reading a batch of data does, but for
+    fast models or large batches shared memory can help.
+
+    The processes don't wait for each other at the end of an epoch.
+    Batches of the next epoch that arrive early are held back until every
+    process has finished the current one.
+
+    If an epoch is abandoned before it ends, by requesting a new epoch
+    iterator or by calling :meth:`next_epoch` or :meth:`reset`, the
+    processes skip the rest of it and the batches they already read are
+    discarded. The processes can't rewind their data streams, so
+    :meth:`reset` starts a new epoch as well.
+
+    If a process fails to read a batch, a :class:`RuntimeError` with its
+    traceback is raised. Call :meth:`close` to stop the processes.
 
     """
 
-    def __init__(self, data_stream, max_store=100, **kwargs):
+    def __init__(self, data_stream, max_store=100, num_workers=1,
+                 ordered=False, shared_memory=False, **kwargs):
         if data_stream.axis_labels:
             kwargs.setdefault('axis_labels', data_stream.axis_labels.copy())
         super(MultiProcessing, self).__init__(
             data_stream, data_stream.produces_examples, **kwargs)
-        self.background = BackgroundProcess(data_stream, max_store)
-        self.proc = Process(target=self.background.main)
-        self.proc.daemon = True
-        self.proc.start()
+        if num_workers < 1:
+            raise ValueError('num_workers must be at least 1')
+        self.num_workers = num_workers
+        self.ordered = ordered
+        self.batches = Queue(max_store)
+        self.epoch = Value('l', 0)
+        self.backgrounds = [
+            BackgroundProcess(data_stream, max_store, worker, num_workers,
+                              self.batches, shared_memory, self.epoch)
+            for worker in range(num_workers)]
+        self.procs = [Process(target=background.main)
+                      for background in self.backgrounds]
+        for proc in self.procs:
+            proc.daemon = True
+            proc.start()
+        self._epoch_started = False
+        self._reassembler = EpochReassembler(num_workers, ordered, epoch=0)
+
+    @property
+    def background(self):
+        return self.backgrounds[0]
+
+    @property
+    def proc(self):
+        return self.procs[0]
+
+    def close(self):
+        """Stop the background processes and wait for them to exit."""
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            proc.join()
+        # The processes removed their shared memory files on exit
+        release_removed_maps()
+        super(MultiProcessing, self).close()
+
+    def reset(self):
+        self.next_epoch()
+
+    def next_epoch(self):
+        self._reassembler.next_epoch()
+        self.epoch.value = self._reassembler.epoch
+        self._epoch_started = False
+
+    def get_epoch_iterator(self, **kwargs):
+        if self._epoch_started:
+            self.next_epoch()
+        # The wrapped data stream is only iterated over in the background
+        return super(Transformer, self).get_epoch_iterator(**kwargs)
 
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
-        data = self.background.get_next_data()
-        if data == StopIteration:
+        while True:
+            data = self._reassembler.pop()
+            if data is not None:
+                self._epoch_started = True
+                return data
+            if self._reassembler.epoch_finished():
+                self.next_epoch()
+                raise StopIteration
+            self._receive()
+
+    def _receive(self):
+        """Take a batch off the queue and store it with its epoch."""
+        while True:
+            try:
+                epoch, worker, index, data = self.batches.get(timeout=1)
+                break
+            except queue.Empty:
+                for worker, proc in enumerate(self.procs):
+                    if not proc.is_alive():
+                        raise RuntimeError(
+                            'background process {} exited with code '
+                            '{}'.format(worker, proc.exitcode))
+        if isinstance(data, _SharedMemoryBatch):
+            # Stale batches must be read too, to release their slot
+            data = data.read()
+        if index is None and data is not StopIteration:
+            raise RuntimeError('background process {} failed to read a '
+                               'batch:\n{}'.format(worker, data.rstrip()))
+        self._reassembler.add(epoch, worker, index, data)
+
+
+class ThreadedTransformer(Transformer):
+    """Apply a transformer to several examples or batches in threads.
+
+    Many transformations, e.g. decoding images with PIL or most NumPy
+    operations, release the GIL, so that running them in a pool of
+    threads uses several cores without the cost of sending data between
+    processes (see :class:`MultiProcessing`).
+
+    Parameters
+    ----------
+    transformer : :class:`Transformer`
+        The transformer to apply. It must act through `transform_example`
+        or `transform_batch` (including those of a
+        :class:`SourcewiseTransformer` or :class:`AgnosticTransformer`),
+        instead of overriding `get_data`. Its data stream is read from
+        directly.
+    num_threads : int, optional
+        The number of threads. Defaults to 4.
+    max_store : int, optional
+        The number of examples or batches read ahead of the one being
+        returned. Defaults to twice the number of threads.
+
+    Notes
+    -----
+    Data is returned in the order it is read from the wrapped data stream.
+    Transformers that draw random numbers do so from several threads at
+    once, so the numbers drawn for each example or batch are not
+    reproducible. Data read ahead is lost when the transformer is
+    pickled.
+
+    Requires the `futures` package on Python 2.
+
+    """
+    def __init__(self, transformer, num_threads=4, max_store=None,
+                 **kwargs):
+        if not CONCURRENT_FUTURES_AVAILABLE:
+            raise ImportError("the futures package is required to use "
+                              "ThreadedTransformer on Python 2")
+        if (get_unbound_function(type(transformer).get_data) is not
+                get_unbound_function(Transformer.get_data)):
+            raise ValueError('{} overrides get_data, so it cannot be '
+                             'applied in threads'.format(
+                                 transformer.__class__.__name__))
+        if (transformer.produces_examples !=
+                transformer.data_stream.produces_examples):
+            raise ValueError('{} changes examples into batches or vice '
+                             'versa, so it cannot be applied in '
+                             'threads'.format(
+                                 transformer.__class__.__name__))
+        if transformer.axis_labels:
+            kwargs.setdefault('axis_labels', transformer.axis_labels.copy())
+        super(ThreadedTransformer, self).__init__(
+            transformer.data_stream, transformer.produces_examples,
+            **kwargs)
+        self.transformer = transformer
+        self.num_threads = num_threads
+        self.max_store = max_store or 2 * num_threads
+        self._executor = None
+        self._futures = deque()
+
+    @property
+    def sources(self):
+        return self.transformer.sources
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._futures.clear()
+        super(ThreadedTransformer, self).close()
+
+    def get_epoch_iterator(self, **kwargs):
+        # Data read ahead during an earlier epoch is not needed
+        self._futures.clear()
+        return super(ThreadedTransformer, self).get_epoch_iterator(**kwargs)
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.num_threads)
+        if self.produces_examples:
+            transform = self.transformer.transform_example
+        else:
+            transform = self.transformer.transform_batch
+        for data in islice(self.child_epoch_iterator,
+                           self.max_store + 1 - len(self._futures)):
+            self._futures.append(self._executor.submit(transform, data))
+        if not self._futures:
             raise StopIteration
-        return data
+        return self._futures.popleft().result()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_futures'] = deque()
+        return state
 
 
 class Rename(AgnosticTransformer):
@@ -1,5 +1,6 @@
 from __future__ import division
 from io import BytesIO
+from itertools import repeat
 import math
 
 import numpy
@@ -80,7 +81,8 @@ class ImagesFromBytes(SourcewiseTransformer):
         return image
 
     def transform_source_batch(self, batch, source_name):
-        return [self.transform_source_example(im, source_name) for im in batch]
+        return self.map_examples(self.transform_source_example, batch,
+                                 repeat(source_name))
 
     def _make_axis_labels(self, data_stream, which_sources, produces_examples):
         # This is ugly and probably deserves a refactoring of how we handle
@@ -143,7 +145,8 @@ class MinimumImageDimensions(SourcewiseTransformer, ExpectsAxisLabels):
         self.verify_axis_labels(('batch', 'channel', 'height', 'width'),
                                 self.data_stream.axis_labels[source_name],
                                 source_name)
-        return [self._example_transform(im, source_name) for im in batch]
+        return self.map_examples(self._example_transform, batch,
+                                 repeat(source_name))
 
     def transform_source_example(self, example, source_name):
         self.verify_axis_labels(('channel', 'height', 'width'),
@@ -197,11 +200,16 @@ class SamplewiseCropTransformer(Transformer):
     weight_source: str
         Name of the source that is to be used to scale and influence the
         random cropping.
+    rng : :class:`numpy.random.RandomState`, optional
+        The random number generator the crops are drawn from. Defaults
+        to one seeded with the default seed.
     """
     def __init__(self, data_stream, window_shape,
                  which_sources=None, weight_source=None, **kwargs):
         self.window_shape = window_shape
         self.rng = kwargs.pop('rng', None)
+        if self.rng is None:
+            self.rng = numpy.random.RandomState(config.default_seed)
         kwargs.setdefault('axis_labels', data_stream.axis_labels)
         kwargs.setdefault('produces_examples', data_stream.produces_examples)
         self.weight_source = weight_source
@@ -240,11 +248,11 @@ class SamplewiseCropTransformer(Transformer):
                 # We crop the heatmap indefinetely until the random float r
                 # is below the sum of its weights (so regions with few bone
                 # will get low p, so low chances of being picked)
-                seed = numpy.random.randint(9999)
+                seed = self.rng.randint(9999)
                 heatmap_crop = method(heatmap, self.weight_source,
                                       seed)
                 p = numpy.minimum(numpy.sum(heatmap_crop), 1)
-                r = numpy.random.uniform()
+                r = self.rng.uniform()
                 if r < p:
                     break
             for i, source_name in enumerate(self.data_stream.sources):
@@ -255,7 +263,7 @@ class SamplewiseCropTransformer(Transformer):
                 elif source_name in self.which_sources:
                     data[i] = method(data[i], source_name, seed)
         else:
-            seed = numpy.random.randint(9999)
+            seed = self.rng.randint(9999)
             for i, source_name in enumerate(self.data_stream.sources):
                 if source_name in self.which_sources:
                     data[i] = method(data[i], source_name, seed)
@@ -674,13 +682,12 @@ class FixedSizeCrop(SourcewiseTransformer, ExpectsAxisLabels):
                                 source_name)
         if isinstance(source, list) and all(isinstance(b, numpy.ndarray) and
                                             b.ndim == 3 for b in source):
-            return [self.transform_source_example(im, source_name)
-                    for im in source]
+            return self.map_examples(self.transform_source_example, source,
+                                     repeat(source_name))
         elif isinstance(source, numpy.ndarray) and \
                 source.dtype == numpy.object:
-            return numpy.array([self.transform_source_example(im,
-                                                              source_name)
-                                for im in source])
+            return numpy.array(self.map_examples(
+                self.transform_source_example, source, repeat(source_name)))
         elif isinstance(source, numpy.ndarray) and source.ndim == 4:
             # Hardcoded assumption of (batch, channels, height, width).
             # This is what the fast Cython code supports.
@@ -768,12 +775,12 @@ class FixedSizeCropND(SourcewiseTransformer):
     def transform_source_batch(self, source, source_name):
         if isinstance(source, list) and all(isinstance(b, numpy.ndarray)
                                             for b in source):
-            return [self.transform_source_example(im, source_name)
-                    for im in source]
+            return self.map_examples(self.transform_source_example, source,
+                                     repeat(source_name))
         elif isinstance(source, numpy.ndarray) and \
                 source.dtype == numpy.object:
-            return numpy.array([self.transform_source_example(im, source_name)
-                                for im in source])
+            return numpy.array(self.map_examples(
+                self.transform_source_example, source, repeat(source_name)))
         elif isinstance(source, numpy.ndarray):
             if any(vol_sh < win_sh for vol_sh, win_sh
                    in zip(source.shape[2:], self.window_shape)):
@@ -868,10 +875,9 @@ class RandomSpatialFlip(SourcewiseTransformer):
             to_flip_h = to_flip_h == 1  # convert to bool list
             to_flip_v = to_flip_v == 1
 
-            output = [self.transform_source_example(example, source_name,
-                                                    ex_flip_h, ex_flip_v)
-                      for example, ex_flip_h, ex_flip_v
-                      in zip(source, to_flip_h, to_flip_v)]
+            output = self.map_examples(self.transform_source_example,
+                                       source, repeat(source_name),
+                                       to_flip_h, to_flip_v)
 
             return output
 
@@ -883,11 +889,11 @@ class RandomSpatialFlip(SourcewiseTransformer):
 
             output = numpy.empty(source.shape[0], dtype=object)
 
-            for i in range(source.shape[0]):
-                output[i] = self.transform_source_example(source[i],
-                                                          source_name,
-                                                          to_flip_h[i],
-                                                          to_flip_v[i])
+            examples = self.map_examples(self.transform_source_example,
+                                         source, repeat(source_name),
+                                         to_flip_h, to_flip_v)
+            for i, example in enumerate(examples):
+                output[i] = example
 
             return output
 
@@ -1023,12 +1029,12 @@ class GammaCorrectionND(SourcewiseTransformer):
     def transform_source_batch(self, source, source_name):
         if isinstance(source, list) and all(isinstance(b, numpy.ndarray)
                                             for b in source):
-            return [self.transform_source_example(im, source_name)
-                    for im in source]
+            return self.map_examples(self.transform_source_example, source,
+                                     repeat(source_name))
         elif isinstance(source, numpy.ndarray) and \
                 source.dtype == numpy.object:
-            return numpy.array([self.transform_source_example(im, source_name)
-                                for im in source])
+            return numpy.array(self.map_examples(
+                self.transform_source_example, source, repeat(source_name)))
         elif isinstance(source, numpy.ndarray):
             return self.gamma_correction(source, self.gamma)
         else:
@@ -172,7 +172,7 @@ class Subset(object):
         return cls([], original_num_examples)
 
     @staticmethod
-    def sorted_fancy_indexing(indexable, request):
+    def sorted_fancy_indexing(indexable, request, max_gap_bytes=65536):
         """Safe fancy indexing.
 
         Some objects, such as h5py datasets, only support list indexing
@@ -185,16 +185,51 @@ class Subset(object):
         Parameters
         ----------
         request : list of int
-            Unsorted list of example indices.
+            Unsorted list of example indices, possibly with duplicates.
         indexable : any fancy-indexable object
             Indexable we'd like to do unsorted fancy indexing on.
+        max_gap_bytes : int, optional
+            Sorted indices are read together as a single slice, from which
+            the requested elements are then selected, if the elements in
+            between them take up at most this many bytes. Defaults to 64
+            KiB.
+
+        Notes
+        -----
+        h5py selects each element of a fancy index separately, which makes
+        reading runs of nearby indices much slower than reading the slice
+        that covers them, while reading far apart indices as a slice reads
+        a lot of data for nothing. The gap is measured in bytes, so that
+        fewer rows are skipped over when rows are large. The indices that
+        aren't close to any other are read together with a single fancy
+        index.
 
         """
         if len(request) > 1:
-            indices = numpy.argsort(request)
+            indices = numpy.unique(request)
+            if len(indices) < len(request):
+                # h5py doesn't accept repeated indices
+                data = Subset.sorted_fancy_indexing(indexable, indices,
+                                                    max_gap_bytes)
+                return data[numpy.searchsorted(indices, request)]
+            request = numpy.asarray(request)
+            order = numpy.argsort(request)
             data = numpy.empty(shape=(len(request),) + indexable.shape[1:],
                                dtype=indexable.dtype)
-            data[indices] = indexable[numpy.array(request)[indices], ...]
+            row_nbytes = max(
+                data.itemsize * int(numpy.prod(data.shape[1:])), 1)
+            gaps = (numpy.diff(indices) - 1) * row_nbytes
+            breaks = numpy.flatnonzero(gaps > max_gap_bytes) + 1
+            starts = numpy.concatenate([[0], breaks]).astype(int)
+            stops = numpy.concatenate([breaks, [len(indices)]]).astype(int)
+            isolated = stops - starts == 1
+            if isolated.any():
+                positions = starts[isolated]
+                data[order[positions]] = indexable[indices[positions], ...]
+            for start, stop in zip(starts[~isolated], stops[~isolated]):
+                first = indices[start]
+                run = indexable[first:indices[stop - 1] + 1]
+                data[order[start:stop]] = run[indices[start:stop] - first]
         else:
             data = indexable[request]
         return data
@@ -344,6 +379,25 @@ class Subset(object):
                              'whose start value is greater than its stop '
                              'value')
 
+    def check_request(self, request):
+        """Check that a request is valid within this subset.
+
+        Parameters
+        ----------
+        request : int, :class:`list` or :class:`slice`
+            A request made *within the context of this subset*.
+
+        Raises
+        ------
+        ValueError
+            If the request is empty or goes beyond the examples of this
+            subset.
+
+        """
+        if isinstance(request, numbers.Integral):
+            request = [request]
+        self._request_sanity_check(request, self.num_examples)
+
     def _request_sanity_check(self, list_or_slice, num_examples):
         if self._is_list(list_or_slice):
             self._list_request_sanity_check(list_or_slice, num_examples)
@@ -396,6 +450,77 @@ class Subset(object):
             return indices
 
 
+class LRUCache(object):
+    """A cache bounded in bytes, which evicts the least recently used items.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the cached items, in bytes.
+    item_overhead : int, optional
+        The number of bytes added to the size of each item, to account
+        for its key and the cache's bookkeeping, which matter when many
+        small items are cached. Defaults to 256.
+
+    Attributes
+    ----------
+    nbytes : int
+        The total size of the cached items, in bytes.
+    hits : int
+        The number of lookups that found their item in the cache.
+    misses : int
+        The number of lookups that didn't.
+
+    """
+    def __init__(self, max_bytes, item_overhead=256):
+        self.max_bytes = max_bytes
+        self.item_overhead = item_overhead
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """Look up an item, marking it as the most recently used."""
+        if key not in self._items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        item = self._items.pop(key)
+        self._items[key] = item
+        return item[0]
+
+    def put(self, key, value, nbytes):
+        """Cache an item, evicting the least recently used ones to fit it.
+
+        Items larger than the whole cache aren't cached.
+
+        """
+        if key in self._items:
+            self.nbytes -= self._items.pop(key)[1]
+        nbytes += self.item_overhead
+        if nbytes > self.max_bytes:
+            return
+        while self.nbytes + nbytes > self.max_bytes:
+            _, (_, evicted_nbytes) = self._items.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+        self._items[key] = (value, nbytes)
+        self.nbytes += nbytes
+
+    def clear(self):
+        """Empty the cache and reset the counters."""
+        self._items.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
 def iterable_fancy_indexing(iterable, request):
     if isinstance(iterable, numpy.ndarray):
         return iterable[request]
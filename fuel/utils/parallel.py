@@ -4,12 +4,27 @@ Currently including:
 
 * A very simple PUSH-PULL reusable producer-consumer pattern
   using a ZeroMQ socket instead of the (slow, unnecessarily
-  copying) multiprocessing.Queue. See :func:`producer_consumer`.
+  copying) multiprocessing.Queue, with one or more producers.
+  See :func:`producer_consumer`, and :func:`split_work` to divide
+  the work units of a job between the producers.
+* Helpers to divide the work of a data stream between several worker
+  processes. See :func:`partition_stream` and :func:`reseed_stream`,
+  and :class:`SeedSequence` to derive independent seeds for each
+  worker and epoch. :class:`EpochReassembler` puts the batches of the
+  workers back together.
 
 """
+from collections import defaultdict, OrderedDict
+from functools import partial
 from multiprocessing import Process
+import weakref
+
+import numpy
 import zmq
 
+from fuel import config
+from fuel.schemes import PartitionedScheme
+
 
 def _producer_wrapper(f, port, addr='tcp://127.0.0.1'):
     """A shim that sets up a socket and starts the producer callable.
@@ -56,15 +71,42 @@ def _spawn_producer(f, port, addr='tcp://127.0.0.1'):
     return process
 
 
+def split_work(work_units, num_parts):
+    """Divide a sequence of work units into roughly equal parts.
+
+    Parameters
+    ----------
+    work_units : sequence
+        The work units to divide, e.g. the names of files to process.
+    num_parts : int
+        The number of parts to divide the work units into.
+
+    Returns
+    -------
+    list of lists
+        At most `num_parts` non-empty lists. Work units are dealt out
+        in turn, so that neighbouring units end up in different parts.
+
+    """
+    if num_parts < 1:
+        raise ValueError('num_parts must be at least 1')
+    work_units = list(work_units)
+    parts = [work_units[i::num_parts] for i in range(num_parts)]
+    return [part for part in parts if part]
+
+
 def producer_consumer(producer, consumer, addr='tcp://127.0.0.1',
-                      port=None, context=None):
+                      port=None, context=None, work_units=None,
+                      num_producers=1):
     """A producer-consumer pattern.
 
     Parameters
     ----------
-    producer : callable
+    producer : callable or list of callables
         Callable that takes a single argument, a handle
-        for a ZeroMQ PUSH socket. Must be picklable.
+        for a ZeroMQ PUSH socket. Must be picklable. If a list
+        is given, a process is started for each callable in it,
+        e.g. for each partition of the work.
     consumer : callable
         Callable that takes a single argument, a handle
         for a ZeroMQ PULL socket.
@@ -75,6 +117,14 @@ def producer_consumer(producer, consumer, addr='tcp://127.0.0.1',
         The port on which the consumer should listen.
     context : zmq.Context, optional
         The ZeroMQ Context to use. One will be created otherwise.
+    work_units : sequence, optional
+        If given, the work units are divided between `num_producers`
+        processes using :func:`split_work`, and each process calls
+        `producer` with its share passed as the `work_units` keyword
+        argument. `producer` must then be a single callable.
+    num_producers : int, optional
+        The number of producers to divide `work_units` between.
+        Defaults to 1. Ignored if `work_units` isn't given.
 
     Returns
     -------
@@ -85,7 +135,13 @@ def producer_consumer(producer, consumer, addr='tcp://127.0.0.1',
     -----
     This sets up a PULL socket in the calling process and forks
     a process that calls `producer` on a PUSH socket. When the
-    consumer returns, the producer process is terminated.
+    consumer returns or raises an exception, the producer process
+    is terminated and waited for.
+
+    With several producers, the PULL socket receives messages from
+    each of them in turn (fair-queueing), so the order in which
+    messages of different producers arrive isn't deterministic.
+    Multipart messages are never interleaved.
 
     Wrap `consumer` or `producer` in a `functools.partial` object
     in order to send additional arguments; the callables passed in
@@ -101,13 +157,297 @@ def producer_consumer(producer, consumer, addr='tcp://127.0.0.1',
         consumer_socket = context.socket(zmq.PULL)
         if port is None:
             port = consumer_socket.bind_to_random_port(addr)
+        if work_units is not None:
+            if isinstance(producer, (list, tuple)):
+                raise ValueError('work_units requires a single producer')
+            producer = [partial(producer, work_units=part)
+                        for part in split_work(work_units, num_producers)]
+        elif not isinstance(producer, (list, tuple)):
+            producer = [producer]
+        processes = []
         try:
-            process = _spawn_producer(producer, port)
+            for producer_ in producer:
+                processes.append(_spawn_producer(producer_, port, addr))
             result = consumer(consumer_socket)
         finally:
-            process.terminate()
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
         return result
     finally:
         # Works around a Python 3.x bug.
         if context_created:
             context.destroy()
+
+
+def iterate_streams(data_stream):
+    """Iterate over a data stream and all the data streams it wraps.
+
+    Parameters
+    ----------
+    data_stream : :class:`.AbstractDataStream`
+        The outermost data stream.
+
+    Yields
+    ------
+    :class:`.AbstractDataStream`
+        The given data stream, followed by the data streams it wraps, in
+        depth-first order.
+
+    """
+    yield data_stream
+    if hasattr(data_stream, 'data_streams'):
+        children = data_stream.data_streams
+    elif hasattr(data_stream, 'data_stream'):
+        children = [data_stream.data_stream]
+    else:
+        children = []
+    for child in children:
+        for stream in iterate_streams(child):
+            yield stream
+
+
+def partition_stream(data_stream, num_partitions, partition):
+    """Restrict a data stream to a partition of each epoch.
+
+    The iteration schemes of the innermost data streams (the ones reading
+    from a dataset) are wrapped in a :class:`.PartitionedScheme`, so that
+    ``num_partitions`` copies of the same data stream, each restricted to
+    a different partition, together cover each epoch exactly once.
+
+    Parameters
+    ----------
+    data_stream : :class:`.AbstractDataStream`
+        The data stream to restrict. It is modified in place.
+    num_partitions : int
+        The total number of partitions.
+    partition : int
+        The partition to restrict the data stream to.
+
+    Raises
+    ------
+    ValueError
+        If one of the innermost data streams doesn't have an iteration
+        scheme, in which case its requests can't be partitioned.
+
+    """
+    leaves = [stream for stream in iterate_streams(data_stream)
+              if not hasattr(stream, 'data_stream') and
+              not hasattr(stream, 'data_streams')]
+    for stream in leaves:
+        if stream.iteration_scheme is None:
+            raise ValueError('cannot partition {} instance without an '
+                             'iteration scheme'.format(
+                                 stream.__class__.__name__))
+    for stream in leaves:
+        stream.iteration_scheme = PartitionedScheme(
+            stream.iteration_scheme, num_partitions, partition)
+
+
+class SeedSequence(object):
+    """Derive independent seeds from a single seed.
+
+    Modelled after NumPy's ``SeedSequence`` (which older versions of
+    NumPy lack): a sequence is identified by a seed and a spawn key, and
+    different spawn keys, e.g. the index of a worker and an epoch, give
+    independent random states. The same seed and spawn key always give
+    the same random state.
+
+    Parameters
+    ----------
+    entropy : int, optional
+        The seed, between 0 and ``2 ** 32 - 1``. Defaults to
+        ``config.default_seed``.
+    spawn_key : tuple of int, optional
+        Identifies this sequence among those derived from the same seed.
+        Defaults to ``()``.
+
+    """
+    def __init__(self, entropy=None, spawn_key=()):
+        self.entropy = config.default_seed if entropy is None else entropy
+        self.spawn_key = tuple(spawn_key)
+        self.num_spawned = 0
+
+    def spawn(self, n):
+        """Derive new sequences.
+
+        Parameters
+        ----------
+        n : int
+            The number of sequences to derive. Later calls derive
+            different sequences.
+
+        Returns
+        -------
+        list of :class:`SeedSequence`
+
+        """
+        children = [SeedSequence(self.entropy, self.spawn_key + (i,))
+                    for i in range(self.num_spawned, self.num_spawned + n)]
+        self.num_spawned += n
+        return children
+
+    def generate_state(self, n_words=4):
+        """Return a list of `n_words` 31-bit integers to seed with."""
+        # The length of the key is included, so that keys ending in zeros
+        # differ from shorter keys
+        rng = numpy.random.RandomState(
+            [self.entropy, len(self.spawn_key)] + list(self.spawn_key))
+        return rng.randint(2 ** 31, size=n_words).tolist()
+
+    def random_state(self):
+        """Return a random state seeded from this sequence."""
+        return numpy.random.RandomState(self.generate_state())
+
+
+# The seeds drawn from the original random states of the reseeded data
+# streams, so that reseeding doesn't depend on the numbers drawn since
+_base_seeds = weakref.WeakKeyDictionary()
+
+
+def reseed_stream(data_stream, key):
+    """Give every transformer of a data stream a new random state.
+
+    Parameters
+    ----------
+    data_stream : :class:`.AbstractDataStream`
+        The data stream to reseed. It is modified in place.
+    key : int or :class:`SeedSequence`
+        Copies of a data stream reseeded with different keys draw
+        different random numbers. An integer is short for a
+        :class:`SeedSequence` with the default seed and the integer as
+        its spawn key. Parallel code can use e.g. the worker index and
+        the epoch as the spawn key, so that each worker draws different
+        numbers in each epoch.
+
+    Notes
+    -----
+    The new seed of each random state combines the key with a draw of its
+    original state, so that reseeding is reproducible and respects random
+    states passed in by the user. This draw is only taken the first time
+    a data stream is reseeded, so that reseeding a data stream with the
+    same key always gives the same random states, however many numbers
+    were drawn in between. The random states of iteration schemes are left
+    untouched, since copies of a partitioned stream must agree on the
+    order of the examples.
+
+    """
+    if not isinstance(key, SeedSequence):
+        key = SeedSequence(spawn_key=(key,))
+    state = key.generate_state()
+    streams = [stream for stream in iterate_streams(data_stream)
+               if isinstance(getattr(stream, 'rng', None),
+                             numpy.random.RandomState)]
+    for i, stream in enumerate(streams):
+        if stream not in _base_seeds:
+            _base_seeds[stream] = stream.rng.randint(2 ** 31)
+        stream.rng = numpy.random.RandomState(
+            [_base_seeds[stream], i] + state)
+
+
+class EpochReassembler(object):
+    """Restore the epochs of batches read by several producers.
+
+    When each producer reads a partition of every epoch (see
+    :func:`partition_stream`), their batches arrive interleaved, and a
+    producer can start on the next epoch before the others have finished
+    the current one. Batches of later epochs are held back until their
+    epoch is the current one, and an epoch only ends once every producer
+    has finished it.
+
+    Parameters
+    ----------
+    num_producers : int, optional
+        The number of producers. If not given, it must be set before an
+        epoch can end.
+    ordered : bool, optional
+        If `True`, the batches of each epoch are returned in the order of
+        their indices. Defaults to `False`, in which case they are
+        returned in the order they were added.
+    epoch : int, optional
+        The current epoch. If not given, it is taken from the first batch
+        added.
+
+    Notes
+    -----
+    When returning batches in order, batch ``i`` of an epoch is expected
+    to come from producer ``i % num_producers``, so that the indices a
+    producer skipped (e.g. because its data stream filtered out a batch)
+    can be skipped as soon as the producer has finished the epoch.
+
+    """
+    def __init__(self, num_producers=None, ordered=False, epoch=None):
+        self.num_producers = num_producers
+        self.ordered = ordered
+        self.epoch = epoch
+        self._batches = defaultdict(OrderedDict)
+        self._finished = defaultdict(set)
+        self._returned = set()
+        self._next_index = 0
+
+    def add(self, epoch, producer, index, data):
+        """Add a batch, or the end of a producer's epoch.
+
+        Parameters
+        ----------
+        epoch : int
+            The epoch the batch belongs to. Batches of epochs that already
+            ended are dropped.
+        producer : int
+            The index of the producer that read the batch.
+        index : int or None
+            The index of the batch within its epoch, or `None` if the
+            producer finished the epoch.
+        data : object
+            The batch.
+
+        """
+        if self.epoch is None:
+            self.epoch = epoch
+        if epoch < self.epoch:
+            return
+        if index is None:
+            self._finished[epoch].add(producer)
+        elif epoch > self.epoch or index not in self._returned:
+            self._batches[epoch][index] = data
+
+    def pop(self):
+        """Return the next batch of the current epoch, if added."""
+        if self.epoch is None:
+            return None
+        batches = self._batches[self.epoch]
+        if not batches:
+            return None
+        if not self.ordered:
+            index, data = batches.popitem(last=False)
+        else:
+            finished = self._finished[self.epoch]
+            while (self._next_index not in batches and
+                   self._next_index % self.num_producers in finished):
+                self._next_index += 1
+            if self._next_index not in batches:
+                return None
+            index = self._next_index
+            data = batches.pop(index)
+            self._next_index += 1
+        self._returned.add(index)
+        return data
+
+    def epoch_finished(self):
+        """Whether every batch of the current epoch was returned."""
+        return (self.epoch is not None and
+                not self._batches[self.epoch] and
+                len(self._finished[self.epoch]) == self.num_producers)
+
+    def next_epoch(self):
+        """Move on to the next epoch, dropping the rest of this one."""
+        for epoch in list(self._batches):
+            if epoch <= self.epoch:
+                del self._batches[epoch]
+        for epoch in list(self._finished):
+            if epoch <= self.epoch:
+                del self._finished[epoch]
+        self.epoch += 1
+        self._returned = set()
+        self._next_index = 0
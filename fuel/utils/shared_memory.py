@@ -0,0 +1,215 @@
+"""Passing batches between processes through shared memory.
+
+See :class:`SharedMemoryRing`, to which the sender writes batches, and
+:func:`read_shared_memory`, with which the receiver reads them. The
+receiver can call :func:`release_removed_maps` once the senders are gone.
+
+"""
+import mmap
+import os
+import signal
+import tempfile
+import weakref
+
+import numpy
+
+# Offsets of slots and arrays in shared memory are aligned to cache lines
+_ALIGNMENT = 64
+
+# Memory maps of the shared memory files opened by this process, with the
+# number of received batches that still occupy a slot, by path and inode,
+# and weak references to those batches
+_shared_memory_maps = {}
+_shared_memory_references = {}
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+class SharedMemoryRing(object):
+    """A ring of slots in shared memory to pass batches through.
+
+    Instead of copying a batch through a socket, the sender writes it into
+    a free slot of a memory-mapped file and only sends the location of the
+    batch. The receiver reads the arrays straight from the mapped file,
+    and the slot is released once those arrays are garbage collected. This
+    only works if the sender and receiver run on the same host.
+
+    Parameters
+    ----------
+    num_slots : int
+        The number of slots. Batches are sent over the socket as usual
+        while all slots are in use.
+
+    Notes
+    -----
+    The file is created when the first batch is written, with slots large
+    enough for that batch. Larger batches are sent over the socket. If
+    possible, the file is created in ``/dev/shm`` so that it is never
+    written to disk.
+
+    The file starts with one byte per slot which is non-zero while the slot
+    is in use, followed by the slots themselves. Batches are written to
+    the lowest free slot, so only as many slots take up memory as there
+    are batches in use at once.
+
+    """
+    def __init__(self, num_slots):
+        self.num_slots = num_slots
+        self.path = None
+        self.slot_size = None
+        self._map = None
+
+    def _create(self, slot_size):
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, self.path = tempfile.mkstemp(prefix='fuel-', dir=directory)
+        try:
+            self.slot_size = slot_size
+            size = _align(self.num_slots) + self.num_slots * slot_size
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def write(self, arrays):
+        """Write a batch to a free slot.
+
+        Parameters
+        ----------
+        arrays : list
+            A list of C-contiguous :class:`numpy.ndarray`.
+
+        Returns
+        -------
+        slot : int or None
+            The slot the batch was written to, or `None` if it doesn't fit
+            or if all slots are in use.
+        offsets : list or None
+            The offset of each array in the file.
+
+        """
+        sizes = [_align(array.nbytes) for array in arrays]
+        if self._map is None:
+            self._create(sum(sizes))
+        if sum(sizes) > self.slot_size:
+            return None, None
+        # Reusing the lowest free slot leaves the pages of slots that
+        # are never needed untouched, so they never take up memory
+        slot = self._map.find(b'\x00', 0, self.num_slots)
+        if slot < 0:
+            return None, None
+        self._map[slot:slot + 1] = b'\x01'
+        offset = _align(self.num_slots) + slot * self.slot_size
+        offsets = []
+        for array, size in zip(arrays, sizes):
+            view = numpy.frombuffer(self._map, dtype=array.dtype,
+                                    count=array.size, offset=offset)
+            view[...] = array.ravel()
+            offsets.append(offset)
+            offset += size
+        return slot, offsets
+
+    def close(self):
+        """Remove the file backing the ring."""
+        if self._map is not None:
+            self._map.close()
+            os.remove(self.path)
+            self._map, self.path = None, None
+
+
+def _is_removed(key):
+    path, inode = key
+    try:
+        return os.stat(path).st_ino != inode
+    except OSError:
+        return True
+
+
+def _map_shared_memory(path):
+    """Memory-map a file created by a :class:`SharedMemoryRing`.
+
+    Returns the key of the map and the map, whose count of batches is
+    incremented. A ring that was closed may leave a file with the same
+    path behind, so maps are told apart by the inode of their file too.
+
+    """
+    key = path, os.stat(path).st_ino
+    if key not in _shared_memory_maps:
+        # A new file usually means that an older one was removed
+        release_removed_maps()
+        with open(path, 'r+b') as f:
+            _shared_memory_maps[key] = [mmap.mmap(f.fileno(), 0), 0]
+    entry = _shared_memory_maps[key]
+    entry[1] += 1
+    return key, entry[0]
+
+
+def _release_slot(key, map_, slot, reference):
+    map_[slot:slot + 1] = b'\x00'
+    del _shared_memory_references[id(reference)]
+    entry = _shared_memory_maps.get(key)
+    if entry is not None and entry[0] is map_:
+        entry[1] -= 1
+        if not entry[1] and _is_removed(key):
+            del _shared_memory_maps[key]
+
+
+def release_removed_maps():
+    """Drop the memory maps of removed files that no batch uses anymore.
+
+    The map of a file is kept while the file exists, so that it isn't
+    mapped again for every batch. Once the file is removed, i.e. its
+    :class:`SharedMemoryRing` is closed, the map is dropped when the last
+    batch read from it is garbage collected, which frees the memory. Call
+    this function if no batches were left when the file was removed.
+
+    """
+    for key, (map_, num_batches) in list(_shared_memory_maps.items()):
+        if not num_batches and _is_removed(key):
+            del _shared_memory_maps[key]
+
+
+def read_shared_memory(path, slot):
+    """Map a file created by a :class:`SharedMemoryRing` to read a slot.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file, the `path` attribute of the ring.
+    slot : int
+        The slot a batch was written to by :meth:`SharedMemoryRing.write`.
+        The arrays of the batch are at the offsets it returned.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        The bytes of the whole file. The slot is released once this array
+        and all views of it are garbage collected.
+
+    """
+    key, map_ = _map_shared_memory(path)
+    base = numpy.frombuffer(map_, dtype=numpy.uint8)
+    reference = weakref.ref(
+        base, lambda reference: _release_slot(key, map_, slot, reference))
+    _shared_memory_references[id(reference)] = reference
+    return base
+
+
+def remove_on_sigterm(ring):
+    """Remove the file of a ring before exiting on SIGTERM.
+
+    Processes that write to shared memory are usually stopped by
+    terminating them, which would otherwise leave the file behind.
+
+    Parameters
+    ----------
+    ring : :class:`SharedMemoryRing`
+        The ring whose file to remove.
+
+    """
+    def handler(signum, frame):
+        if ring.path is not None:
+            os.remove(ring.path)
+        os._exit(0)
+    signal.signal(signal.SIGTERM, handler)
@@ -54,7 +54,8 @@ setup(
     entry_points={
         'console_scripts': ['fuel-convert = fuel.bin.fuel_convert:main',
                             'fuel-download = fuel.bin.fuel_download:main',
-                            'fuel-info = fuel.bin.fuel_info:main']
+                            'fuel-info = fuel.bin.fuel_info:main',
+                            'fuel-server = fuel.bin.fuel_server:main']
     },
     #ext_modules=[Extension("fuel.transformers._image",
     #                       ["fuel/transformers/_image.c"],
@@ -7,7 +7,7 @@ from tempfile import NamedTemporaryFile
 import gzip
 
 import numpy
-from numpy.testing import assert_equal
+from numpy.testing import assert_equal, assert_raises
 
 from PIL import Image
 import six
@@ -27,6 +27,7 @@ from fuel.converters.ilsvrc2010 import (extract_patch_images,
                                         read_devkit,
                                         read_metadata_mat_file,
                                         train_set_producer,
+                                        train_set_work_units,
                                         DEVKIT_META_PATH,
                                         DEVKIT_ARCHIVE,
                                         TEST_GROUNDTRUTH)
@@ -432,6 +433,45 @@ def test_process_train_set():
     assert len(hdf5_file['targets'][:]) == len(all_jpegs)
 
 
+def test_process_train_set_multiple_producers():
+    tar_data, names, jpeg_names = create_fake_tar_of_tars(20150925, 5,
+                                                          min_num_images=45,
+                                                          max_num_images=55)
+    all_jpegs = numpy.array(sum(jpeg_names, []))
+    patches_data = create_fake_patch_images(filenames=all_jpegs[::7],
+                                            num_train=len(all_jpegs[::7]),
+                                            num_valid=0, num_test=0)
+    wnid_map = dict(zip((n.split('.')[0] for n in names), range(len(names))))
+    hdf5_files = []
+    for num_producers in (1, 3):
+        hdf5_file = MockH5PYFile()
+        prepare_hdf5_file(hdf5_file, len(all_jpegs), 0, 0)
+        process_train_set(hdf5_file, io.BytesIO(tar_data),
+                          io.BytesIO(patches_data), len(all_jpegs),
+                          wnid_map, shuffle_seed=1,
+                          num_producers=num_producers)
+        hdf5_files.append(hdf5_file)
+
+    for name in ('filenames', 'targets'):
+        assert_equal(hdf5_files[0][name][:], hdf5_files[1][name][:])
+    for first, second in zip(hdf5_files[0]['encoded_images'][:],
+                             hdf5_files[1]['encoded_images'][:]):
+        assert_equal(first, second)
+
+
+def test_train_set_work_units():
+    tar_data, names, jpeg_names = create_fake_tar_of_tars(20150925, 3,
+                                                          min_num_images=5,
+                                                          max_num_images=9)
+    patches = {jpeg_names[1][0]: b''}
+    work_units = train_set_work_units(io.BytesIO(tar_data), patches)
+    assert work_units == [
+        (name, sum(len(fns) for fns in jpeg_names[:i]))
+        for i, name in enumerate(names)]
+    assert_raises(ValueError, train_set_work_units, io.BytesIO(tar_data),
+                  {'missing.JPEG': b''})
+
+
 def test_process_other_set():
     images, all_filenames = create_fake_jpeg_tar(3, min_num_images=30,
                                                  max_num_images=40,
@@ -477,6 +517,7 @@ def test_train_set_producer():
     tar_data, names, jpeg_names = create_fake_tar_of_tars(20150923, 5,
                                                           min_num_images=45,
                                                           max_num_images=55)
+    position = 0
     for tar_name in names:
         with tarfile.open(fileobj=io.BytesIO(tar_data)) as outer_tar:
             with tarfile.open(fileobj=outer_tar.extractfile(tar_name)) as tar:
@@ -486,7 +527,9 @@ def test_train_set_producer():
                     assert metadata_msg['type'] == 'send_pyobj'
                     assert metadata_msg['flags'] == zmq.SNDMORE
                     key = tar_name.split('.')[0]
-                    assert metadata_msg['obj'] == (jpeg, wnid_map[key])
+                    assert metadata_msg['obj'] == (jpeg, wnid_map[key],
+                                                   position)
+                    position += 1
 
                     image_msg = socket.sent.popleft()
                     assert image_msg['type'] == 'send'
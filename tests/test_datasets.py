@@ -120,6 +120,13 @@ class TestIndexableDataset(object):
     def test_pickling(self):
         cPickle.loads(cPickle.dumps(IndexableDataset({'a': (1, 2)})))
 
+    def test_supports_slices(self):
+        assert IndexableDataset([1, 2, 3]).supports_slices
+        assert IndexableDataset(numpy.arange(3)).supports_slices
+        assert not IndexableDataset(
+            numpy.array([[1], [2, 3]], dtype=object)).supports_slices
+        assert not IndexableDataset(range(3)).supports_slices
+
     def test_batch_iteration_scheme_with_lists(self):
         """Batch schemes should work with more than ndarrays."""
         data = IndexableDataset(OrderedDict([('foo', list(range(50))),
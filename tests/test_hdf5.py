@@ -1,5 +1,8 @@
 import os
+import shutil
+import sys
 import tables
+import tempfile
 
 import h5py
 import numpy
@@ -8,7 +11,9 @@ from six.moves import range, cPickle
 
 from fuel.datasets.hdf5 import PytablesDataset, H5PYDataset
 from fuel.streams import DataStream
-from fuel.schemes import SequentialScheme
+from fuel.schemes import ConstantScheme, SequentialScheme
+from fuel.transformers import Batch, block_shuffled_stream
+from fuel.utils import LRUCache
 
 
 class TestPytablesDataset(object):
@@ -214,6 +219,104 @@ class TestH5PYDataset(object):
                      (self.features[request], self.targets[request]))
         dataset.close(handle)
 
+    def test_partially_in_memory(self):
+        dataset = H5PYDataset(
+            self.h5file, which_sets=('train',), load_in_memory=('targets',))
+        assert_equal(dataset.in_memory_sources, ('targets',))
+        assert dataset.data_sources[0] is None
+        assert_equal(dataset.data_sources[1], self.targets[:20])
+        handle = dataset.open()
+        for request in [slice(0, 10), [7, 2, 3], 4]:
+            assert_equal(dataset.get_data(handle, request),
+                         (self.features[:20][request],
+                          self.targets[:20][request]))
+        dataset.close(handle)
+
+    def test_in_memory_budget(self):
+        dataset = H5PYDataset(
+            self.h5file, which_sets=('train',), load_in_memory=100)
+        assert_equal(dataset.in_memory_sources, ('targets',))
+        dataset = H5PYDataset(
+            self.h5file, which_sets=('train',), load_in_memory=10)
+        assert_equal(dataset.in_memory_sources, ())
+        dataset = H5PYDataset(
+            self.h5file, which_sets=('train',), load_in_memory=2000)
+        assert_equal(dataset.in_memory_sources, ('features', 'targets'))
+
+    def test_partially_in_memory_vlen(self):
+        dataset = H5PYDataset(
+            self.vlen_h5file, which_sets=('train',),
+            load_in_memory=('features',))
+        handle = dataset.open()
+        features, targets = dataset.get_data(handle, slice(1, 3))
+        for val, truth in zip(features, self.vlen_features[1:3]):
+            assert_equal(val, truth)
+        assert_equal(targets, self.vlen_targets[1:3])
+        dataset.close(handle)
+
+    def test_example_cache(self):
+        # The size of an example includes its array objects
+        example_nbytes = (sys.getsizeof(self.features[0].copy()) +
+                          sys.getsizeof(self.targets[0].copy()) +
+                          LRUCache(0).item_overhead)
+        dataset = H5PYDataset(self.h5file, which_sets=('train',),
+                              cache_size=6.5 * example_nbytes)
+        handle = dataset.open()
+        for request in [[7, 2, 7], slice(0, 4), 3, [2, 9]]:
+            assert_equal(dataset.get_data(handle, request),
+                         (self.features[:20][request],
+                          self.targets[:20][request]))
+        cache = dataset.example_cache
+        # Only 6 examples fit
+        assert_equal((cache.hits, cache.misses), (3, 7))
+        assert_equal((len(cache), cache.nbytes), (6, 6 * example_nbytes))
+        assert_raises(ValueError, dataset.get_data, handle, slice(15, 25))
+        dataset.close(handle)
+
+    def test_example_cache_vlen(self):
+        dataset = H5PYDataset(self.vlen_h5file, which_sets=('train',),
+                              cache_size=10000)
+        handle = dataset.open()
+        for _ in range(2):
+            features, targets = dataset.get_data(handle, [3, 1])
+            for val, truth in zip(features, [self.vlen_features[3],
+                                             self.vlen_features[1]]):
+                assert_equal(val, truth)
+            assert_equal(targets, self.vlen_targets[[3, 1]])
+        features, targets = dataset.get_data(handle, 1)
+        assert_equal(features, self.vlen_features[1])
+        assert_equal((dataset.example_cache.hits,
+                      dataset.example_cache.misses), (3, 2))
+        dataset.close(handle)
+
+    def test_example_cache_returns_copies(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',),
+                              cache_size=10000)
+        handle = dataset.open()
+        for request in [3, [3, 4]]:
+            features, targets = dataset.get_data(handle, request)
+            features += 1
+            features, targets = dataset.get_data(handle, request)
+            assert_equal(features, self.features[request])
+        dataset.close(handle)
+
+    def test_example_cache_vlen_returns_copies(self):
+        dataset = H5PYDataset(self.vlen_h5file, which_sets=('train',),
+                              cache_size=10000)
+        handle = dataset.open()
+        features, targets = dataset.get_data(handle, 1)
+        features += 1
+        features, targets = dataset.get_data(handle, [1, 3])
+        features[0] += 1
+        features, targets = dataset.get_data(handle, 1)
+        assert_equal(features, self.vlen_features[1])
+        assert_equal(dataset.example_cache.hits, 2)
+        dataset.close(handle)
+
+    def test_value_error_on_unknown_in_memory_source(self):
+        assert_raises(ValueError, H5PYDataset, self.h5file,
+                      which_sets=('train',), load_in_memory=('labels',))
+
     def test_out_of_memory_sorted_indices(self):
         dataset = H5PYDataset(
             self.h5file, which_sets=('train',), load_in_memory=False,
@@ -246,6 +349,89 @@ class TestH5PYDataset(object):
         assert_equal(next(iter_), (self.features[0], self.targets[0]))
         assert_equal(next(iter_), (self.features[1], self.targets[1]))
 
+    def test_supports_slices(self):
+        assert H5PYDataset(self.h5file, which_sets=('train',)).supports_slices
+        assert not H5PYDataset(
+            self.vlen_h5file, which_sets=('train',)).supports_slices
+        assert H5PYDataset(self.vlen_h5file, which_sets=('train',),
+                           sources=('targets',)).supports_slices
+
+    def test_batch_of_example_stream(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',))
+        stream = Batch(dataset.get_example_stream(), ConstantScheme(7))
+        batches = list(stream.get_epoch_iterator())
+        assert_equal(len(batches), 3)
+        for i, (features, targets) in enumerate(batches):
+            assert_equal(features, self.features[7 * i:min(7 * i + 7, 20)])
+            assert_equal(targets, self.targets[7 * i:min(7 * i + 7, 20)])
+
+    def test_chunk_size(self):
+        assert H5PYDataset(self.h5file, which_sets=('train',)).chunk_size \
+            is None
+        h5file = h5py.File(
+            'chunked.hdf5', mode='w', driver='core', backing_store=False)
+        try:
+            h5file.create_dataset('features', data=self.features,
+                                  chunks=(8, 36))
+            h5file.create_dataset('targets', data=self.features[:, :1],
+                                  chunks=(16, 1))
+            h5file.attrs['split'] = H5PYDataset.create_split_array(
+                {'train': {'features': (0, 100), 'targets': (0, 100)}})
+            dataset = H5PYDataset(h5file, which_sets=('train',))
+            assert_equal(dataset.chunk_size, 16)
+            dataset = H5PYDataset(h5file, which_sets=('train',),
+                                  sources=('features',))
+            assert_equal(dataset.chunk_size, 8)
+        finally:
+            h5file.close()
+
+    def test_block_shuffled_stream(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('unlabeled',),
+                              sources=('features',))
+        stream = block_shuffled_stream(dataset, 8, block_size=5,
+                                       buffer_blocks=2)
+        batches = [batch for batch, in stream.get_epoch_iterator()]
+        assert_equal([len(batch) for batch in batches], [8] * 8 + [6])
+        features = numpy.concatenate(batches)
+        assert_equal(features[numpy.argsort(features[:, 0])],
+                     self.features[30:])
+        assert numpy.any(features[:-1, 0] > features[1:, 0])
+
+    def test_memory_map(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'file.hdf5')
+        try:
+            with h5py.File(path, mode='w') as h5file:
+                h5file['features'] = self.features
+                h5file.create_dataset('targets', data=self.features[:, :1],
+                                      chunks=(10, 1), compression='gzip')
+                h5file.attrs['split'] = H5PYDataset.create_split_array(
+                    {'train': {'features': (20, 100), 'targets': (20, 100)}})
+            dataset = H5PYDataset(path, which_sets=('train',),
+                                  memory_map=True)
+            handle = dataset.open()
+            features, targets = dataset.get_data(handle, slice(2, 6))
+            assert_equal(features, self.features[22:26])
+            assert_equal(targets, self.features[22:26, :1])
+            assert not features.flags.writeable
+            assert targets.flags.writeable
+            features, targets = dataset.get_data(handle, [7, 1, 3])
+            assert_equal(features, self.features[[27, 21, 23]])
+            assert_equal(targets, self.features[[27, 21, 23], :1])
+            dataset.close(handle)
+            assert path not in H5PYDataset._memory_maps
+        finally:
+            shutil.rmtree(directory)
+
+    def test_memory_map_ignores_external_file_handles(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',),
+                              memory_map=True)
+        handle = dataset.open()
+        features, targets = dataset.get_data(handle, slice(0, 10))
+        assert_equal(features, self.features[:10])
+        assert features.flags.writeable
+        dataset.close(handle)
+
     def test_value_error_on_unequal_sources(self):
         def get_subsets():
             return H5PYDataset(self.h5file, which_sets=('train',)).subsets
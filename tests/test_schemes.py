@@ -3,7 +3,9 @@ from numpy.testing import assert_raises
 
 from fuel.schemes import (ConstantScheme, SequentialExampleScheme,
                           SequentialScheme, ShuffledExampleScheme,
-                          ShuffledScheme, ConcatenatedScheme,
+                          ShuffledScheme, ShuffledBlockScheme,
+                          ConcatenatedScheme,
+                          PartitionedScheme,
                           cross_validation, BalancedSamplingScheme)
 
 
@@ -135,6 +137,19 @@ def test_balanced_sampling_scheme_indexed_examples():
     assert_raises(ValueError, BalancedSamplingScheme, targets, 200, 100)
 
 
+def test_shuffled_block_scheme():
+    get_request_iterator = iterator_requester(ShuffledBlockScheme)
+    blocks = [[0, 1, 2], [3, 4, 5], [6]]
+    rng = numpy.random.RandomState(3)
+    test_rng = numpy.random.RandomState(3)
+    test_rng.shuffle(blocks)
+    assert list(get_request_iterator(7, 3, rng=rng)) == blocks
+
+
+def test_shuffled_block_scheme_requests_batches():
+    assert not ShuffledBlockScheme(7, 3).requests_examples
+
+
 def test_shuffled_example_scheme():
     get_request_iterator = iterator_requester(ShuffledExampleScheme)
     indices = list(range(7))
@@ -245,3 +260,15 @@ def test_cross_validation():
     assert list(valid.get_request_iterator()) == [[4, 5], [6, 7]]
 
     assert_raises(StopIteration, next, cross)
+
+
+def test_partitioned_scheme():
+    schemes = [PartitionedScheme(SequentialScheme(10, 2), 3, i)
+               for i in range(3)]
+    assert ([list(scheme.get_request_iterator()) for scheme in schemes] ==
+            [[[0, 1], [6, 7]], [[2, 3], [8, 9]], [[4, 5]]])
+    assert not schemes[0].requests_examples
+
+
+def test_partitioned_scheme_raises_value_error_on_invalid_partition():
+    assert_raises(ValueError, PartitionedScheme, SequentialScheme(10, 2), 3, 3)
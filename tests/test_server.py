@@ -1,12 +1,22 @@
 from multiprocessing import Process
+import time
 
-from numpy.testing import assert_allclose, assert_raises
+import numpy
+import zmq
+try:
+    import asyncio
+except ImportError:
+    pass
+from numpy.testing import assert_allclose, assert_equal, assert_raises
 from six.moves import cPickle
 from nose.exc import SkipTest
 
-from fuel.datasets import MNIST
+from fuel.bin import fuel_server
+from fuel.datasets import IndexableDataset, MNIST
 from fuel.schemes import SequentialScheme
-from fuel.server import start_server
+from fuel.server import (LZ4_AVAILABLE, ServerStats, recv_message,
+                         send_arrays, start_dataset_server, start_server)
+from fuel.iterator import ASYNCIO_AVAILABLE
 from fuel.streams import DataStream, ServerDataStream
 
 
@@ -57,3 +67,382 @@ class TestServer(object):
 
     def test_reset(self):
         self.stream.reset()
+
+
+def get_indexable_stream():
+    return DataStream(
+        IndexableDataset(numpy.arange(100).reshape((50, 2))),
+        iteration_scheme=SequentialScheme(50, 5))
+
+
+class TestServerWorkers(object):
+    def setUp(self):
+        self.server_process = Process(
+            target=start_server, args=(get_indexable_stream(),),
+            kwargs={'port': 5560, 'num_workers': 3})
+        self.server_process.start()
+        self.stream = ServerDataStream(('features',), False, port=5560)
+
+    def tearDown(self):
+        self.server_process.terminate()
+        self.server_process.join()
+        self.stream = None
+
+    def test_each_example_served_once_per_epoch(self):
+        for _ in range(2):
+            batches = list(self.stream.get_epoch_iterator())
+            assert len(batches) == 10
+            assert_equal(
+                sorted(numpy.concatenate([b for b, in batches])[:, 0]),
+                numpy.arange(0, 100, 2))
+
+    def test_stats(self):
+        list(self.stream.get_epoch_iterator())
+        stats = self.stream.stats(reset=True)
+        assert stats['num_batches'] == 10
+        assert 0 <= stats['wait_time'] <= stats['elapsed_time']
+        assert self.stream.stats()['num_batches'] == 0
+
+    def test_ordered(self):
+        self.stream.ordered = True
+        expected_data = get_indexable_stream().get_epoch_iterator()
+        for (s,), (e,) in zip(self.stream.get_epoch_iterator(),
+                              expected_data):
+            assert_equal(s, e)
+        assert_raises(StopIteration, next, expected_data)
+
+
+class TestServerSharedMemory(object):
+    def setUp(self):
+        self.server_process = Process(
+            target=start_server, args=(get_indexable_stream(),),
+            kwargs={'port': 5561, 'hwm': 2, 'shared_memory': True})
+        self.server_process.start()
+        self.stream = ServerDataStream(('features',), False, port=5561,
+                                       hwm=2)
+
+    def tearDown(self):
+        self.server_process.terminate()
+        self.server_process.join()
+        self.stream = None
+
+    def test_server(self):
+        for _ in range(3):
+            expected_data = get_indexable_stream().get_epoch_iterator()
+            for (s,), (e,) in zip(self.stream.get_epoch_iterator(),
+                                  expected_data):
+                assert_equal(s, e)
+            assert_raises(StopIteration, next, expected_data)
+
+    def test_batches_are_read_only(self):
+        batch, = next(self.stream.get_epoch_iterator())
+        assert not batch.flags.writeable
+
+
+def check_compression(compression, shuffle):
+    context = zmq.Context()
+    try:
+        sender = context.socket(zmq.PAIR)
+        sender.bind('inproc://compression')
+        receiver = context.socket(zmq.PAIR)
+        receiver.connect('inproc://compression')
+        arrays = [numpy.linspace(0, 1, 60, dtype='float32').reshape((3, 20)),
+                  numpy.asfortranarray(numpy.arange(6).reshape((2, 3))),
+                  numpy.zeros((0, 4))]
+        send_arrays(sender, arrays, metadata={'epoch': 1},
+                    compression=compression, shuffle=shuffle)
+        metadata, received = recv_message(receiver)
+        assert metadata == {'epoch': 1}
+        for array, received_array in zip(arrays, received):
+            assert received_array.dtype == array.dtype
+            assert_equal(received_array, array)
+    finally:
+        context.destroy(linger=0)
+
+
+def test_send_arrays_header():
+    context = zmq.Context()
+    try:
+        sender = context.socket(zmq.PAIR)
+        sender.bind('inproc://header')
+        receiver = context.socket(zmq.PAIR)
+        receiver.connect('inproc://header')
+        arrays = [numpy.arange(12).reshape((3, 4)),
+                  numpy.ones((2, 2), dtype=[('a', 'f4'), ('b', 'i1')])]
+        for metadata, binary in [({'epoch': 1, 'index': 2}, True),
+                                 ({}, True),
+                                 ({'epoch': 1, 'name': 'train'}, False),
+                                 ({'valid': True}, False)]:
+            send_arrays(sender, arrays, metadata=metadata)
+            frames = receiver.recv_multipart()
+            # Only integer metadata is packed into a binary header
+            assert (frames[0][:1] == b'{') != binary
+            receiver.send_multipart(frames)
+            received_metadata, received = recv_message(sender)
+            assert received_metadata == metadata
+            for array, received_array in zip(arrays, received):
+                assert received_array.dtype == array.dtype
+                assert_equal(received_array, array)
+    finally:
+        context.destroy(linger=0)
+
+
+def test_server_stats():
+    stats = ServerStats()
+    stats.num_batches, stats.num_bytes = 10, 2000000
+    stats.load_time, stats.send_time, stats.blocked_time = 0.5, 0.25, 0.25
+    stats.start_time -= 1
+    report = stats.report()
+    assert '50% of the time loading' in report
+    assert '25% waiting for the client' in report
+    stats.reset()
+    assert stats.num_batches == 0
+
+
+def test_send_arrays_zlib_compression():
+    for shuffle in (False, True):
+        check_compression('zlib', shuffle)
+
+
+def test_send_arrays_lz4_compression():
+    if not LZ4_AVAILABLE:
+        raise SkipTest
+    for shuffle in (False, True):
+        check_compression('lz4', shuffle)
+
+
+def get_indexable_dataset():
+    return IndexableDataset(numpy.arange(10))
+
+
+def test_fuel_server_rejects_stream_options_for_datasets():
+    assert_raises(SystemExit, fuel_server.main,
+                  ['tests.test_server:get_indexable_dataset', '--hwm', '5'])
+
+
+def test_start_server_raises_value_error_on_unknown_compression():
+    assert_raises(ValueError, start_server, get_indexable_stream(),
+                  compression='foo')
+
+
+class TestServerCompression(object):
+    def setUp(self):
+        self.server_process = Process(
+            target=start_server, args=(get_indexable_stream(),),
+            kwargs={'port': 5562, 'compression': 'zlib', 'shuffle': True})
+        self.server_process.start()
+        self.stream = ServerDataStream(('features',), False, port=5562)
+
+    def tearDown(self):
+        self.server_process.terminate()
+        self.server_process.join()
+        self.stream = None
+
+    def test_server(self):
+        expected_data = get_indexable_stream().get_epoch_iterator()
+        for (s,), (e,) in zip(self.stream.get_epoch_iterator(),
+                              expected_data):
+            assert_equal(s, e)
+        assert_raises(StopIteration, next, expected_data)
+
+
+class TestServerPrefetch(object):
+    def setUp(self):
+        self.server_process = Process(
+            target=start_server, args=(get_indexable_stream(),),
+            kwargs={'port': 5563})
+        self.server_process.start()
+        self.stream = ServerDataStream(('features',), False, port=5563,
+                                       prefetch=3)
+
+    def tearDown(self):
+        self.server_process.terminate()
+        self.server_process.join()
+        self.stream.close()
+        self.stream = None
+
+    def test_server(self):
+        for _ in range(2):
+            expected_data = get_indexable_stream().get_epoch_iterator()
+            for (s,), (e,) in zip(self.stream.get_epoch_iterator(),
+                                  expected_data):
+                assert_equal(s, e)
+            assert_raises(StopIteration, next, expected_data)
+
+    def test_pickling(self):
+        next(self.stream.get_epoch_iterator())
+        stream = cPickle.loads(cPickle.dumps(self.stream))
+        assert stream._prefetcher is None
+        assert not stream.connected
+
+    def test_close(self):
+        prefetcher = self.stream._prefetcher
+        self.stream.close()
+        prefetcher.join()
+        assert not self.stream.connected
+
+
+class TestDatasetServer(object):
+    def setUp(self):
+        self.server_process = Process(
+            target=start_dataset_server,
+            args=(IndexableDataset(numpy.arange(100).reshape((50, 2))),),
+            kwargs={'port': 5564, 'num_workers': 2})
+        self.server_process.start()
+        self.stream = ServerDataStream(
+            ('features',), None, port=5564, prefetch=3,
+            iteration_scheme=SequentialScheme(50, 5))
+
+    def tearDown(self):
+        self.server_process.terminate()
+        self.server_process.join()
+        self.stream = None
+
+    def test_iteration_scheme(self):
+        assert not self.stream.produces_examples
+        for _ in range(2):
+            expected_data = get_indexable_stream().get_epoch_iterator()
+            for (s,), (e,) in zip(self.stream.get_epoch_iterator(),
+                                  expected_data):
+                assert_equal(s, e)
+            assert_raises(StopIteration, next, expected_data)
+
+    def test_random_access(self):
+        assert_equal(self.stream.get_data([7, 3])[0], [[14, 15], [6, 7]])
+        assert_equal(self.stream.get_data(slice(2, 4))[0],
+                     [[4, 5], [6, 7]])
+        assert_equal(self.stream.get_data(numpy.int64(1))[0], [2, 3])
+
+    def test_error(self):
+        assert_raises(RuntimeError, self.stream.get_data, [100])
+        assert_equal(self.stream.get_data([0])[0], [[0, 1]])
+
+    def test_value_error_without_request(self):
+        assert_raises(ValueError, self.stream.get_data)
+
+    def test_pickling(self):
+        iterator = self.stream.get_epoch_iterator()
+        next(iterator)
+        iterator = cPickle.loads(cPickle.dumps(iterator))
+        assert_equal(next(iterator)[0], [[10, 11], [12, 13], [14, 15],
+                                         [16, 17], [18, 19]])
+
+
+class TestServerFlowControl(object):
+    def setUp(self):
+        self.server_process = Process(
+            target=start_server, args=(get_indexable_stream(),),
+            kwargs={'port': 5565, 'max_bytes': 160})
+        self.server_process.start()
+
+    def tearDown(self):
+        self.server_process.terminate()
+        self.server_process.join()
+
+    def test_server(self):
+        stream = ServerDataStream(('features',), False, port=5565)
+        for _ in range(3):
+            expected_data = get_indexable_stream().get_epoch_iterator()
+            for (s,), (e,) in zip(stream.get_epoch_iterator(),
+                                  expected_data):
+                assert_equal(s, e)
+            assert_raises(StopIteration, next, expected_data)
+
+    def test_budget(self):
+        context = zmq.Context()
+        try:
+            socket = context.socket(zmq.PULL)
+            socket.set_hwm(1)
+            socket.connect('tcp://localhost:5565')
+            acks = context.socket(zmq.PUSH)
+            acks.connect('tcp://localhost:5566')
+            # Each batch is 80 bytes, so only two are sent before the
+            # first one is acknowledged
+            for _ in range(2):
+                metadata, _ = recv_message(socket)
+                assert metadata['nbytes'] == 80
+            assert not socket.poll(500)
+            acks.send(b'80')
+            assert socket.poll(5000)
+        finally:
+            context.destroy(linger=0)
+
+    def test_reconnect(self):
+        stream = ServerDataStream(('features',), False, port=5565)
+        iterator = stream.get_epoch_iterator()
+        assert_equal(next(iterator)[0], [[0, 1], [2, 3], [4, 5], [6, 7],
+                                         [8, 9]])
+        # The batches sent to the old connection are never acknowledged
+        stream.connect()
+        assert stream.socket.poll(5000)
+        assert len(list(stream.get_epoch_iterator())) > 0
+
+    def test_pickling(self):
+        stream = ServerDataStream(('features',), False, port=5565)
+        next(stream.get_epoch_iterator())
+        stream = cPickle.loads(cPickle.dumps(stream))
+        stream.connect()
+        assert stream.socket.poll(5000)
+
+
+def run_async_epoch(iterator, loop):
+    data = []
+    while True:
+        try:
+            data.append(loop.run_until_complete(iterator.__anext__()))
+        except StopAsyncIteration:  # noqa
+            return data
+
+
+class TestServerAsync(object):
+    def setUp(self):
+        if not ASYNCIO_AVAILABLE:
+            raise SkipTest('asyncio is not available')
+        self.server_process = Process(
+            target=start_server, args=(get_indexable_stream(),),
+            kwargs={'port': 5567})
+        self.server_process.start()
+        self.stream = ServerDataStream(('features',), False, port=5567)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        if self.stream.connected:
+            # Otherwise it reconnects to the next test's server and takes
+            # some of its batches
+            self.stream.socket.close(linger=0)
+        self.server_process.terminate()
+        self.server_process.join()
+
+    def test_aiter_epoch(self):
+        for _ in range(2):
+            epoch = self.stream.aiter_epoch(loop=self.loop)
+            expected_data = list(get_indexable_stream().get_epoch_iterator())
+            server_data = run_async_epoch(epoch, self.loop)
+            assert_equal(len(server_data), len(expected_data))
+            for (s,), (e,) in zip(server_data, expected_data):
+                assert_equal(s, e)
+
+    def test_aiter_epoch_with_queued_messages(self):
+        self.stream.connect()
+        assert self.stream.socket.poll(5000)
+        # Let the whole epoch arrive before the first await
+        time.sleep(0.5)
+        epoch = self.stream.aiter_epoch(loop=self.loop)
+        server_data = []
+        while True:
+            try:
+                server_data.append(self.loop.run_until_complete(
+                    asyncio.wait_for(epoch.__anext__(), 5)))
+            except StopAsyncIteration:  # noqa
+                break
+        expected_data = list(get_indexable_stream().get_epoch_iterator())
+        assert_equal(len(server_data), len(expected_data))
+        for (s,), (e,) in zip(server_data, expected_data):
+            assert_equal(s, e)
+
+    def test_aiter_epoch_as_dict(self):
+        epoch = self.stream.aiter_epoch(as_dict=True, loop=self.loop)
+        data = self.loop.run_until_complete(epoch.__anext__())
+        assert_equal(data['features'], [[0, 1], [2, 3], [4, 5], [6, 7],
+                                        [8, 9]])
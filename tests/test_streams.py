@@ -1,9 +1,20 @@
+import time
+
+import mock
 import numpy
+import zmq
+try:
+    import asyncio
+except ImportError:
+    pass
+from nose.exc import SkipTest
 from numpy.testing import assert_equal, assert_raises
 
 from fuel.datasets import IterableDataset, IndexableDataset
+from fuel.iterator import ASYNCIO_AVAILABLE
 from fuel.schemes import SequentialExampleScheme, SequentialScheme
-from fuel.streams import AbstractDataStream, DataStream
+from fuel.server import send_arrays
+from fuel.streams import AbstractDataStream, DataStream, _Prefetcher
 
 
 class DummyDataStream(AbstractDataStream):
@@ -63,3 +74,62 @@ class TestDataStream(object):
         stream = DataStream(self.dataset,
                             iteration_scheme=SequentialExampleScheme(2))
         assert stream.produces_examples
+
+    def test_aiter_epoch(self):
+        if not ASYNCIO_AVAILABLE:
+            raise SkipTest('asyncio is not available')
+        stream = DataStream(IndexableDataset([1, 2, 3]),
+                            iteration_scheme=SequentialScheme(3, 2))
+        loop = asyncio.new_event_loop()
+        try:
+            for as_dict in (False, True):
+                iterator = stream.aiter_epoch(as_dict=as_dict, loop=loop)
+                for expected in stream.get_epoch_iterator(as_dict=as_dict):
+                    data = loop.run_until_complete(iterator.__anext__())
+                    assert_equal(data, expected)
+                assert_raises(StopAsyncIteration,  # noqa
+                              loop.run_until_complete, iterator.__anext__())
+        finally:
+            loop.close()
+
+    @mock.patch('fuel.iterator.ASYNCIO_AVAILABLE', False)
+    def test_aiter_epoch_raises_import_error_without_asyncio(self):
+        stream = DataStream(IndexableDataset([1, 2, 3]),
+                            iteration_scheme=SequentialScheme(3, 2))
+        assert_raises(ImportError, stream.aiter_epoch)
+
+
+class TestPrefetcher(object):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.sender = self.context.socket(zmq.PAIR)
+        port = self.sender.bind_to_random_port('tcp://127.0.0.1')
+        receiver = self.context.socket(zmq.PAIR)
+        receiver.connect('tcp://127.0.0.1:{}'.format(port))
+        self.prefetcher = _Prefetcher(receiver, 1)
+        self.prefetcher.start()
+
+    def tearDown(self):
+        self.prefetcher.stop()
+        self.prefetcher.join()
+        self.context.destroy(linger=0)
+
+    def test_error_is_raised_by_every_get(self):
+        send_arrays(self.sender, [numpy.arange(3)])
+        self.sender.send(b'not a message')
+        assert_equal(self.prefetcher.get()[1], [numpy.arange(3)])
+        for _ in range(2):
+            assert_raises(ValueError, self.prefetcher.get)
+
+    def test_stop_when_error_cannot_be_queued(self):
+        # The first message fills the queue
+        send_arrays(self.sender, [numpy.arange(3)])
+        self.sender.send(b'not a message')
+        for _ in range(50):
+            if self.prefetcher.error is not None:
+                break
+            time.sleep(0.1)
+        assert isinstance(self.prefetcher.error, ValueError)
+        self.prefetcher.stop()
+        self.prefetcher.join(5)
+        assert not self.prefetcher.is_alive()
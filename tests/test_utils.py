@@ -1,18 +1,44 @@
 from functools import partial
+from multiprocessing import active_children
 import operator
 import os
 import shutil
 import tempfile
 import time
 
+import h5py
 import numpy
+import zmq
 from numpy.testing import assert_raises, assert_equal
 from six.moves import range, cPickle
 
 from fuel import config
+from fuel.datasets import IndexableDataset, IterableDataset
 from fuel.iterator import DataIterator
-from fuel.utils import do_not_pickle_attributes, find_in_data_path, Subset
-from fuel.utils.parallel import producer_consumer
+from fuel.schemes import ShuffledScheme
+from fuel.streams import DataStream
+from fuel.transformers import Mapping
+from fuel.utils import (do_not_pickle_attributes, find_in_data_path,
+                        LRUCache, Subset)
+from fuel.utils.parallel import (EpochReassembler, SeedSequence,
+                                 partition_stream, producer_consumer,
+                                 reseed_stream, split_work)
+from fuel.utils import shared_memory
+from fuel.utils.shared_memory import (SharedMemoryRing, read_shared_memory,
+                                      release_removed_maps)
+
+
+class RecordingIndexable(object):
+    """Records how an array is indexed."""
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.keys = []
+
+    def __getitem__(self, key):
+        self.keys.append(key)
+        return self.array[key]
 
 
 class TestSubset(object):
@@ -132,6 +158,51 @@ class TestSubset(object):
         assert_equal(Subset.sorted_fancy_indexing(indexable, [0, 5, 2]),
                      [0, 5, 2])
 
+    def test_safe_sorted_fancy_indexing_scattered(self):
+        indexable = numpy.arange(20).reshape((10, 2))
+        assert_equal(
+            Subset.sorted_fancy_indexing(indexable, [9, 0, 5],
+                                         max_gap_bytes=0),
+            indexable[[9, 0, 5]])
+
+    def test_safe_sorted_fancy_indexing_duplicates(self):
+        indexable = numpy.arange(20).reshape((10, 2))
+        assert_equal(
+            Subset.sorted_fancy_indexing(indexable, [5, 2, 5, 9, 2]),
+            indexable[[5, 2, 5, 9, 2]])
+
+    def test_safe_sorted_fancy_indexing_1d(self):
+        indexable = numpy.arange(100)
+        request = [70, 3, 1, 2, 40]
+        assert_equal(
+            Subset.sorted_fancy_indexing(indexable, request,
+                                         max_gap_bytes=indexable.itemsize),
+            indexable[request])
+
+    def test_safe_sorted_fancy_indexing_runs_and_isolated_indices(self):
+        indexable = RecordingIndexable(numpy.arange(200).reshape((100, 2)))
+        request = [50, 3, 90, 2, 5, 20, 51]
+        # Rows hold 2 integers, so the gap between 3 and 5 is one row
+        data = Subset.sorted_fancy_indexing(
+            indexable, request, max_gap_bytes=indexable.array[0].nbytes)
+        assert_equal(data, indexable.array[request])
+        keys = [key if isinstance(key, slice) else key[0].tolist()
+                for key in indexable.keys]
+        assert_equal(keys, [[20, 90], slice(2, 6), slice(50, 52)])
+
+    def test_safe_sorted_fancy_indexing_reads_runs(self):
+        h5file = h5py.File('file.hdf5', mode='w', driver='core',
+                           backing_store=False)
+        try:
+            indexable = numpy.arange(200).reshape((100, 2))
+            h5file['data'] = indexable
+            request = [41, 3, 99, 40, 2, 7, 3, 60]
+            assert_equal(
+                Subset.sorted_fancy_indexing(h5file['data'], request),
+                indexable[request])
+        finally:
+            h5file.close()
+
     def test_list_request_sanity_check_raises_error_on_empty_list(self):
         assert_raises(ValueError, Subset([0], 8)._list_request_sanity_check,
                       [], 1)
@@ -214,6 +285,47 @@ class NonLoadingClass(object):
         pass
 
 
+class TestLRUCache(object):
+    def setUp(self):
+        self.cache = LRUCache(10, item_overhead=0)
+        self.cache.put('a', 1, 4)
+        self.cache.put('b', 2, 4)
+
+    def test_get(self):
+        assert_equal(self.cache.get('a'), 1)
+        assert self.cache.get('c') is None
+        assert_equal((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.get('a')
+        self.cache.put('c', 3, 4)
+        assert 'a' in self.cache and 'c' in self.cache
+        assert 'b' not in self.cache
+        assert_equal(self.cache.nbytes, 8)
+
+    def test_replaces_item(self):
+        self.cache.put('a', 3, 6)
+        assert_equal(self.cache.get('a'), 3)
+        assert_equal((len(self.cache), self.cache.nbytes), (2, 10))
+
+    def test_skips_items_larger_than_cache(self):
+        self.cache.put('c', 3, 11)
+        assert 'c' not in self.cache
+        assert_equal(len(self.cache), 2)
+
+    def test_item_overhead(self):
+        cache = LRUCache(1000, item_overhead=300)
+        for key in range(4):
+            cache.put(key, key, 10)
+        assert_equal((len(cache), cache.nbytes), (3, 930))
+
+    def test_clear(self):
+        self.cache.get('a')
+        self.cache.clear()
+        assert_equal((len(self.cache), self.cache.nbytes, self.cache.hits),
+                     (0, 0, 0))
+
+
 class TestFindInDataPath(object):
     def setUp(self):
         self.tempdir = tempfile.mkdtemp()
@@ -286,3 +398,229 @@ def test_producer_consumer():
     assert (producer_consumer(partial(send_integers, n=2000),
                               receive_integers) ==
             sum(i ** 2 for i in range(2000)))
+
+
+def send_partition(socket, n, partition, num_partitions):
+    for i in range(partition, n, num_partitions):
+        socket.send_pyobj(i, zmq.SNDMORE)
+        socket.send_pyobj(i ** 2)
+
+
+def receive_partitions(socket, n):
+    received = {}
+    for _ in range(n):
+        i = socket.recv_pyobj()
+        received[i] = socket.recv_pyobj()
+    return received
+
+
+def test_producer_consumer_multiple_producers():
+    producers = [partial(send_partition, n=2000, partition=i,
+                         num_partitions=3) for i in range(3)]
+    assert (producer_consumer(producers,
+                              partial(receive_partitions, n=2000)) ==
+            dict((i, i ** 2) for i in range(2000)))
+
+
+def send_work_units(socket, work_units):
+    for i in work_units:
+        socket.send_pyobj(i, zmq.SNDMORE)
+        socket.send_pyobj(i ** 2)
+
+
+def test_producer_consumer_work_units():
+    assert (producer_consumer(send_work_units,
+                              partial(receive_partitions, n=2000),
+                              work_units=range(2000), num_producers=3) ==
+            dict((i, i ** 2) for i in range(2000)))
+    assert_raises(ValueError, producer_consumer,
+                  [send_work_units],
+                  partial(receive_partitions, n=10), work_units=range(10))
+
+
+def test_split_work():
+    assert split_work(range(7), 3) == [[0, 3, 6], [1, 4], [2, 5]]
+    assert split_work(range(2), 3) == [[0], [1]]
+    assert split_work([], 2) == []
+    assert_raises(ValueError, split_work, range(2), 0)
+
+
+def test_producer_consumer_terminates_producers_on_error():
+    def consumer(socket):
+        raise ValueError
+
+    children = set(active_children())
+    assert_raises(ValueError, producer_consumer,
+                  [partial(send_integers, n=2000)] * 2, consumer)
+    assert set(active_children()) == children
+
+
+def get_shuffled_stream():
+    return DataStream(IndexableDataset(numpy.arange(10)),
+                      iteration_scheme=ShuffledScheme(10, 3))
+
+
+def test_partition_stream():
+    streams = [get_shuffled_stream() for _ in range(2)]
+    for i, stream in enumerate(streams):
+        partition_stream(stream, 2, i)
+    for _ in range(2):
+        epochs = [numpy.concatenate([batch for batch, in
+                                     stream.get_epoch_iterator()])
+                  for stream in streams]
+        assert_equal(sorted(numpy.concatenate(epochs)), numpy.arange(10))
+
+
+def test_partition_stream_raises_value_error_without_scheme():
+    stream = DataStream(IterableDataset(numpy.arange(10)))
+    assert_raises(ValueError, partition_stream, stream, 2, 0)
+
+
+def test_reseed_stream():
+    def get_rngs(key):
+        stream = Mapping(get_shuffled_stream(), lambda data: data)
+        stream.rng = numpy.random.RandomState(1)
+        reseed_stream(stream, key)
+        return stream.rng, stream.data_stream.iteration_scheme.rng
+    (rng_0, scheme_rng_0), (rng_1, scheme_rng_1) = get_rngs(0), get_rngs(1)
+    assert rng_0.randint(1000, size=5).tolist() != \
+        rng_1.randint(1000, size=5).tolist()
+    assert_equal(get_rngs(0)[0].randint(1000, size=5),
+                 get_rngs(0)[0].randint(1000, size=5))
+    assert_equal(scheme_rng_0.randint(1000, size=5),
+                 scheme_rng_1.randint(1000, size=5))
+
+
+def test_reseed_stream_does_not_depend_on_draws_in_between():
+    stream = Mapping(get_shuffled_stream(), lambda data: data)
+    stream.rng = numpy.random.RandomState(1)
+    reseed_stream(stream, SeedSequence(spawn_key=(0, 0)))
+    first = stream.rng.randint(1000, size=5)
+    reseed_stream(stream, SeedSequence(spawn_key=(0, 1)))
+    assert stream.rng.randint(1000, size=5).tolist() != first.tolist()
+    reseed_stream(stream, SeedSequence(spawn_key=(0, 0)))
+    assert_equal(stream.rng.randint(1000, size=5), first)
+
+
+class TestSeedSequence(object):
+    def test_reproducible(self):
+        assert_equal(SeedSequence(3, (1, 2)).generate_state(),
+                     SeedSequence(3, (1, 2)).generate_state())
+
+    def test_spawn(self):
+        sequence = SeedSequence(3)
+        children = sequence.spawn(2) + sequence.spawn(1)
+        assert_equal([child.spawn_key for child in children],
+                     [(0,), (1,), (2,)])
+        states = [tuple(child.generate_state()) for child in children]
+        states.append(tuple(sequence.generate_state()))
+        assert len(set(states)) == 4
+
+    def test_trailing_zeros(self):
+        assert (SeedSequence(3).generate_state() !=
+                SeedSequence(3, (0,)).generate_state())
+
+    def test_random_state(self):
+        assert_equal(SeedSequence(3).random_state().randint(1000, size=5),
+                     SeedSequence(3).random_state().randint(1000, size=5))
+
+
+class TestEpochReassembler(object):
+    def test_holds_back_next_epoch(self):
+        reassembler = EpochReassembler(2, epoch=0)
+        reassembler.add(0, 0, 0, 'a')
+        reassembler.add(0, 0, None, None)
+        reassembler.add(1, 0, 0, 'c')
+        reassembler.add(0, 1, 1, 'b')
+        assert_equal([reassembler.pop(), reassembler.pop()], ['a', 'b'])
+        assert reassembler.pop() is None
+        assert not reassembler.epoch_finished()
+        reassembler.add(0, 1, None, None)
+        assert reassembler.epoch_finished()
+        reassembler.next_epoch()
+        assert_equal(reassembler.pop(), 'c')
+
+    def test_ordered(self):
+        reassembler = EpochReassembler(2, ordered=True)
+        reassembler.add(3, 1, 1, 'b')
+        assert reassembler.pop() is None
+        reassembler.add(3, 0, 0, 'a')
+        reassembler.add(3, 0, None, None)
+        reassembler.add(3, 1, 3, 'd')
+        # Index 2 was never read by the finished producer 0
+        assert_equal([reassembler.pop() for _ in range(3)],
+                     ['a', 'b', 'd'])
+
+    def test_drops_abandoned_epochs(self):
+        reassembler = EpochReassembler(1, epoch=0)
+        reassembler.add(0, 0, 0, 'a')
+        reassembler.next_epoch()
+        reassembler.add(0, 0, 1, 'b')
+        assert reassembler.pop() is None
+        assert_equal(reassembler.epoch, 1)
+
+
+def is_mapped(path):
+    return any(key[0] == path for key in shared_memory._shared_memory_maps)
+
+
+class TestSharedMemoryRing(object):
+    def setUp(self):
+        self.ring = SharedMemoryRing(3)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_write_read(self):
+        arrays = [numpy.arange(6).reshape((2, 3)), numpy.ones(5)]
+        slot, offsets = self.ring.write(arrays)
+        base = read_shared_memory(self.ring.path, slot)
+        for array, offset in zip(arrays, offsets):
+            read = base[offset:offset + array.nbytes].view(array.dtype)
+            assert_equal(read.reshape(array.shape), array)
+
+    def test_reuses_lowest_free_slot(self):
+        arrays = [numpy.arange(4)]
+        slots = [self.ring.write(arrays)[0] for _ in range(2)]
+        assert_equal(slots, [0, 1])
+        # Reading slot 0 and dropping the result releases it
+        read_shared_memory(self.ring.path, 0)
+        assert_equal(self.ring.write(arrays)[0], 0)
+        assert_equal(self.ring.write(arrays)[0], 2)
+        assert_equal(self.ring.write(arrays), (None, None))
+
+    def test_larger_batches_do_not_fit(self):
+        self.ring.write([numpy.arange(4)])
+        assert_equal(self.ring.write([numpy.arange(100)]), (None, None))
+
+    def test_drops_maps_of_removed_files(self):
+        slot, _ = self.ring.write([numpy.arange(4)])
+        path = self.ring.path
+        base = read_shared_memory(path, slot)
+        self.ring.close()
+        # Kept while a batch uses it
+        release_removed_maps()
+        assert is_mapped(path)
+        del base
+        assert not is_mapped(path)
+
+    def test_keeps_maps_of_files_in_use(self):
+        slot, _ = self.ring.write([numpy.arange(4)])
+        read_shared_memory(self.ring.path, slot)
+        release_removed_maps()
+        assert is_mapped(self.ring.path)
+
+    def test_does_not_reuse_maps_of_removed_files(self):
+        slot, (offset,) = self.ring.write([numpy.arange(8, dtype='uint8')])
+        path = self.ring.path
+        base = read_shared_memory(path, slot)
+        self.ring.close()
+        # Another file that happens to get the same path
+        with open(path, 'wb') as f:
+            f.write(numpy.zeros(offset + 8, dtype='uint8').tobytes())
+        try:
+            new_base = read_shared_memory(path, slot)
+            assert_equal(new_base[offset:offset + 8], numpy.zeros(8))
+            assert_equal(base[offset:offset + 8], numpy.arange(8))
+        finally:
+            os.remove(path)
@@ -8,8 +8,10 @@ from six.moves import zip
 from fuel.transformers._image import window_batch_bchw3d
 from fuel import config
 from fuel.datasets.base import IndexableDataset, IterableDataset
-from fuel.schemes import ShuffledScheme, SequentialExampleScheme
+from fuel.schemes import (ShuffledScheme, SequentialExampleScheme,
+                          SequentialScheme)
 from fuel.streams import DataStream
+from fuel.transformers import MultiProcessing
 from fuel.transformers.image import (ImagesFromBytes, Image2DSlicer,
                                      MinimumImageDimensions,
                                      RandomFixedSizeCrop,
@@ -148,6 +150,20 @@ class TestImagesFromBytes(ImageTestingMixin):
         assert_raises(TypeError, stream.transform_source_example, 54321,
                       'source2')
 
+    def test_parallel(self):
+        stream, parallel_stream = [
+            ImagesFromBytes(
+                DataStream(self.dataset,
+                           iteration_scheme=SequentialScheme(3, 2)),
+                color_mode=None, parallel=parallel)
+            for parallel in (None, 2)]
+        for batch, parallel_batch in zip(stream.get_epoch_iterator(),
+                                         parallel_stream.get_epoch_iterator()):
+            for source, parallel_source in zip(batch, parallel_batch):
+                assert isinstance(parallel_source, list)
+                for image, parallel_image in zip(source, parallel_source):
+                    assert_equal(image, parallel_image)
+
 
 class TestMinimumDimensions(ImageTestingMixin):
     def setUp(self):
@@ -613,6 +629,22 @@ class TestRandomSpatialFlip(ImageTestingMixin):
                             err_msg="Mismatch flip both")
             for ex_result, ex_expected in zip(result, expected))
 
+    def test_parallel(self):
+        for source, source_name in ((self.source_list, 'source_list'),
+                                    (self.source_ndobject, 'source_ndobject')):
+            results = []
+            for parallel in (None, 2):
+                stream = RandomSpatialFlip(
+                    self.example_stream, flip_h=True, flip_v=True,
+                    which_sources=(source_name,), parallel=parallel,
+                    rng=numpy.random.RandomState(10))
+                results.append(
+                    [stream.transform_source_batch(source, source_name)
+                     for _ in range(4)])
+            for batch, parallel_batch in zip(*results):
+                for example, parallel_example in zip(batch, parallel_batch):
+                    assert_equal(example, parallel_example)
+
     def test_ndobject_batch_source(self):
 
         source = self.source_ndobject
@@ -954,6 +986,22 @@ class TestSamplewiseCropTransformer(object):
             offsets[1]:offsets[1] + swctransformer.window_shape[1]]
         assert_allclose(result, expected)
 
+    def test_workers_crop_differently(self):
+        volumes = numpy.tile(numpy.arange(1000, dtype=numpy.float32),
+                             (8, 1)).reshape((8, 1, 10, 10, 10))
+        stream = DataStream(IndexableDataset(volumes),
+                            iteration_scheme=SequentialScheme(8, 1))
+        swctransformer = SamplewiseCropTransformer(stream, self.window_shape)
+        background = MultiProcessing(swctransformer, num_workers=2,
+                                     ordered=True)
+        try:
+            crops = [crop for crop, in background.get_epoch_iterator()]
+        finally:
+            background.close()
+        # The batches are dealt out to the workers in turn
+        assert any((first != second).any()
+                   for first, second in zip(crops[::2], crops[1::2]))
+
 
 class TestFixedSizeCrop(ImageTestingMixin):
     def setUp(self):
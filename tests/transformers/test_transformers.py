@@ -1,9 +1,14 @@
+import glob
 import logging
 import operator
+import os
+import time
 import warnings
 from collections import OrderedDict
+from multiprocessing import Process, Queue
 
 import numpy
+from nose.exc import SkipTest
 from numpy.testing import assert_raises, assert_equal
 from six.moves import zip, cPickle
 from picklable_itertools import izip
@@ -15,9 +20,10 @@ from fuel.schemes import (ConstantScheme, SequentialScheme,
 from fuel.streams import DataStream
 from fuel.transformers import (
     ExpectsAxisLabels, Transformer, Mapping, SortMapping, ForceFloatX, Filter,
-    Cache, Batch, Padding, MultiProcessing, Unpack, Merge,
+    Cache, BlockShuffle, Batch, Padding, MultiProcessing, Unpack, Merge,
     SourcewiseTransformer, Flatten, ScaleAndShift, Cast, Rename,
-    FilterSources, OneHotEncoding, Duplicate, StructuredOneHotEncoding)
+    FilterSources, OneHotEncoding, Duplicate, StructuredOneHotEncoding,
+    ThreadedTransformer, BackgroundProcess)
 from fuel.transformers.defaults import ToBytes
 
 
@@ -162,6 +168,27 @@ class TestSourcewiseTransformer(object):
             NotImplementedError, transformer.transform_source_batch,
             None, 'foo')
 
+    def test_map_examples_after_fork(self):
+        transformer = SourcewiseTransformer(
+            DataStream(IterableDataset([1, 2])), True, parallel=2)
+        # Keep both threads of the pool busy, so that they both get started
+        assert_equal(transformer.map_examples(
+            lambda x: time.sleep(0.05) or abs(x), [-1, -2, -3, -4]),
+            [1, 2, 3, 4])
+
+        def map_in_child(queue):
+            queue.put(transformer.map_examples(abs, [-5]))
+
+        queue = Queue()
+        process = Process(target=map_in_child, args=(queue,))
+        process.start()
+        try:
+            assert_equal(queue.get(timeout=10), [5])
+        finally:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+
 
 class TestFlatten(object):
     def setUp(self):
@@ -360,6 +387,42 @@ class TestCache(object):
         assert_equal(cached_stream.axis_labels, self.stream.axis_labels)
 
 
+class TestBlockShuffle(object):
+    def setUp(self):
+        self.stream = DataStream(
+            IndexableDataset(numpy.arange(100)),
+            iteration_scheme=SequentialScheme(100, 10))
+
+    def test_returns_every_example_once(self):
+        stream = BlockShuffle(self.stream, ConstantScheme(7),
+                              buffer_blocks=3)
+        for _ in range(2):
+            batches = [batch for batch, in stream.get_epoch_iterator()]
+            assert_equal([len(batch) for batch in batches],
+                         [7] * 14 + [2])
+            assert_equal(sorted(numpy.concatenate(batches)), list(range(100)))
+
+    def test_mixes_examples_of_buffered_blocks(self):
+        stream = BlockShuffle(self.stream, ConstantScheme(10),
+                              buffer_blocks=2)
+        batch, = next(stream.get_epoch_iterator())
+        assert numpy.all(batch < 20)
+        assert numpy.any(batch < 10) and numpy.any(batch >= 10)
+
+    def test_value_error_on_example_stream(self):
+        stream = DataStream(IterableDataset(range(10)))
+        assert_raises(ValueError, BlockShuffle, stream, ConstantScheme(2))
+
+    def test_value_error_on_non_batchsizescheme(self):
+        assert_raises(ValueError, BlockShuffle, self.stream,
+                      SequentialScheme(4, 2))
+
+    def test_value_error_on_none_request(self):
+        stream = BlockShuffle(self.stream, ConstantScheme(7))
+        stream.get_epoch_iterator()
+        assert_raises(ValueError, stream.get_data, None)
+
+
 class TestBatch(object):
     def test_strictness_0(self):
         stream = DataStream(IterableDataset([1, 2, 3, 4, 5]))
@@ -408,6 +471,90 @@ class TestBatch(object):
         stream = DataStream(IterableDataset([1, 2, 3, 4]))
         assert_raises(ValueError, Batch, stream, SequentialExampleScheme(4))
 
+    def test_recycle_buffers(self):
+        features = numpy.arange(14).reshape((7, 2))
+        stream = DataStream(IterableDataset(
+            OrderedDict([('features', features), ('targets', range(7))])))
+        transformer = Batch(stream, ConstantScheme(3), recycle_buffers=2)
+        for _ in range(2):
+            batches = []
+            for batch in transformer.get_epoch_iterator():
+                assert_equal(batch, (features[3 * len(batches):][:3],
+                                     numpy.arange(7)[3 * len(batches):][:3]))
+                batches.append(batch)
+        assert not numpy.may_share_memory(batches[0][0], batches[1][0])
+        assert numpy.may_share_memory(batches[0][0], batches[2][0])
+
+    def test_recycle_buffers_falls_back_to_lists(self):
+        stream = DataStream(IterableDataset([1, 2, 3, 4.5, 5, 6]))
+        transformer = Batch(stream, ConstantScheme(2), recycle_buffers=1)
+        assert_equal(list(transformer.get_epoch_iterator()),
+                     [(numpy.array([1, 2]),), (numpy.array([3, 4.5]),),
+                      (numpy.array([5, 6]),)])
+        assert transformer._example_specs == [None]
+
+    def test_recycle_buffers_pickling(self):
+        stream = DataStream(IterableDataset(numpy.arange(6)))
+        transformer = Batch(stream, ConstantScheme(2), recycle_buffers=1)
+        epoch = transformer.get_epoch_iterator()
+        next(epoch)
+        next(epoch)
+        epoch = cPickle.loads(cPickle.dumps(epoch))
+        assert_equal(next(epoch), (numpy.array([4, 5]),))
+
+    def test_reads_slices_of_example_streams(self):
+        class CountingDataset(IndexableDataset):
+            requests = []
+
+            def get_data(self, state=None, request=None):
+                self.requests.append(request)
+                return super(CountingDataset, self).get_data(state, request)
+
+        features = numpy.arange(10).reshape((5, 2))
+        dataset = CountingDataset(features)
+        for strictness, expected in [(0, [[0, 1], [2, 3], [4]]),
+                                     (1, [[0, 1], [2, 3]])]:
+            dataset.requests[:] = []
+            transformer = Batch(dataset.get_example_stream(),
+                                ConstantScheme(2), strictness=strictness)
+            batches = [batch for batch, in transformer.get_epoch_iterator()]
+            assert_equal(batches, [features[indices] for indices in expected])
+            assert all(isinstance(request, slice)
+                       for request in dataset.requests)
+            assert not numpy.may_share_memory(batches[0], features)
+        transformer = Batch(dataset.get_example_stream(), ConstantScheme(2),
+                            strictness=2)
+        assert_raises(ValueError, list, transformer.get_epoch_iterator())
+
+    def test_reads_slices_into_recycled_buffers(self):
+        features = numpy.arange(14).reshape((7, 2))
+        stream = IndexableDataset(
+            OrderedDict([('features', features),
+                         ('targets', list(range(7)))])).get_example_stream()
+        transformer = Batch(stream, ConstantScheme(3), recycle_buffers=2)
+        for _ in range(2):
+            batches = []
+            for batch in transformer.get_epoch_iterator():
+                assert_equal(batch, (features[3 * len(batches):][:3],
+                                     numpy.arange(7)[3 * len(batches):][:3]))
+                batches.append(batch)
+        assert not numpy.may_share_memory(batches[0][0], features)
+        assert not numpy.may_share_memory(batches[0][0], batches[1][0])
+        assert numpy.may_share_memory(batches[0][0], batches[2][0])
+
+    def test_reads_examples_of_unordered_example_streams(self):
+        stream = DataStream(IndexableDataset(numpy.arange(5)),
+                            iteration_scheme=SequentialExampleScheme(
+                                [4, 0, 2]))
+        transformer = Batch(stream, ConstantScheme(2))
+        assert_equal(list(transformer.get_epoch_iterator()),
+                     [(numpy.array([4, 0]),), (numpy.array([2]),)])
+
+    def test_value_error_on_recycle_buffers_zero(self):
+        stream = DataStream(IterableDataset([1, 2, 3, 4]))
+        assert_raises(ValueError, Batch, stream, ConstantScheme(2),
+                      recycle_buffers=0)
+
 
 class TestUnpack(object):
     def setUp(self):
@@ -637,6 +784,156 @@ class TestMultiprocessing(object):
         assert_equal(background.axis_labels, self.transformer.axis_labels)
 
 
+class AddRandomOffset(Transformer):
+    def __init__(self, data_stream):
+        super(AddRandomOffset, self).__init__(
+            data_stream, data_stream.produces_examples)
+        self.rng = numpy.random.RandomState(config.default_seed)
+
+    def transform_batch(self, batch):
+        return (batch[0] + self.rng.randint(1000),)
+
+
+class TestMultiprocessingWorkers(object):
+    def setUp(self):
+        stream = DataStream(
+            IndexableDataset(numpy.arange(100)),
+            iteration_scheme=SequentialScheme(100, 7))
+        self.transformer = Mapping(stream, lambda x: (x[0] + 1,))
+
+    def test_workers(self):
+        background = MultiProcessing(self.transformer, num_workers=3)
+        for _ in range(2):
+            batches = [batch for batch, in background.get_epoch_iterator()]
+            assert_equal(len(batches), 15)
+            assert_equal(numpy.sort(numpy.concatenate(batches)),
+                         numpy.arange(1, 101))
+
+    def test_ordered(self):
+        background = MultiProcessing(self.transformer, num_workers=3,
+                                     ordered=True)
+        for _ in range(2):
+            assert_equal(
+                list(background.get_epoch_iterator()),
+                list(self.transformer.get_epoch_iterator()))
+
+    def test_shared_memory(self):
+        background = MultiProcessing(self.transformer, max_store=2,
+                                     num_workers=3, ordered=True,
+                                     shared_memory=True)
+        # Holding on to all batches uses up the slots, after which batches
+        # are pickled instead
+        batches = list(background.get_epoch_iterator())
+        assert not batches[0][0].flags.writeable
+        assert_equal(batches, list(self.transformer.get_epoch_iterator()))
+        del batches
+        assert_equal(list(background.get_epoch_iterator()),
+                     list(self.transformer.get_epoch_iterator()))
+
+    def test_value_error_on_no_workers(self):
+        assert_raises(ValueError, MultiProcessing, self.transformer,
+                      num_workers=0)
+
+    def test_abandoned_epoch(self):
+        background = MultiProcessing(self.transformer, num_workers=3,
+                                     ordered=True)
+        expected = list(self.transformer.get_epoch_iterator())
+        for _ in range(3):
+            assert_equal(next(background.get_epoch_iterator()), expected[0])
+        background.next_epoch()
+        assert_equal(list(background.get_epoch_iterator()), expected)
+
+    def test_reseeding(self):
+        def get_epochs():
+            background = MultiProcessing(
+                AddRandomOffset(self.transformer.data_stream), num_workers=2,
+                ordered=True)
+            epochs = [[batch for batch, in background.get_epoch_iterator()]
+                      for _ in range(2)]
+            background.close()
+            return [numpy.concatenate(epoch) for epoch in epochs]
+        epochs = get_epochs()
+        assert_equal(epochs, get_epochs())
+        assert not numpy.array_equal(epochs[0], epochs[1])
+        # The first two batches are read by different workers
+        offsets = epochs[0] - numpy.arange(100)
+        assert offsets[0] != offsets[7]
+
+    def test_close(self):
+        background = MultiProcessing(self.transformer, num_workers=3)
+        background.close()
+        assert not any(proc.is_alive() for proc in background.procs)
+
+
+def _fail_on_third_batch(data):
+    if data[0][0] == 14:
+        raise ValueError('third batch')
+    return data
+
+
+def test_multiprocessing_raises_runtime_error_on_failure():
+    stream = Mapping(
+        DataStream(IndexableDataset(numpy.arange(100)),
+                   iteration_scheme=SequentialScheme(100, 7)),
+        _fail_on_third_batch)
+    background = MultiProcessing(stream)
+    iterator = background.get_epoch_iterator()
+    next(iterator)
+    next(iterator)
+    assert_raises(RuntimeError, next, iterator)
+
+
+def test_background_process_removes_shared_memory_on_failure():
+    if not os.path.isdir('/dev/shm'):
+        raise SkipTest('shared memory files are not in /dev/shm')
+    stream = Mapping(
+        DataStream(IndexableDataset(numpy.arange(100)),
+                   iteration_scheme=SequentialScheme(100, 7)),
+        _fail_on_third_batch)
+    background = BackgroundProcess(stream, 5, shared_memory=True)
+    before = set(glob.glob('/dev/shm/fuel-*'))
+    process = Process(target=background.main)
+    process.start()
+    process.join()
+    assert set(glob.glob('/dev/shm/fuel-*')) <= before
+
+
+class TestThreadedTransformer(object):
+    def setUp(self):
+        self.stream = DataStream(
+            IndexableDataset(OrderedDict([('features', numpy.arange(100)),
+                                          ('targets', numpy.arange(100))])),
+            iteration_scheme=SequentialScheme(100, 7))
+        self.transformer = ScaleAndShift(self.stream, 2, 1,
+                                         which_sources=('features',))
+
+    def test_threaded_transformer(self):
+        threaded = ThreadedTransformer(self.transformer, num_threads=3)
+        for _ in range(2):
+            assert_equal(list(threaded.get_epoch_iterator()),
+                         list(self.transformer.get_epoch_iterator()))
+        threaded.close()
+
+    def test_mapping(self):
+        mapping = Mapping(self.stream, lambda data: (data[0] + 1,),
+                          add_sources=('plus_one',))
+        threaded = ThreadedTransformer(mapping)
+        assert_equal(threaded.sources, ('features', 'targets', 'plus_one'))
+        assert_equal(list(threaded.get_epoch_iterator()),
+                     list(mapping.get_epoch_iterator()))
+
+    def test_pickling(self):
+        threaded = ThreadedTransformer(self.transformer)
+        iterator = threaded.get_epoch_iterator()
+        next(iterator)
+        threaded = cPickle.loads(cPickle.dumps(threaded))
+        assert_equal(len(list(threaded.get_epoch_iterator())), 15)
+
+    def test_value_error_on_get_data_override(self):
+        assert_raises(ValueError, ThreadedTransformer,
+                      Cache(self.stream, ConstantScheme(7)))
+
+
 class TestRename(object):
     def setUp(self):
         self.stream = DataStream(